@@ -8,9 +8,29 @@ from datetime import datetime, timedelta
 from io import BytesIO
 import matplotlib.pyplot as plt
 import uuid
+import time
+from contextlib import contextmanager
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+import mcu_analytics
+import mcu_archive
+import mcu_changelog
+import mcu_compliance
+import mcu_export
+import mcu_governor
+import mcu_logging
+import mcu_manifest
+import mcu_pack
+import mcu_profile
+import mcu_projection
+import mcu_replica
+import mcu_renditions
+import mcu_risk
+import mcu_schedule
+import mcu_sites
+from mcu_db import init_write_version
+from mcu_export import get_github_mcu_url
 
 st.set_page_config(
     page_title="MCU CITSECH",
@@ -41,13 +61,10 @@ st.markdown("""
 
 LOG_FILE = "database/app.log"
 os.makedirs("database", exist_ok=True)
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
-                    format="%(asctime)s - %(levelname)s - %(message)s")
+# JSON lines lewat QueueHandler/QueueListener, rotasi per ukuran + harian, file lama di-gzip
+mcu_logging.setup_logging(LOG_FILE)
 
-# ======== SETTING REPO GITHUB UNTUK LINK MCU PDF =========
-GITHUB_OWNER = "Maliqa"
-GITHUB_REPO = "mcu-history"
-GITHUB_BRANCH = "main"
+# Setting repo GitHub untuk link MCU PDF ada di mcu_export.py (GITHUB_OWNER/REPO/BRANCH)
 
 # ============== Utilities (safe rerun etc.) ==============
 def safe_rerun():
@@ -70,6 +87,12 @@ def safe_rerun():
         st.stop()
 
 # ============== LOGIN FORM ==============
+# User yang boleh mengubah konfigurasi server (mis. daftar site = path database), pisahkan dengan koma
+ADMIN_USERS = {u.strip().upper() for u in os.environ.get("MCU_ADMIN_USERS", "").split(",") if u.strip()}
+
+def is_admin():
+    return st.session_state.get("username") in ADMIN_USERS
+
 def login_form():
     """
     Display login form and set session_state['logged_in'] on success.
@@ -153,6 +176,21 @@ def init_db():
         )
         ''')
         conn.commit()
+        mcu_manifest.init_manifest_tables(conn)
+        mcu_pack.init_pack_tables(conn)
+        init_write_version(conn)
+        mcu_changelog.init_changelog(conn)
+        mcu_analytics.init_analytics_indexes(conn)
+        mcu_risk.init_risk_tables(conn)
+        mcu_sites.init_site_tables(conn)
+        mcu_archive.init_archive_tables(conn)
+        mcu_projection.init_latest_mcu_projection(conn)
+        if mcu_manifest.backfill_pending(conn):
+            # Hash semua upload lama di background, bukan di page load
+            mcu_manifest.start_background_backfill()
+        mcu_compliance.init_compliance_tables(conn)
+        mcu_schedule.init_schedule_tables(conn)
+        mcu_profile.init_profile_tables(conn)
         conn.close()
     except Exception as e:
         logging.error(f"Error initializing DB: {e}")
@@ -219,6 +257,26 @@ def determine_mcu_status(employment_status, mcu_expired):
         return "Pre Employee"
 
 
+# ======== RESOURCE GOVERNOR =========
+@contextmanager
+def governed(pool, cost, what):
+    """
+    Run the block once mcu_governor admits `cost` bytes in `pool`, showing
+    the queue position while it waits. Raises mcu_governor.AdmissionTimeout
+    if the server stays busy.
+    """
+    placeholder = st.empty()
+
+    def _on_wait(position):
+        placeholder.info(f"⏳ Server sedang sibuk, {what} menunggu giliran (antrian ke-{position})...")
+
+    try:
+        with mcu_governor.admit(pool, cost, on_wait=_on_wait):
+            placeholder.empty()
+            yield
+    finally:
+        placeholder.empty()
+
 def save_uploaded_file(uploaded_file, nik, year):
     """
     Save uploaded file locally. Returns file_name on success.
@@ -248,10 +306,15 @@ def save_uploaded_file(uploaded_file, nik, year):
         os.makedirs(file_dir, exist_ok=True)
         file_path = os.path.join(file_dir, file_name)
         try:
-            with open(file_path, "wb") as f:
-                f.write(data)
+            # Streamlit sudah menyimpan file di memori; pool upload membatasi penulisan ke disk yang berjalan bersamaan
+            with governed("upload", len(data), "upload"):
+                with open(file_path, "wb") as f:
+                    f.write(data)
             logging.info(f"Saved uploaded file to {file_path}")
             return file_name
+        except mcu_governor.AdmissionTimeout:
+            st.error("❌ Server sedang sibuk, silakan upload ulang beberapa saat lagi.")
+            return None
         except Exception as e:
             st.error("❌ Failed to save file!")
             logging.error(f"File upload error: {e}")
@@ -272,14 +335,17 @@ def validate_dates(birth_date, hire_date, mcu_date):
     # implement validation if needed, return error string or None
     return None
 
-def get_github_mcu_url(nik, file_name):
-    return f"https://github.com/{GITHUB_OWNER}/{GITHUB_REPO}/blob/{GITHUB_BRANCH}/mcu_files/{nik}/{file_name}?raw=true"
-
-def get_mcu_history_db(nik):
+def get_mcu_history_db(nik, full=False):
+    """
+    MCU history of one employee, newest first. Only hot rows by default;
+    full=True also reads the rows moved to the archive (mcu_archive).
+    """
     try:
-        conn = sqlite3.connect("database/mcu_database.db")
-        df = pd.read_sql("SELECT * FROM mcu_history WHERE nik=? ORDER BY mcu_year DESC", conn, params=(nik,))
-        conn.close()
+        with mcu_logging.timed("get_mcu_history", nik=nik, full=full) as log:
+            conn = sqlite3.connect("database/mcu_database.db")
+            df = mcu_archive.get_history(conn, nik, full=full)
+            conn.close()
+            log["rows"] = len(df)
         return df
     except Exception as e:
         logging.error(f"Error get MCU history: {e}")
@@ -287,60 +353,79 @@ def get_mcu_history_db(nik):
 
 def add_mcu_history(nik, mcu_year, mcu_date, expired_date, file_name, diagnosis, recommendation):
     try:
-        conn = sqlite3.connect("database/mcu_database.db")
-        cursor = conn.cursor()
-        cursor.execute('''
-        INSERT INTO mcu_history (nik, mcu_year, mcu_date, expired_date, file_name, diagnosis, recommendation)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (nik, mcu_year, mcu_date, expired_date, file_name, diagnosis, recommendation))
-        conn.commit()
-        conn.close()
+        with mcu_logging.timed("add_mcu_history", nik=nik, rows=1):
+            conn = sqlite3.connect("database/mcu_database.db")
+            cursor = conn.cursor()
+            cursor.execute('''
+            INSERT INTO mcu_history (nik, mcu_year, mcu_date, expired_date, file_name, diagnosis, recommendation)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (nik, mcu_year, mcu_date, expired_date, file_name, diagnosis, recommendation))
+            if file_name:
+                try:
+                    mcu_manifest.register_file(conn, nik, file_name, cursor.lastrowid)
+                except Exception as e:
+                    logging.warning(f"Failed to register {file_name} for {nik} in manifest: {e}")
+            conn.commit()
+            conn.close()
         return True
     except Exception as e:
         logging.error(f"Error add MCU history: {e}")
         return False
 
 def edit_employee(nik, data):
+    """
+    Personal fields go to employee. The MCU fields are written once, to the
+    employee's latest mcu_history row (a new row if there is none); triggers
+    project them and the status back onto employee (mcu_projection).
+    """
     try:
-        conn = sqlite3.connect("database/mcu_database.db")
-        cursor = conn.cursor()
-        # Tambahkan kolom employment_status ke dalam query update
-        cursor.execute('''
-        UPDATE employee SET
-            employee_name=?,
-            birth_date=?,
-            position=?,
-            hire_date=?,
-            work_period=?,
-            mcu_date=?,
-            mcu_expired=?,
-            file_mcu_main=?,
-            examination_result=?,
-            diagnosis=?,
-            recommendation=?,
-            status=?,
-            email=?,
-            employment_status=? -- Kolom baru
-        WHERE nik=?
-        ''', (
-            data['employee_name'],
-            data['birth_date'],
-            data['position'],
-            data['hire_date'],
-            data['work_period'],
-            data['mcu_date'],
-            data['mcu_expired'],
-            data['file_mcu_main'],
-            data['examination_result'],
-            data['diagnosis'],
-            data['recommendation'],
-            data['status'],
-            data['email'],
-            data['employment_status'], # Kolom baru
-            nik
-        ))
-        conn.commit()
-        conn.close()
+        with mcu_logging.timed("edit_employee", nik=nik) as log:
+            conn = sqlite3.connect("database/mcu_database.db")
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE employee SET
+                employee_name=?,
+                birth_date=?,
+                position=?,
+                hire_date=?,
+                work_period=?,
+                examination_result=?,
+                email=?,
+                employment_status=?
+            WHERE nik=?
+            ''', (
+                data['employee_name'],
+                data['birth_date'],
+                data['position'],
+                data['hire_date'],
+                data['work_period'],
+                data['examination_result'],
+                data['email'],
+                data['employment_status'],
+                nik
+            ))
+            log["rows"] = cursor.rowcount
+            mcu_fields = (
+                pd.to_datetime(data['mcu_date']).year,
+                data['mcu_date'],
+                data['mcu_expired'],
+                data['file_mcu_main'],
+                data['diagnosis'],
+                data['recommendation'],
+            )
+            latest_id = mcu_projection.latest_history_id(conn, nik)
+            if latest_id is None:
+                cursor.execute('''
+                INSERT INTO mcu_history (mcu_year, mcu_date, expired_date, file_name, diagnosis, recommendation, nik)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', mcu_fields + (nik,))
+            else:
+                cursor.execute('''
+                UPDATE mcu_history SET mcu_year=?, mcu_date=?, expired_date=?, file_name=?, diagnosis=?, recommendation=?
+                WHERE id=?
+                ''', mcu_fields + (latest_id,))
+            conn.commit()
+            conn.close()
         return True
     except Exception as e:
         logging.error(f"Error edit employee: {e}")
@@ -348,51 +433,142 @@ def edit_employee(nik, data):
 
 def delete_employee(nik):
     """
-    Delete employee record, related mcu_history rows, and files on disk.
+    Delete employee record and related mcu_history rows. Files on disk are
+    queued for background garbage collection.
     Return True if deletion was performed.
     """
     try:
-        conn = sqlite3.connect("database/mcu_database.db")
+        with mcu_logging.timed("delete_employee", nik=nik) as log:
+            conn = mcu_archive.attach_archive(sqlite3.connect("database/mcu_database.db"))
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM employee WHERE nik=?", (nik,))
+            log["rows"] = cursor.rowcount
+            cursor.execute("DELETE FROM mcu_history WHERE nik=?", (nik,))
+            log["history_rows"] = cursor.rowcount + mcu_archive.delete_archived(conn, "nik=?", (nik,))
+            queued = mcu_manifest.enqueue_employee_files(conn, nik, f"delete employee {nik}")
+            conn.commit()
+            conn.close()
+            mcu_manifest.start_background_gc()
+            log["files_queued"] = queued
+        return True
+    except Exception as e:
+        logging.error(f"Error delete employee: {e}")
+        return False
+
+# ======== BULK ACTIONS (MCU History multi-select) =========
+BULK_CHUNK_SIZE = 500
+
+def run_bulk_action(action, niks, employment_status=None, progress_callback=None):
+    """
+    Apply one bulk action to many employees inside a single transaction.
+    action: 'employment_status', 'recompute_status', 'reset_reminder' or 'delete'.
+    progress_callback(done, total) is called after every chunk.
+    Return the number of employees processed, or None if the transaction failed.
+    """
+    started = time.perf_counter()
+    niks = [str(n) for n in niks]
+    total = len(niks)
+    conn = sqlite3.connect("database/mcu_database.db")
+    if action == "delete":
+        mcu_archive.attach_archive(conn)
+    try:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM employee WHERE nik=?", (nik,))
-        cursor.execute("DELETE FROM mcu_history WHERE nik=?", (nik,))
+        for start in range(0, total, BULK_CHUNK_SIZE):
+            chunk = niks[start:start + BULK_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            if action in ("employment_status", "recompute_status"):
+                rows = cursor.execute(
+                    f"SELECT nik, employment_status, mcu_expired FROM employee WHERE nik IN ({placeholders})", chunk
+                ).fetchall()
+                updates = []
+                for nik, current_emp_status, mcu_expired in rows:
+                    new_emp_status = employment_status if action == "employment_status" else current_emp_status
+                    updates.append((new_emp_status, determine_mcu_status(new_emp_status, mcu_expired), nik))
+                cursor.executemany("UPDATE employee SET employment_status=?, status=? WHERE nik=?", updates)
+            elif action == "reset_reminder":
+                cursor.execute(f"UPDATE employee SET reminder_sent=0 WHERE nik IN ({placeholders})", chunk)
+            elif action == "delete":
+                cursor.execute(f"DELETE FROM employee WHERE nik IN ({placeholders})", chunk)
+                cursor.execute(f"DELETE FROM mcu_history WHERE nik IN ({placeholders})", chunk)
+                mcu_archive.delete_archived(conn, f"nik IN ({placeholders})", chunk)
+                for nik in chunk:
+                    mcu_manifest.enqueue_employee_files(conn, nik, "bulk delete")
+            else:
+                raise ValueError(f"Unknown bulk action: {action}")
+            if progress_callback:
+                progress_callback(min(start + BULK_CHUNK_SIZE, total), total)
         conn.commit()
+        if action == "delete":
+            mcu_manifest.start_background_gc()
+        logging.info(f"Bulk action {action} applied to {total} employee(s)", extra={
+            "operation": f"bulk_{action}", "rows": total, "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+        return total
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Bulk action {action} failed: {e}")
+        return None
+    finally:
         conn.close()
-        # Delete files on disk (if any)
-        file_dir = os.path.join("database", "uploads", "mcu_history", str(nik))
-        if os.path.exists(file_dir):
-            for fname in os.listdir(file_dir):
-                try:
-                    os.remove(os.path.join(file_dir, fname))
-                except Exception as e:
-                    logging.warning(f"Failed to remove file {fname}: {e}")
-            # try to remove directory
+
+def load_employees(niks):
+    """
+    Full employee rows for the given NIKs (e.g. the bulk "Export Terpilih");
+    the MCU History page itself only loads the list columns.
+    """
+    niks = [str(n) for n in niks]
+    frames = []
+    conn = sqlite3.connect("database/mcu_database.db")
+    try:
+        for start in range(0, len(niks), BULK_CHUNK_SIZE):
+            chunk = niks[start:start + BULK_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            frames.append(pd.read_sql(f"SELECT * FROM employee WHERE nik IN ({placeholders})", conn, params=chunk))
+    finally:
+        conn.close()
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def employees_to_excel(df_rows, sheet_name="MCU Data"):
+    """
+    Build an xlsx file (bytes) from a DataFrame with the same header style as the vendor export.
+    """
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df_rows.to_excel(writer, index=False, sheet_name=sheet_name)
+        workbook = writer.book
+        worksheet = writer.sheets[sheet_name]
+        header_format = workbook.add_format({
+            'bold': True,
+            'text_wrap': True,
+            'valign': 'top',
+            'fg_color': '#D7E4BC',
+            'border': 1
+        })
+        for col_num, value in enumerate(df_rows.columns.values):
+            worksheet.write(0, col_num, value, header_format)
             try:
-                os.rmdir(file_dir)
+                max_len = max(df_rows[value].astype(str).map(len).max(), len(str(value))) + 2
             except Exception:
-                pass
-        logging.info(f"Employee {nik} deleted from DB and disk")
-        return True
-    except Exception as e:
-        logging.error(f"Error delete employee: {e}")
-        return False
+                max_len = len(str(value)) + 2
+            worksheet.set_column(col_num, col_num, max_len)
+    return output.getvalue()
 
 def delete_mcu_history_file_and_db(nik, file_name, mcu_id):
     """
-    Delete a single MCU history row and the associated file on disk.
+    Delete a single MCU history row. The associated file is queued for
+    background garbage collection.
     """
-    file_path = get_file_path_mcu_history(nik, file_name)
-    if file_path and os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-        except Exception as e:
-            st.error("Gagal delete file fisik!")
-            logging.error(f"Failed to remove file {file_path}: {e}")
     try:
-        conn = sqlite3.connect("database/mcu_database.db")
+        conn = mcu_archive.attach_archive(sqlite3.connect("database/mcu_database.db"))
         conn.execute("DELETE FROM mcu_history WHERE id=?", (mcu_id,))
+        mcu_archive.delete_archived(conn, "id=?", (mcu_id,))
+        # Jika tidak ada baris hot tersisa, MCU terbaru dari arsip dikembalikan (sumber proyeksi employee)
+        mcu_archive.restore_latest(conn, nik)
+        if file_name:
+            mcu_manifest.enqueue_gc(conn, [mcu_manifest.manifest_path(nik, file_name)], f"delete mcu_history {mcu_id}")
         conn.commit()
         conn.close()
+        mcu_manifest.start_background_gc()
         st.success("MCU file berhasil dihapus!")
         # refresh display
         safe_rerun()
@@ -400,10 +576,9 @@ def delete_mcu_history_file_and_db(nik, file_name, mcu_id):
         st.error("Gagal delete data dari database!")
         logging.error(f"Failed to delete mcu_history id {mcu_id}: {e}")
 
-def preview_pdf_iframe(file_path, width=700, height=900):
+def preview_pdf_iframe(file_bytes, width=700, height=900):
     try:
-        with open(file_path, "rb") as f:
-            base64_pdf = base64.b64encode(f.read()).decode('utf-8')
+        base64_pdf = base64.b64encode(file_bytes).decode('utf-8')
         pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="{width}" height="{height}" type="application/pdf" style="border: none;"></iframe>'
         st.markdown(pdf_display, unsafe_allow_html=True)
     except Exception as e:
@@ -439,743 +614,1191 @@ def send_reminder_email(to_email, employee_name, expired_date, mcu_year):
         logging.error(f"Email send failed to {to_email}: {e}")
         return False
 
+# ======== ANALYTICS REPLICA =========
+def load_from_replica(query):
+    """
+    Read-only query on the in-memory analytics replica (mcu_replica), so the
+    heavy pages do not hold locks on the database file HR is writing to.
+    Returns (DataFrame, snapshot info).
+    """
+    with mcu_replica.reader() as (conn, snapshot):
+        return pd.read_sql(query, conn), snapshot
+
+def snapshot_caption(snapshot):
+    if snapshot.get("replica"):
+        st.caption(
+            f"📸 Data snapshot: {snapshot['taken_at']:%d-%m-%Y %H:%M:%S} "
+            f"(diperbarui otomatis setelah perubahan data, tertinggal maks. {mcu_replica.MAX_STALENESS} detik)"
+        )
+
+# ======== EXPORT JOB PROGRESS =========
+@st.fragment(run_every=1)
+def export_job_progress(job_id):
+    """
+    Poll a background export job once per second without rerunning the whole page.
+    When the job finishes, rerun the app so the download button is rendered.
+    """
+    job = mcu_export.get_job(job_id)
+    if job is None or job["status"] not in ("queued", "running"):
+        st.rerun(scope="app")
+    position = mcu_export.queue_position(job_id)
+    if position:
+        # Export lain sedang berjalan; job ini menunggu giliran di mcu_governor
+        st.info(f"⏳ Export menunggu giliran (antrian ke-{position})...")
+        return
+    rows = f" ({job['rows']} karyawan)" if job["rows"] is not None else ""
+    st.progress(job["progress"], text=f"Menyiapkan export{rows}... {int(job['progress'] * 100)}%")
+
+# ======== MCU HISTORY FRAGMENTS =========
+# Setiap bagian halaman MCU History adalah fragment: klik/ketik di dalamnya hanya
+# menjalankan ulang fragment itu, bukan seluruh halaman (load tabel employee,
+# tabel status, search). Perubahan data tetap memanggil safe_rerun() (rerun app).
+def read_original_file(manifest_entry):
+    # Baca dari file lokal atau dari pack (cold storage)
+    try:
+        return mcu_pack.read_file(manifest_entry['path'])
+    except OSError as e:
+        logging.warning(f"Manifest entry {manifest_entry['path']} unreadable: {e}")
+        return None
+
+@st.fragment
+def history_item(nik, row, manifest_entry):
+    """
+    One MCU history record. View/Delete only rerun this record. The original
+    file is only read for PDFs and downloads; images are viewed through their
+    downscaled preview (mcu_renditions) once it exists.
+    """
+    with st.expander(f"MCU Year: {row['mcu_year']}  —  Date: {row['mcu_date']}", expanded=False):
+        st.write(f"Expired: {row['expired_date']}")
+        st.write(f"Diagnosis: {row['diagnosis']}")
+        st.write(f"Recommendation: {row['recommendation']}")
+        file_name = row['file_name']
+        github_url = get_github_mcu_url(nik, file_name)
+        # Action buttons in a row
+        c1, c2, c3 = st.columns([1,1,1])
+        view_clicked = False
+        with c1:
+            if file_name:
+                view_key = f"view_{row['id']}"
+                view_clicked = st.button("View File", key=view_key)
+            else:
+                # MCU diinput tanpa file
+                st.caption("Tidak ada file MCU")
+        with c2:
+            download_key = f"download_{row['id']}"
+            github_link = f'<a href="{github_url}" target="_blank" style="text-decoration:none;">⬇️ Download (GitHub)</a>'
+            if file_name and manifest_entry:
+                # File asli (bisa puluhan MB) hanya dibaca saat benar-benar diunduh
+                if st.button("⬇️ Download", key=f"prepare_{download_key}"):
+                    try:
+                        with governed("preview", manifest_entry.get('size') or 0, "download"):
+                            file_bytes = read_original_file(manifest_entry)
+                    except mcu_governor.AdmissionTimeout:
+                        st.error("Server sedang sibuk, silakan coba lagi.")
+                        file_bytes = None
+                    if file_bytes is not None:
+                        st.download_button(label="💾 Simpan file", data=file_bytes, file_name=file_name, mime="application/octet-stream", key=download_key)
+                    else:
+                        st.markdown(github_link, unsafe_allow_html=True)
+            elif file_name:
+                # if not local, provide GitHub link
+                st.markdown(github_link, unsafe_allow_html=True)
+        with c3:
+            del_key = f"delete_{row['id']}"
+            if st.button("🗑️ Delete", key=del_key):
+                confirm_key = f"confirm_delete_{row['id']}"
+                # set a session flag to request confirmation
+                st.session_state[confirm_key] = st.session_state.get(confirm_key, False) or False
+                if not st.session_state.get(confirm_key):
+                    st.session_state[confirm_key] = True
+                    st.warning("Klik lagi untuk konfirmasi penghapusan MCU ini.")
+                else:
+                    # clear confirm flag
+                    st.session_state.pop(confirm_key, None)
+                    # safe_rerun called inside delete function (rerun seluruh app)
+                    delete_mcu_history_file_and_db(nik, file_name, row['id'])
+
+        # If view button clicked, show preview inline (iframe for pdf, st.image for images)
+        if view_clicked:
+            size = (manifest_entry or {}).get('size') or 0
+            # PDF: file asli + salinan base64 + HTML iframe ada di memori bersamaan
+            cost = size * 3 if file_name.lower().endswith(".pdf") else size
+            try:
+                with governed("preview", cost, "tampilan file"):
+                    show_history_file(file_name, manifest_entry, github_url)
+            except mcu_governor.AdmissionTimeout:
+                st.error("Server sedang sibuk, silakan coba lagi.")
+
+def show_history_file(file_name, manifest_entry, github_url):
+    view_bytes = None
+    caption = file_name
+    if manifest_entry and mcu_renditions.is_image(file_name):
+        view_bytes = mcu_renditions.get_rendition(manifest_entry['sha256'], "preview")
+        if view_bytes is None:
+            # Preview belum ada: buat di background, tampilkan file asli sekali ini
+            mcu_renditions.request_renditions([manifest_entry])
+            view_bytes = read_original_file(manifest_entry)
+        else:
+            caption = f"{file_name} (preview)"
+    elif manifest_entry:
+        view_bytes = read_original_file(manifest_entry)
+    if view_bytes is not None:
+        ext = file_name.split('.')[-1].lower()
+        if ext == 'pdf':
+            preview_pdf_iframe(view_bytes, width=800, height=900)
+        else:
+            try:
+                st.image(view_bytes, caption=caption, use_column_width=True)
+            except Exception as e:
+                st.error(f"Gagal menampilkan image: {e}")
+    else:
+        # no local file: open GitHub raw link in new tab via markdown link and show message
+        st.markdown(f'<a href="{github_url}" target="_blank">📄 Open file on GitHub (raw)</a>', unsafe_allow_html=True)
+        st.info("File tidak ditemukan di server; membuka di GitHub.")
+
+def thumbnail_strip(records, manifest_entries):
+    """
+    Small thumbnails of the employee's image uploads (a few KB each). Missing
+    thumbnails are queued for background generation.
+    """
+    images = [(row, manifest_entries[row['file_name']]) for row in records
+              if mcu_renditions.is_image(row['file_name']) and row['file_name'] in manifest_entries]
+    if not images:
+        return
+    mcu_renditions.request_renditions([entry for _, entry in images])
+    thumbs, captions = [], []
+    for row, entry in images:
+        thumb = mcu_renditions.get_rendition(entry['sha256'], "thumb")
+        if thumb is not None:
+            thumbs.append(thumb)
+            captions.append(str(row['mcu_year']))
+    if thumbs:
+        st.image(thumbs, caption=captions, width=mcu_renditions.THUMB_MAX_PX)
+    if len(thumbs) < len(images) and mcu_renditions.available():
+        st.caption(f"Thumbnail sedang dibuat untuk {len(images) - len(thumbs)} file gambar.")
+
+@st.fragment
+def history_list(nik):
+    """
+    MCU history of one employee from its profile document (mcu_profile),
+    one history_item fragment per record.
+    """
+    profile = mcu_profile.get_profile(nik)
+    if profile is None:
+        st.info("Belum ada histori MCU.")
+        return
+    # Baris lama (di luar MCU_HISTORY_HOT_YEARS) ada di arsip, hanya dibaca jika diminta
+    archived = profile['archived']
+    full = archived > 0 and st.toggle(
+        f"Tampilkan histori lengkap (termasuk {archived} arsip)", key=f"history_full_{nik}"
+    )
+    records = get_mcu_history_db(nik, full=True).to_dict("records") if full else profile['history']
+    if not records:
+        st.info("Belum ada histori MCU.")
+        return
+    # Ketersediaan file dibaca dari manifest (ikut di profile), bukan dari filesystem
+    manifest_entries = profile['manifest']
+    thumbnail_strip(records, manifest_entries)
+    for row in records:
+        history_item(nik, row, manifest_entries.get(row['file_name']))
+
+@st.fragment
+def add_mcu_form(nik):
+    """
+    "Tambah MCU Baru": typing and uploading only rerun this form.
+    """
+    st.subheader("Tambah MCU Baru")
+    new_year = st.number_input("Tahun MCU", value=datetime.now().year, min_value=1945, max_value=3000, step=1)
+    new_date = st.date_input("Tanggal MCU", min_value=datetime(1945, 1, 1), max_value=datetime(3000, 12, 31))
+    new_file = st.file_uploader("Upload File MCU", type=["pdf", "png", "jpg", "jpeg"], key=f"new_file_{nik}_{new_year}")
+    new_diag = st.text_input("Diagnosis MCU Baru")
+    new_rekom = st.text_area("Recommendation MCU Baru")
+    if st.button("Save MCU Baru", key=f"btn_save_mcu_{nik}_{new_year}"):
+        saved_file_name = save_uploaded_file(new_file, nik, new_year)
+        if saved_file_name:
+            add_mcu_history(nik, new_year, new_date.strftime("%Y-%m-%d"), calculate_mcu_expiry(new_date).strftime("%Y-%m-%d"), saved_file_name, new_diag, new_rekom)
+            st.success("MCU baru berhasil ditambahkan!")
+            # History list ada di fragment lain, jadi rerun seluruh app
+            safe_rerun()
+        else:
+            st.error("File MCU belum diupload.")
+
+@st.fragment
+def edit_employee_section(employee_data):
+    """
+    Edit form and delete button for one employee.
+    """
+    selected_nik = employee_data['nik']
+    st.subheader("Edit/Delete Employee Data")
+    edit_mode = st.checkbox("Edit employee data", key="edit_employee")
+    if edit_mode:
+        with st.form("edit_employee_form"):
+            employee_name_edit = st.text_input("Employee Name", employee_data['employee_name'])
+            birth_date_edit = st.date_input("Birth Date", pd.to_datetime(employee_data['birth_date']))
+            position_edit = st.text_input("Position", employee_data['position'])
+            email_edit = st.text_input("Employee Email", employee_data['email'])
+            hire_date_edit = st.date_input("Hire Date", pd.to_datetime(employee_data['hire_date']))
+            mcu_date_edit = st.date_input("Last MCU Date", pd.to_datetime(employee_data['mcu_date']))
+            # Tambahkan input edit untuk employment_status
+            employment_status_edit = st.selectbox("Employment Status", ["Probation", "Permanent"], index=0 if employee_data['employment_status'] == "Probation" else 1)
+            work_period_edit = calculate_work_period(hire_date_edit)
+            # Hitung status baru berdasarkan employment_status_edit dan mcu_date_edit
+            mcu_expired_edit = calculate_mcu_expiry(mcu_date_edit).strftime("%Y-%m-%d")
+            calculated_status_edit = determine_mcu_status(employment_status_edit, mcu_expired_edit)
+            examination_result_edit = st.text_area("Examination Result", employee_data['examination_result'])
+            diagnosis_edit = st.text_input("Diagnosis", employee_data['diagnosis'])
+            recommendation_edit = st.text_area("Recommendation", employee_data['recommendation'])
+            # Status MCU dihitung otomatis, tampilkan sebagai disabled
+            st.text_input("MCU Status (auto)", value=calculated_status_edit, disabled=True)
+            file_mcu_main_edit = employee_data['file_mcu_main']
+            submitted_edit = st.form_submit_button("Save Changes")
+
+            if submitted_edit:
+                # If user wants to upload new main MCU file
+                new_file_mcu_main = st.file_uploader("Upload New Main MCU File", type=['pdf', 'png', 'jpg', 'jpeg'], key="edit_main_mcu_file")
+                if new_file_mcu_main is not None:
+                    file_mcu_main_edit = save_uploaded_file(new_file_mcu_main, selected_nik, pd.to_datetime(mcu_date_edit).year)
+                    if file_mcu_main_edit:
+                        try:
+                            conn = sqlite3.connect("database/mcu_database.db")
+                            mcu_manifest.register_file(conn, selected_nik, file_mcu_main_edit)
+                            conn.commit()
+                            conn.close()
+                        except Exception as e:
+                            logging.warning(f"Failed to register {file_mcu_main_edit} in manifest: {e}")
+
+                edit_employee(selected_nik, {
+                    "employee_name": employee_name_edit,
+                    "birth_date": birth_date_edit.strftime("%Y-%m-%d"),
+                    "position": position_edit,
+                    "hire_date": hire_date_edit.strftime("%Y-%m-%d"),
+                    "work_period": work_period_edit,
+                    "mcu_date": mcu_date_edit.strftime("%Y-%m-%d"),
+                    "mcu_expired": mcu_expired_edit,
+                    "file_mcu_main": file_mcu_main_edit,
+                    "examination_result": examination_result_edit,
+                    "diagnosis": diagnosis_edit,
+                    "recommendation": recommendation_edit,
+                    "email": email_edit,
+                    "employment_status": employment_status_edit # Simpan employment_status
+                })
+                st.success("Data berhasil diupdate!")
+                safe_rerun()
+
+    # DELETE employee: two-step confirmation using session_state
+    if st.button("🗑️ Delete Employee", key="delete_emp_btn"):
+        st.session_state["confirm_delete_emp"] = selected_nik
+        st.warning("Klik tombol Konfirmasi Penghapusan untuk menghapus employee ini secara permanen.")
+
+    if st.session_state.get("confirm_delete_emp") == selected_nik:
+        if st.button("Konfirmasi Penghapusan (PERMANENT)", key="confirm_emp_delete_btn"):
+            ok = delete_employee(selected_nik)
+            if ok:
+                st.success("Employee data deleted permanently.")
+                # clear flag
+                st.session_state.pop("confirm_delete_emp", None)
+                safe_rerun()
+            else:
+                st.error("Gagal menghapus employee. Cek log.")
+
 # ----------------- UI / Navigation -----------------
 st.sidebar.title("Navigation")
 page = st.sidebar.radio(
     "Choose Page",
-    ("Dashboard MCU", "Input MCU Data", "MCU History", "Health Monitoring", "Export MCU Excel")
+    ("Dashboard MCU", "Input MCU Data", "MCU History", "Health Monitoring", "Export MCU Excel", "Multi-Site", "Compliance Trend")
 )
+# Semua log dari script run ini membawa page dan user
+mcu_logging.set_context(page=page, user=st.session_state.get("username"))
+
+# Durasi render dicatat juga kalau run berakhir dengan st.rerun() / st.stop()
+with mcu_logging.timed("page_render"):
+    if st.sidebar.button("Logout"):
+        # Clear session state and rerun
+        for k in list(st.session_state.keys()):
+            st.session_state.pop(k, None)
+        st.session_state["logged_in"] = False
+        st.success("Logged out.")
+        safe_rerun()
 
-if st.sidebar.button("Logout"):
-    # Clear session state and rerun
-    for k in list(st.session_state.keys()):
-        st.session_state.pop(k, None)
-    st.session_state["logged_in"] = False
-    st.success("Logged out.")
-    safe_rerun()
-
-if page == "Dashboard MCU":
-    show_logo()
-    st.title("🏥 Employee MCU Dashboard")
-
-    try:
-        conn = sqlite3.connect("database/mcu_database.db")
-        df = pd.read_sql("SELECT * FROM employee", conn)
-        conn.close()
-    except Exception as e:
-        st.error("Failed to load data!")
-        logging.error(f"Dashboard error: {e}")
-        df = pd.DataFrame()
-
-    if not df.empty:
-        st.header("Employee MCU Status")
-        col1, col2, col3, col4 = st.columns(4)
-        total_emp = len(df)
-        active_mcu = sum(df['status'] == "Active")
-        expired_mcu = sum(df['status'] == "Expired")
-        will_expired = sum(df['status'] == "Will Expire")
-        pre_employee = sum(df['status'] == "Pre Employee") # Hitung Pre Employee
-        col1.metric("Total Employee", total_emp)
-        col2.metric("MCU Active", active_mcu)
-        col3.metric("MCU Expired", expired_mcu)
-        col4.metric("Will Expire", will_expired)
-        # Tambahkan metric Pre Employee
-        st.metric("Pre Employee", pre_employee)
-
-        st.header("Health Statistics (Pie Chart)")
-        if 'diagnosis' in df.columns and not df['diagnosis'].isna().all():
-            diagnosis_counts = df['diagnosis'].value_counts().head(5)
-            fig, ax = plt.subplots(figsize=(3.5, 3.5))
-            diagnosis_counts.plot(
-                kind='pie',
-                autopct='%1.1f%%',
-                startangle=90,
-                shadow=True,
-                colors=['#ff9999','#66b3ff','#99ff99','#ffcc99','#c2c2f0'],
-                ax=ax
-            )
-            ax.set_title('Top 5 Health Diagnosis', pad=12)
-            ax.set_ylabel('')
-            st.pyplot(fig)
-            st.write("Diagnosis Details:")
-            for i, (diagnosis, jumlah) in enumerate(diagnosis_counts.items(), start=1):
-                st.markdown(f"<b>{i}. {diagnosis}</b>: {jumlah} employee", unsafe_allow_html=True)
-        else:
-            st.warning("Diagnosis data not available.")
+    if page == "Dashboard MCU":
+        show_logo()
+        st.title("🏥 Employee MCU Dashboard")
 
-        st.header("MCU Reminder")
+        snapshot = {}
         try:
-            conn = sqlite3.connect("database/mcu_database.db")
-            df_db = pd.read_sql("SELECT * FROM employee", conn)
+            # Status bergantung pada tanggal hari ini: diperbarui sekali sehari per proses (job harian juga)
+            if mcu_projection.refresh_status_daily():
+                # Snapshot langsung diperbarui supaya status hari ini yang tampil
+                mcu_replica.refresh()
         except Exception as e:
-            st.error("Failed to load data for reminder!")
-            logging.error(f"Reminder DB error: {e}")
-            df_db = pd.DataFrame()
-
-        # Hanya cari karyawan yang statusnya "Will Expire" dan employment_status "Permanent"
-        upcoming = df_db[(df_db['status'] == "Will Expire") & (df_db['employment_status'] == "Permanent")] if not df_db.empty and 'status' in df_db.columns else pd.DataFrame()
-        if not upcoming.empty:
-            st.warning(f"⚠️ {len(upcoming)} employee MCU will expire soon!")
-            for idx, row in upcoming.iterrows():
-                st.write(f"- {row['nik']} | {row['employee_name']} | Expired: {row['mcu_expired']} | Email: {row['email']}")
-                if row.get("reminder_sent", 0) != 1 and pd.notna(row["email"]) and row["email"]:
-                    email_sent = send_reminder_email(
-                        row['email'],
-                        row['employee_name'],
-                        row['mcu_expired'],
-                        pd.to_datetime(row['mcu_date']).year if pd.notna(row['mcu_date']) else ""
-                    )
-                    if email_sent:
-                        st.success(f"Reminder sent to {row['email']}")
-                        try:
-                            conn2 = sqlite3.connect("database/mcu_database.db")
-                            c2 = conn2.cursor()
-                            c2.execute("UPDATE employee SET reminder_sent=1 WHERE nik=?", (row['nik'],))
-                            conn2.commit()
-                            conn2.close()
-                        except Exception as e:
-                            logging.error(f"Failed to update reminder_sent for {row['nik']}: {e}")
-                    else:
-                        st.error(f"Failed to send email to {row['email']}")
-        else:
-            st.success("✅ No MCU will expire soon.")
-    else:
-        st.warning("Database is empty. Please input MCU data first.")
-
-elif page == "Input MCU Data":
-    show_logo()
-    st.title("📝 Input MCU Data Employee")
-
-    # Fungsi baru untuk menentukan status MCU saat INPUT berdasarkan employment_status
-    def determine_mcu_status_input(employment_status, mcu_date):
-        if employment_status == "Probation":
-            return "Pre Employee"
-        elif employment_status == "Permanent":
-            # Jika Permanent, status awalnya adalah 'Berkala' atau 'Active', bukan 'Pre Employee'
-            # Status 'Will Expire' atau 'Expired' akan dihitung berdasarkan mcu_expired nanti di dashboard
-            # Untuk input, kita gunakan logika berdasarkan tanggal MCU dan expiry
-            if pd.isna(mcu_date) or mcu_date is None:
-                return "No MCU" # Atau status default lain jika MCU date belum diisi
-            expiry_date = calculate_mcu_expiry(mcu_date)
-            if pd.isna(expiry_date):
-                return "Berkala" # Jika expiry tidak bisa dihitung, anggap aktif
-            now = datetime.now().date()
-            expiry = expiry_date.date()
-            if now > expiry:
-                return "Expired"
-            elif (expiry - now).days <= 30:
-                return "Will Expire"
+            # Database sedang dipakai penulis lain: refresh dilewati, data tetap tampil dari replica
+            logging.warning(f"Dashboard status refresh skipped: {e}")
+        try:
+            df, snapshot = load_from_replica("SELECT * FROM employee")
+        except Exception as e:
+            st.error("Failed to load data!")
+            logging.error(f"Dashboard error: {e}")
+            df = pd.DataFrame()
+        snapshot_caption(snapshot)
+
+        if not df.empty:
+            st.header("Employee MCU Status")
+            col1, col2, col3, col4 = st.columns(4)
+            total_emp = len(df)
+            active_mcu = sum(df['status'] == "Active")
+            expired_mcu = sum(df['status'] == "Expired")
+            will_expired = sum(df['status'] == "Will Expire")
+            pre_employee = sum(df['status'] == "Pre Employee") # Hitung Pre Employee
+            col1.metric("Total Employee", total_emp)
+            col2.metric("MCU Active", active_mcu)
+            col3.metric("MCU Expired", expired_mcu)
+            col4.metric("Will Expire", will_expired)
+            # Tambahkan metric Pre Employee
+            st.metric("Pre Employee", pre_employee)
+
+            st.header("Health Statistics (Pie Chart)")
+            if 'diagnosis' in df.columns and not df['diagnosis'].isna().all():
+                diagnosis_counts = df['diagnosis'].value_counts().head(5)
+                fig, ax = plt.subplots(figsize=(3.5, 3.5))
+                diagnosis_counts.plot(
+                    kind='pie',
+                    autopct='%1.1f%%',
+                    startangle=90,
+                    shadow=True,
+                    colors=['#ff9999','#66b3ff','#99ff99','#ffcc99','#c2c2f0'],
+                    ax=ax
+                )
+                ax.set_title('Top 5 Health Diagnosis', pad=12)
+                ax.set_ylabel('')
+                st.pyplot(fig)
+                st.write("Diagnosis Details:")
+                for i, (diagnosis, jumlah) in enumerate(diagnosis_counts.items(), start=1):
+                    st.markdown(f"<b>{i}. {diagnosis}</b>: {jumlah} employee", unsafe_allow_html=True)
             else:
-                return "Berkala"
-        else:
-            # Untuk status kerja lain (selain Probation/Permanent), bisa disesuaikan
-            # Misalnya, anggap sebagai Pre Employee juga atau status default lain
-            return "Pre Employee" # Contoh default
+                st.warning("Diagnosis data not available.")
 
-    try:
-        with st.form("mcu_form"):
-            col1, col2 = st.columns(2)
-            with col1:
-                nik = st.text_input("NIK", max_chars=20)
-                employee_name = st.text_input("Employee Name")
-                birth_date = st.date_input("Birth Date", min_value=datetime(1945, 1, 1), max_value=datetime(3000, 12, 31))
-                position = st.text_input("Position")
-                email = st.text_input("Employee Email")
-            with col2:
-                hire_date = st.date_input("Hire Date", min_value=datetime(1945, 1, 1), max_value=datetime(3000, 12, 31))
-                mcu_date = st.date_input("Last MCU Date", min_value=datetime(1945, 1, 1), max_value=datetime(3000, 12, 31))
-                # Tambahkan input untuk employment status
-                employment_status = st.selectbox("Employment Status", ["Probation", "Permanent"])
-                work_period = st.text_input("Work Period (auto)", value=calculate_work_period(hire_date), disabled=True)
-                # Status MCU otomatis dihitung berdasarkan employment_status dan mcu_date
-                calculated_status = determine_mcu_status_input(employment_status, mcu_date)
-                mcu_status = st.text_input("MCU Status (auto)", value=calculated_status, disabled=True)
-
-            examination_result = st.text_area("Examination Result")
-            diagnosis = st.text_input("Diagnosis")
-            recommendation = st.text_area("Recommendation")
-            file_mcu_main = st.file_uploader("Upload Main MCU Result (PDF/Image)", type=['pdf', 'png', 'jpg', 'jpeg'])
-
-            submitted = st.form_submit_button("Save MCU Data")
-
-            valid_date = True
-            error_date = validate_dates(birth_date, hire_date, mcu_date)
-            if error_date:
-                st.error(error_date)
-                valid_date = False
-
-            if submitted and valid_date:
-                if not nik or not employee_name:
-                    st.error("❌ NIK and Employee Name are required!")
+            st.header("MCU Reminder")
+            # Reminder dibaca dari database (bukan snapshot) supaya reminder_sent selalu terbaru
+            try:
+                conn = sqlite3.connect("database/mcu_database.db")
+                df_db = pd.read_sql("SELECT * FROM employee", conn)
+            except Exception as e:
+                st.error("Failed to load data for reminder!")
+                logging.error(f"Reminder DB error: {e}")
+                df_db = pd.DataFrame()
+
+            # Hanya cari karyawan yang statusnya "Will Expire" dan employment_status "Permanent"
+            upcoming = df_db[(df_db['status'] == "Will Expire") & (df_db['employment_status'] == "Permanent")] if not df_db.empty and 'status' in df_db.columns else pd.DataFrame()
+            if not upcoming.empty:
+                st.warning(f"⚠️ {len(upcoming)} employee MCU will expire soon!")
+                for idx, row in upcoming.iterrows():
+                    st.write(f"- {row['nik']} | {row['employee_name']} | Expired: {row['mcu_expired']} | Email: {row['email']}")
+                    if row.get("reminder_sent", 0) != 1 and pd.notna(row["email"]) and row["email"]:
+                        email_sent = send_reminder_email(
+                            row['email'],
+                            row['employee_name'],
+                            row['mcu_expired'],
+                            pd.to_datetime(row['mcu_date']).year if pd.notna(row['mcu_date']) else ""
+                        )
+                        if email_sent:
+                            st.success(f"Reminder sent to {row['email']}")
+                            try:
+                                conn2 = sqlite3.connect("database/mcu_database.db")
+                                c2 = conn2.cursor()
+                                c2.execute("UPDATE employee SET reminder_sent=1 WHERE nik=?", (row['nik'],))
+                                conn2.commit()
+                                conn2.close()
+                            except Exception as e:
+                                logging.error(f"Failed to update reminder_sent for {row['nik']}: {e}")
+                        else:
+                            st.error(f"Failed to send email to {row['email']}")
+            else:
+                st.success("✅ No MCU will expire soon.")
+
+            st.header("Jadwal MCU Vendor")
+            with st.expander("⚙️ Klinik & Tanggal Libur"):
+                st.dataframe(mcu_schedule.list_clinics(), hide_index=True)
+                weekday_names = ["Senin", "Selasa", "Rabu", "Kamis", "Jumat", "Sabtu", "Minggu"]
+                with st.form("schedule_clinic_form"):
+                    clinic_name = st.text_input("Nama Klinik")
+                    clinic_capacity = st.number_input("Kapasitas per hari", min_value=1, value=20, step=1)
+                    clinic_days = st.multiselect("Hari praktik", weekday_names, default=weekday_names[:5])
+                    if st.form_submit_button("Simpan Klinik"):
+                        try:
+                            mcu_schedule.set_clinic(clinic_name.strip(), clinic_capacity,
+                                                    [weekday_names.index(d) for d in clinic_days])
+                            st.success(f"Klinik {clinic_name} tersimpan.")
+                        except Exception as e:
+                            st.error(f"Gagal menyimpan klinik: {e}")
+                st.dataframe(mcu_schedule.list_blackouts(since=datetime.now().date().isoformat()), hide_index=True)
+                with st.form("schedule_blackout_form"):
+                    blackout_clinics = ["Semua klinik"] + mcu_schedule.list_clinics()['clinic'].tolist()
+                    blackout_date = st.date_input("Tanggal libur")
+                    blackout_clinic = st.selectbox("Klinik", blackout_clinics)
+                    blackout_reason = st.text_input("Keterangan")
+                    if st.form_submit_button("Tambah Tanggal Libur"):
+                        mcu_schedule.add_blackout(blackout_date, "" if blackout_clinic == "Semua klinik" else blackout_clinic,
+                                                  blackout_reason or None)
+                        st.success(f"Tanggal libur {blackout_date.strftime('%d-%m-%Y')} ditambahkan.")
+
+            scol1, scol2 = st.columns(2)
+            with scol1:
+                schedule_start = st.date_input("Mulai jadwal", value=datetime.now().date(), key="schedule_start")
+            with scol2:
+                schedule_horizon = st.number_input("Horizon (hari)", min_value=7, max_value=365,
+                                                   value=mcu_schedule.DEFAULT_HORIZON_DAYS, step=1, key="schedule_horizon")
+            if st.button("Buat Jadwal MCU", key="schedule_build_btn"):
+                if mcu_schedule.list_clinics(enabled_only=True).empty:
+                    st.warning("Belum ada klinik aktif. Tambahkan klinik terlebih dahulu.")
                 else:
                     try:
-                        conn = sqlite3.connect("database/mcu_database.db")
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT COUNT(*) FROM employee WHERE nik=?", (nik,))
-                        if cursor.fetchone()[0] > 0:
-                            st.error("❌ NIK already registered! Please use another NIK or edit existing data.")
-                        else:
-                            saved_filename = save_uploaded_file(file_mcu_main, nik, pd.to_datetime(mcu_date).year)
-
-                            # Gunakan fungsi baru untuk menentukan status MCU saat input
-                            calculated_status = determine_mcu_status_input(employment_status, mcu_date)
-
-                            cursor.execute('''
-                            INSERT INTO employee (
-                                nik, employee_name, birth_date, position,
-                                hire_date, work_period, mcu_date, mcu_expired,
-                                file_mcu_main, examination_result, diagnosis,
-                                recommendation, status, email, reminder_sent, employment_status -- Tambahkan employment_status
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (
-                                nik,
-                                employee_name,
-                                birth_date.strftime("%Y-%m-%d"),
-                                position,
-                                hire_date.strftime("%Y-%m-%d"),
-                                calculate_work_period(hire_date),
-                                mcu_date.strftime("%Y-%m-%d") if mcu_date else None,
-                                calculate_mcu_expiry(mcu_date).strftime("%Y-%m-%d") if mcu_date else None,
-                                saved_filename,
-                                examination_result,
-                                diagnosis,
-                                recommendation,
-                                calculated_status, # Gunakan hasil dari fungsi baru
-                                email,
-                                0,
-                                employment_status # Simpan employment_status
-                            ))
-                            conn.commit()
+                        run = mcu_schedule.build_schedule(start=schedule_start, horizon_days=int(schedule_horizon))
+                        st.success(f"Jadwal dibuat: {run['scheduled']} terjadwal, {run['late']} melewati expired, "
+                                   f"{run['overdue']} sudah expired, {run['unscheduled']} belum dapat slot.")
+                    except Exception as e:
+                        st.error("Gagal membuat jadwal!")
+                        logging.error(f"Schedule build error: {e}")
+
+            last_run = mcu_schedule.latest_run()
+            if last_run:
+                st.caption(f"Jadwal terakhir: {last_run['created_at']} | mulai {last_run['start_date']}, "
+                           f"{last_run['horizon_days']} hari, {last_run['due']} karyawan")
+                df_schedule = mcu_schedule.load_schedule(last_run['run_id'])
+                st.dataframe(df_schedule, hide_index=True)
+                st.download_button(
+                    label="⬇️ Download Jadwal MCU (Excel)",
+                    data=mcu_schedule.schedule_to_excel(df_schedule),
+                    file_name=f"mcu_schedule_{last_run['start_date']}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+        else:
+            st.warning("Database is empty. Please input MCU data first.")
+
+    elif page == "Input MCU Data":
+        show_logo()
+        st.title("📝 Input MCU Data Employee")
+
+        # Fungsi baru untuk menentukan status MCU saat INPUT berdasarkan employment_status
+        def determine_mcu_status_input(employment_status, mcu_date):
+            if employment_status == "Probation":
+                return "Pre Employee"
+            elif employment_status == "Permanent":
+                # Jika Permanent, status awalnya adalah 'Berkala' atau 'Active', bukan 'Pre Employee'
+                # Status 'Will Expire' atau 'Expired' akan dihitung berdasarkan mcu_expired nanti di dashboard
+                # Untuk input, kita gunakan logika berdasarkan tanggal MCU dan expiry
+                if pd.isna(mcu_date) or mcu_date is None:
+                    return "No MCU" # Atau status default lain jika MCU date belum diisi
+                expiry_date = calculate_mcu_expiry(mcu_date)
+                if pd.isna(expiry_date):
+                    return "Berkala" # Jika expiry tidak bisa dihitung, anggap aktif
+                now = datetime.now().date()
+                expiry = expiry_date.date()
+                if now > expiry:
+                    return "Expired"
+                elif (expiry - now).days <= 30:
+                    return "Will Expire"
+                else:
+                    return "Berkala"
+            else:
+                # Untuk status kerja lain (selain Probation/Permanent), bisa disesuaikan
+                # Misalnya, anggap sebagai Pre Employee juga atau status default lain
+                return "Pre Employee" # Contoh default
 
-                            if saved_filename:
-                                add_mcu_history(
+        try:
+            with st.form("mcu_form"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    nik = st.text_input("NIK", max_chars=20)
+                    employee_name = st.text_input("Employee Name")
+                    birth_date = st.date_input("Birth Date", min_value=datetime(1945, 1, 1), max_value=datetime(3000, 12, 31))
+                    position = st.text_input("Position")
+                    email = st.text_input("Employee Email")
+                with col2:
+                    hire_date = st.date_input("Hire Date", min_value=datetime(1945, 1, 1), max_value=datetime(3000, 12, 31))
+                    mcu_date = st.date_input("Last MCU Date", min_value=datetime(1945, 1, 1), max_value=datetime(3000, 12, 31))
+                    # Tambahkan input untuk employment status
+                    employment_status = st.selectbox("Employment Status", ["Probation", "Permanent"])
+                    work_period = st.text_input("Work Period (auto)", value=calculate_work_period(hire_date), disabled=True)
+                    # Status MCU otomatis dihitung berdasarkan employment_status dan mcu_date
+                    calculated_status = determine_mcu_status_input(employment_status, mcu_date)
+                    mcu_status = st.text_input("MCU Status (auto)", value=calculated_status, disabled=True)
+
+                examination_result = st.text_area("Examination Result")
+                diagnosis = st.text_input("Diagnosis")
+                recommendation = st.text_area("Recommendation")
+                file_mcu_main = st.file_uploader("Upload Main MCU Result (PDF/Image)", type=['pdf', 'png', 'jpg', 'jpeg'])
+
+                submitted = st.form_submit_button("Save MCU Data")
+
+                valid_date = True
+                error_date = validate_dates(birth_date, hire_date, mcu_date)
+                if error_date:
+                    st.error(error_date)
+                    valid_date = False
+
+                if submitted and valid_date:
+                    if not nik or not employee_name:
+                        st.error("❌ NIK and Employee Name are required!")
+                    else:
+                        try:
+                            conn = sqlite3.connect("database/mcu_database.db")
+                            cursor = conn.cursor()
+                            cursor.execute("SELECT COUNT(*) FROM employee WHERE nik=?", (nik,))
+                            if cursor.fetchone()[0] > 0:
+                                st.error("❌ NIK already registered! Please use another NIK or edit existing data.")
+                            else:
+                                saved_filename = save_uploaded_file(file_mcu_main, nik, pd.to_datetime(mcu_date).year)
+
+                                # Data MCU hanya ditulis ke mcu_history; trigger mengisi kolom MCU
+                                # terbaru dan status di employee (mcu_projection)
+                                cursor.execute('''
+                                INSERT INTO employee (
+                                    nik, employee_name, birth_date, position,
+                                    hire_date, work_period, examination_result,
+                                    email, reminder_sent, employment_status
+                                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                ''', (
                                     nik,
-                                    pd.to_datetime(mcu_date).year,
-                                    mcu_date.strftime("%Y-%m-%d"),
-                                    calculate_mcu_expiry(mcu_date).strftime("%Y-%m-%d"),
-                                    saved_filename,
-                                    diagnosis,
-                                    recommendation
-                                )
-                            st.success("✅ MCU data saved!")
-                        conn.close()
-                    except Exception as e:
-                        st.error("Failed to input data!")
-                        logging.error(f"Input MCU error: {e}")
-    except Exception as e:
-        st.error("Form input error!")
-        logging.error(f"Form input error: {e}")
+                                    employee_name,
+                                    birth_date.strftime("%Y-%m-%d"),
+                                    position,
+                                    hire_date.strftime("%Y-%m-%d"),
+                                    calculate_work_period(hire_date),
+                                    examination_result,
+                                    email,
+                                    0,
+                                    employment_status
+                                ))
+                                conn.commit()
+
+                                if mcu_date:
+                                    add_mcu_history(
+                                        nik,
+                                        pd.to_datetime(mcu_date).year,
+                                        mcu_date.strftime("%Y-%m-%d"),
+                                        calculate_mcu_expiry(mcu_date).strftime("%Y-%m-%d"),
+                                        saved_filename,
+                                        diagnosis,
+                                        recommendation
+                                    )
+                                st.success("✅ MCU data saved!")
+                            conn.close()
+                        except Exception as e:
+                            st.error("Failed to input data!")
+                            logging.error(f"Input MCU error: {e}")
+        except Exception as e:
+            st.error("Form input error!")
+            logging.error(f"Form input error: {e}")
 
-elif page == "MCU History":
-    show_logo()
-    st.title("📋 Employee MCU History")
+    elif page == "MCU History":
+        show_logo()
+        st.title("📋 Employee MCU History")
 
-    try:
-        conn = sqlite3.connect("database/mcu_database.db")
-        df = pd.read_sql("SELECT * FROM employee", conn)
-        conn.close()
-    except Exception as e:
-        st.error("Failed to load data!")
-        logging.error(f"History error: {e}")
-        df = pd.DataFrame()
-
-    if not df.empty:
-        # --- MODIFIKASI MULAI DI SINI ---
-        # Tambahkan filter berdasarkan status MCU
-        st.subheader("Filter Data Berdasarkan Status MCU")
-        all_statuses = sorted(df['status'].dropna().unique().tolist())
-        selected_status = st.selectbox(
-            "Pilih Status MCU",
-            options=["All"] + all_statuses
-        )
+        try:
+            # Hanya kolom daftar/search; detail karyawan dibaca dari profile document (mcu_profile)
+            conn = sqlite3.connect("database/mcu_database.db")
+            df = pd.read_sql("SELECT nik, employee_name, status, employment_status FROM employee", conn)
+            conn.close()
+        except Exception as e:
+            st.error("Failed to load data!")
+            logging.error(f"History error: {e}")
+            df = pd.DataFrame()
+
+        if not df.empty:
+            # --- MODIFIKASI MULAI DI SINI ---
+            # Tambahkan filter berdasarkan status MCU
+            st.subheader("Filter Data Berdasarkan Status MCU")
+            all_statuses = sorted(df['status'].dropna().unique().tolist())
+            selected_status = st.selectbox(
+                "Pilih Status MCU",
+                options=["All"] + all_statuses
+            )
 
-        # Terapkan filter status
-        if selected_status != "All":
-            filtered_data_status = df[df['status'] == selected_status]
-        else:
-            filtered_data_status = df
-
-        # Tampilkan jumlah hasil setelah filter status
-        st.info(f"Jumlah karyawan dengan status '{selected_status if selected_status != 'All' else 'Semua'}': {len(filtered_data_status)}")
-
-        # Tampilkan hasil filter status sebagai tabel
-        if not filtered_data_status.empty:
-            st.subheader("Daftar Karyawan Berdasarkan Status")
-            # Pilih kolom yang ingin ditampilkan
-            display_df = filtered_data_status[['employee_name', 'nik', 'status']].copy()
-            # Opsional: tambahkan styling warna untuk status
-            def color_status(val):
-                color = "green" if val == "Active" else "orange" if val == "Will Expire" else "red" if val in ["Expired", "No MCU"] else "blue" # Warna untuk Pre Employee dan Berkala
-                return f'color: {color}; font-weight: bold'
-            st.dataframe(display_df.style.map(color_status, subset=['status']))
-        else:
-            st.warning("Tidak ada karyawan dengan status tersebut.")
-
-        st.markdown("---") # Garis pemisah
-
-        # --- KODE ASLI SEARCH BERDASARKAN NAMA/NIK ---
-        st.subheader("Cari Karyawan")
-        search_col1, search_col2 = st.columns([3, 1])
-        with search_col1:
-            search_query = st.text_input("🔍 Search by NIK or Employee Name")
-
-        # Terapkan filter pencarian ke data hasil filter status sebelumnya
-        if search_query:
-            filtered_data = filtered_data_status[
-                filtered_data_status['nik'].str.contains(search_query, case=False, na=False) |
-                filtered_data_status['employee_name'].str.contains(search_query, case=False, na=False)
-            ]
-        else:
-            filtered_data = filtered_data_status # Gunakan data hasil filter status
-
-        # --- MODIFIKASI SEARCH: TAMPILKAN DETAIL JIKA HASIL PENCARIAN PERSIS ---
-        if not filtered_data.empty:
-            # Cek apakah hasil pencarian mengandung persis NIK atau Nama
-            exact_match_nik = filtered_data[filtered_data['nik'].str.lower() == search_query.lower()]
-            exact_match_name = filtered_data[filtered_data['employee_name'].str.lower() == search_query.lower()]
-
-            # Jika ada NIK atau Nama yang persis sama dengan query
-            if not exact_match_nik.empty:
-                selected_nik = exact_match_nik.iloc[0]['nik']
-                employee_data = exact_match_nik.iloc[0]
-                st.info(f"Hasil pencarian persis ditemukan untuk NIK: {selected_nik}")
-            elif not exact_match_name.empty:
-                selected_nik = exact_match_name.iloc[0]['nik']
-                employee_data = exact_match_name.iloc[0]
-                st.info(f"Hasil pencarian persis ditemukan untuk Nama: {employee_data['employee_name']}")
-            # Jika tidak ada yang persis, tampilkan dropdown
+            # Terapkan filter status
+            if selected_status != "All":
+                filtered_data_status = df[df['status'] == selected_status]
             else:
-                if len(filtered_data) > 1:
-                    selected_employee = st.selectbox(
-                        "Pilih Karyawan dari hasil pencarian:",
-                        options=filtered_data['employee_name'] + " (" + filtered_data['nik'] + ")",
-                        format_func=lambda x: x
+                filtered_data_status = df
+
+            # Tampilkan jumlah hasil setelah filter status
+            st.info(f"Jumlah karyawan dengan status '{selected_status if selected_status != 'All' else 'Semua'}': {len(filtered_data_status)}")
+
+            # Tampilkan hasil filter status sebagai tabel
+            if not filtered_data_status.empty:
+                st.subheader("Daftar Karyawan Berdasarkan Status")
+                # Pilih kolom yang ingin ditampilkan
+                display_df = filtered_data_status[['employee_name', 'nik', 'status', 'employment_status']].copy()
+                # Kolom checkbox untuk multi-select aksi massal
+                select_all = st.checkbox("Pilih semua", key="bulk_select_all")
+                display_df.insert(0, "pilih", select_all)
+                # Opsional: tambahkan styling warna untuk status
+                def color_status(val):
+                    color = "green" if val == "Active" else "orange" if val == "Will Expire" else "red" if val in ["Expired", "No MCU"] else "blue" # Warna untuk Pre Employee dan Berkala
+                    return f'color: {color}; font-weight: bold'
+                edited_df = st.data_editor(
+                    display_df.style.map(color_status, subset=['status']),
+                    hide_index=True,
+                    column_config={"pilih": st.column_config.CheckboxColumn("Pilih")},
+                    disabled=['employee_name', 'nik', 'status', 'employment_status'],
+                    key=f"bulk_editor_{selected_status}_{select_all}"
+                )
+                selected_niks = edited_df.loc[edited_df['pilih'] == True, 'nik'].tolist()
+
+                if st.session_state.get("bulk_result"):
+                    st.success(st.session_state.pop("bulk_result"))
+
+                if selected_niks:
+                    st.markdown(f"**Aksi Massal — {len(selected_niks)} karyawan dipilih**")
+                    bulk_action = st.selectbox(
+                        "Pilih Aksi",
+                        ["Ubah Employment Status", "Hitung Ulang Status MCU", "Reset Reminder", "Export Terpilih", "Hapus Karyawan"],
+                        key="bulk_action"
                     )
-                    selected_nik = selected_employee.split("(")[1].replace(")", "")
-                    employee_data = filtered_data[filtered_data['nik'] == selected_nik].iloc[0]
-                elif len(filtered_data) == 1:
-                    # Jika hanya satu hasil tapi bukan persis
-                    selected_nik = filtered_data.iloc[0]['nik']
-                    employee_data = filtered_data.iloc[0]
-                    st.info(f"Satu hasil ditemukan untuk pencarian: {search_query}")
-                else:
-                    # Ini seharusnya tidak terjadi karena sudah dicek di atas
-                    st.warning("Tidak ada data yang cocok.")
-                    employee_data = None
-                    selected_nik = None
-
-            # Jika employee_data ditemukan, tampilkan detailnya
-            if employee_data is not None and selected_nik is not None:
-                st.subheader("Employee Information")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.write(f"**NIK:** {employee_data['nik']}")
-                    st.write(f"**Name:** {employee_data['employee_name']}")
-                    st.write(f"**Birth Date:** {employee_data['birth_date']}")
-                with col2:
-                    st.write(f"**Position:** {employee_data['position']}")
-                    st.write(f"**Hire Date:** {employee_data['hire_date']}")
-                    st.write(f"**Work Period:** {employee_data['work_period']}")
-                with col3:
-                    st.write(f"**MCU Date:** {employee_data['mcu_date']}")
-                    st.write(f"**MCU Expired:** {employee_data['mcu_expired']}")
-                    # Tambahkan tampilan Employment Status
-                    st.write(f"**Employment Status:** {employee_data['employment_status']}")
-                    status = employee_data['status']
-                    color = "green" if status == "Active" else "orange" if status == "Will Expire" else "red"
-                    st.write(f"**Status:** <span style='color:{color};font-weight:bold'>{status}</span>", unsafe_allow_html=True)
-
-                st.subheader("Examination Result")
-                st.write(employee_data['examination_result'])
-
-                st.subheader("Diagnosis & Recommendation")
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.write(f"**Diagnosis:**")
-                    st.write(employee_data['diagnosis'])
-                with col2:
-                    st.write(f"**Recommendation:**")
-                    st.write(employee_data['recommendation'])
-
-                st.subheader("Employee MCU History (Expander per record)")
-                history_df = get_mcu_history_db(employee_data['nik'])
-                if not history_df.empty:
-                    # iterate and show each history item as an expander
-                    for _, row in history_df.iterrows():
-                        exp_key = f"exp_{row['id']}"
-                        with st.expander(f"MCU Year: {row['mcu_year']}  —  Date: {row['mcu_date']}", expanded=False):
-                            st.write(f"Expired: {row['expired_date']}")
-                            st.write(f"Diagnosis: {row['diagnosis']}")
-                            st.write(f"Recommendation: {row['recommendation']}")
-                            file_name = row['file_name']
-                            file_path = get_file_path_mcu_history(employee_data['nik'], file_name)
-                            github_url = get_github_mcu_url(employee_data['nik'], file_name)
-                            # Action buttons in a row
-                            c1, c2, c3 = st.columns([1,1,1])
-                            with c1:
-                                view_key = f"view_{row['id']}"
-                                view_clicked = st.button("View File", key=view_key)
-                            with c2:
-                                download_key = f"download_{row['id']}"
-                                if file_path and os.path.exists(file_path):
-                                    with open(file_path, "rb") as f:
-                                        file_bytes = f.read()
-                                    st.download_button(label="⬇️ Download", data=file_bytes, file_name=file_name, mime="application/octet-stream", key=download_key)
-                                else:
-                                    # if not local, provide GitHub link
-                                    st.markdown(f'<a href="{github_url}" target="_blank" style="text-decoration:none;">⬇️ Download (GitHub)</a>', unsafe_allow_html=True)
-                            with c3:
-                                del_key = f"delete_{row['id']}"
-                                if st.button("🗑️ Delete", key=del_key):
-                                    confirm_key = f"confirm_delete_{row['id']}"
-                                    # set a session flag to request confirmation
-                                    st.session_state[confirm_key] = st.session_state.get(confirm_key, False) or False
-                                    if not st.session_state.get(confirm_key):
-                                        st.session_state[confirm_key] = True
-                                        st.warning("Klik lagi untuk konfirmasi penghapusan MCU ini.")
-                                    else:
-                                        delete_mcu_history_file_and_db(employee_data['nik'], file_name, row['id'])
-                                        # clear confirm flag
-                                        st.session_state.pop(confirm_key, None)
-                                        # safe_rerun called inside delete function
-
-                            # If view button clicked, show preview inline (iframe for pdf, st.image for images)
-                            if view_clicked:
-                                if file_path and os.path.exists(file_path):
-                                    ext = file_name.split('.')[-1].lower()
-                                    if ext == 'pdf':
-                                        preview_pdf_iframe(file_path, width=800, height=900)
-                                    else:
-                                        try:
-                                            st.image(file_path, caption=f"{file_name}", use_column_width=True)
-                                        except Exception as e:
-                                            st.error(f"Gagal menampilkan image: {e}")
-                                else:
-                                    # no local file: open GitHub raw link in new tab via markdown link and show message
-                                    st.markdown(f'<a href="{github_url}" target="_blank">📄 Open file on GitHub (raw)</a>', unsafe_allow_html=True)
-                                    st.info("File tidak ditemukan di server; membuka di GitHub.")
+                    if bulk_action == "Export Terpilih":
+                        selected_rows = load_employees(selected_niks)
+                        st.download_button(
+                            label="⬇️ Download Excel Terpilih",
+                            data=employees_to_excel(selected_rows.drop(columns=['id'], errors='ignore')),
+                            file_name="mcu_selected.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            key="bulk_export_btn"
+                        )
+                    else:
+                        bulk_emp_status = None
+                        confirmed = True
+                        if bulk_action == "Ubah Employment Status":
+                            bulk_emp_status = st.selectbox("Employment Status Baru", ["Permanent", "Probation"], key="bulk_emp_status")
+                        elif bulk_action == "Hapus Karyawan":
+                            confirmed = st.checkbox(f"Konfirmasi hapus PERMANEN {len(selected_niks)} karyawan beserta file MCU", key="bulk_confirm_delete")
+                        if st.button("Jalankan Aksi Massal", key="bulk_run_btn", disabled=not confirmed):
+                            action_map = {
+                                "Ubah Employment Status": "employment_status",
+                                "Hitung Ulang Status MCU": "recompute_status",
+                                "Reset Reminder": "reset_reminder",
+                                "Hapus Karyawan": "delete",
+                            }
+                            progress = st.progress(0.0, text="Memproses...")
+                            done = run_bulk_action(
+                                action_map[bulk_action],
+                                selected_niks,
+                                employment_status=bulk_emp_status,
+                                progress_callback=lambda n, total: progress.progress(n / total, text=f"Memproses {n}/{total}")
+                            )
+                            if done is None:
+                                st.error("Aksi massal gagal, tidak ada perubahan yang disimpan. Cek log.")
+                            else:
+                                st.session_state["bulk_result"] = f"{bulk_action}: {done} karyawan diproses."
+                                safe_rerun()
+            else:
+                st.warning("Tidak ada karyawan dengan status tersebut.")
+
+            st.markdown("---") # Garis pemisah
+
+            # --- KODE ASLI SEARCH BERDASARKAN NAMA/NIK ---
+            st.subheader("Cari Karyawan")
+            search_col1, search_col2 = st.columns([3, 1])
+            with search_col1:
+                search_query = st.text_input("🔍 Search by NIK or Employee Name")
+
+            # Terapkan filter pencarian ke data hasil filter status sebelumnya
+            if search_query:
+                filtered_data = filtered_data_status[
+                    filtered_data_status['nik'].str.contains(search_query, case=False, na=False) |
+                    filtered_data_status['employee_name'].str.contains(search_query, case=False, na=False)
+                ]
+            else:
+                filtered_data = filtered_data_status # Gunakan data hasil filter status
+
+            # --- MODIFIKASI SEARCH: TAMPILKAN DETAIL JIKA HASIL PENCARIAN PERSIS ---
+            if not filtered_data.empty:
+                # Cek apakah hasil pencarian mengandung persis NIK atau Nama
+                exact_match_nik = filtered_data[filtered_data['nik'].str.lower() == search_query.lower()]
+                exact_match_name = filtered_data[filtered_data['employee_name'].str.lower() == search_query.lower()]
+
+                # Jika ada NIK atau Nama yang persis sama dengan query
+                if not exact_match_nik.empty:
+                    selected_nik = exact_match_nik.iloc[0]['nik']
+                    employee_data = exact_match_nik.iloc[0]
+                    st.info(f"Hasil pencarian persis ditemukan untuk NIK: {selected_nik}")
+                elif not exact_match_name.empty:
+                    selected_nik = exact_match_name.iloc[0]['nik']
+                    employee_data = exact_match_name.iloc[0]
+                    st.info(f"Hasil pencarian persis ditemukan untuk Nama: {employee_data['employee_name']}")
+                # Jika tidak ada yang persis, tampilkan dropdown
                 else:
-                    st.info("Belum ada histori MCU.")
-
-                st.markdown("---")
-                # Form untuk menambah MCU baru
-                st.subheader("Tambah MCU Baru")
-                new_year = st.number_input("Tahun MCU", value=datetime.now().year, min_value=1945, max_value=3000, step=1)
-                new_date = st.date_input("Tanggal MCU", min_value=datetime(1945, 1, 1), max_value=datetime(3000, 12, 31))
-                new_file = st.file_uploader("Upload File MCU", type=["pdf", "png", "jpg", "jpeg"], key=f"new_file_{selected_nik}_{new_year}")
-                new_diag = st.text_input("Diagnosis MCU Baru")
-                new_rekom = st.text_area("Recommendation MCU Baru")
-                if st.button("Save MCU Baru", key=f"btn_save_mcu_{selected_nik}_{new_year}"):
-                    saved_file_name = save_uploaded_file(new_file, selected_nik, new_year)
-                    if saved_file_name:
-                        add_mcu_history(selected_nik, new_year, new_date.strftime("%Y-%m-%d"), calculate_mcu_expiry(new_date).strftime("%Y-%m-%d"), saved_file_name, new_diag, new_rekom)
-                        st.success("MCU baru berhasil ditambahkan!")
-                        safe_rerun()
+                    if len(filtered_data) > 1:
+                        selected_employee = st.selectbox(
+                            "Pilih Karyawan dari hasil pencarian:",
+                            options=filtered_data['employee_name'] + " (" + filtered_data['nik'] + ")",
+                            format_func=lambda x: x
+                        )
+                        selected_nik = selected_employee.split("(")[1].replace(")", "")
+                        employee_data = filtered_data[filtered_data['nik'] == selected_nik].iloc[0]
+                    elif len(filtered_data) == 1:
+                        # Jika hanya satu hasil tapi bukan persis
+                        selected_nik = filtered_data.iloc[0]['nik']
+                        employee_data = filtered_data.iloc[0]
+                        st.info(f"Satu hasil ditemukan untuk pencarian: {search_query}")
                     else:
-                        st.error("File MCU belum diupload.")
-
-                st.markdown("---")
-                st.subheader("Edit/Delete Employee Data")
-                edit_mode = st.checkbox("Edit employee data", key="edit_employee")
-                if edit_mode:
-                    with st.form("edit_employee_form"):
-                        employee_name_edit = st.text_input("Employee Name", employee_data['employee_name'])
-                        birth_date_edit = st.date_input("Birth Date", pd.to_datetime(employee_data['birth_date']))
-                        position_edit = st.text_input("Position", employee_data['position'])
-                        email_edit = st.text_input("Employee Email", employee_data['email'])
-                        hire_date_edit = st.date_input("Hire Date", pd.to_datetime(employee_data['hire_date']))
-                        mcu_date_edit = st.date_input("Last MCU Date", pd.to_datetime(employee_data['mcu_date']))
-                        # Tambahkan input edit untuk employment_status
-                        employment_status_edit = st.selectbox("Employment Status", ["Probation", "Permanent"], index=0 if employee_data['employment_status'] == "Probation" else 1)
-                        work_period_edit = calculate_work_period(hire_date_edit)
-                        # Hitung status baru berdasarkan employment_status_edit dan mcu_date_edit
-                        mcu_expired_edit = calculate_mcu_expiry(mcu_date_edit).strftime("%Y-%m-%d")
-                        calculated_status_edit = determine_mcu_status(employment_status_edit, mcu_expired_edit)
-                        examination_result_edit = st.text_area("Examination Result", employee_data['examination_result'])
-                        diagnosis_edit = st.text_input("Diagnosis", employee_data['diagnosis'])
-                        recommendation_edit = st.text_area("Recommendation", employee_data['recommendation'])
-                        # Status MCU dihitung otomatis, tampilkan sebagai disabled
-                        status_edit = st.text_input("MCU Status (auto)", value=calculated_status_edit, disabled=True)
-                        file_mcu_main_edit = employee_data['file_mcu_main']
-                        submitted_edit = st.form_submit_button("Save Changes")
-
-                        if submitted_edit:
-                            # If user wants to upload new main MCU file
-                            new_file_mcu_main = st.file_uploader("Upload New Main MCU File", type=['pdf', 'png', 'jpg', 'jpeg'], key="edit_main_mcu_file")
-                            if new_file_mcu_main is not None:
-                                file_mcu_main_edit = save_uploaded_file(new_file_mcu_main, selected_nik, pd.to_datetime(mcu_date_edit).year)
-
-                            edit_employee(selected_nik, {
-                                "employee_name": employee_name_edit,
-                                "birth_date": birth_date_edit.strftime("%Y-%m-%d"),
-                                "position": position_edit,
-                                "hire_date": hire_date_edit.strftime("%Y-%m-%d"),
-                                "work_period": work_period_edit,
-                                "mcu_date": mcu_date_edit.strftime("%Y-%m-%d"),
-                                "mcu_expired": mcu_expired_edit,
-                                "file_mcu_main": file_mcu_main_edit,
-                                "examination_result": examination_result_edit,
-                                "diagnosis": diagnosis_edit,
-                                "recommendation": recommendation_edit,
-                                "status": calculated_status_edit, # Gunakan status yang dihitung
-                                "email": email_edit,
-                                "employment_status": employment_status_edit # Simpan employment_status
-                            })
-                            st.success("Data berhasil diupdate!")
-                            safe_rerun()
-
-                # DELETE employee: two-step confirmation using session_state
-                if st.button("🗑️ Delete Employee", key="delete_emp_btn"):
-                    st.session_state["confirm_delete_emp"] = selected_nik
-                    st.warning("Klik tombol Konfirmasi Penghapusan untuk menghapus employee ini secara permanen.")
-
-                if st.session_state.get("confirm_delete_emp") == selected_nik:
-                    if st.button("Konfirmasi Penghapusan (PERMANENT)", key="confirm_emp_delete_btn"):
-                        ok = delete_employee(selected_nik)
-                        if ok:
-                            st.success("Employee data deleted permanently.")
-                            # clear flag
-                            st.session_state.pop("confirm_delete_emp", None)
-                            safe_rerun()
-                        else:
-                            st.error("Gagal menghapus employee. Cek log.")
+                        # Ini seharusnya tidak terjadi karena sudah dicek di atas
+                        st.warning("Tidak ada data yang cocok.")
+                        employee_data = None
+                        selected_nik = None
+
+                # Detail karyawan: satu baca primary key ke profile document
+                profile = mcu_profile.get_profile(selected_nik) if selected_nik is not None else None
+                employee_data = profile['employee'] if profile else None
+
+                # Jika employee_data ditemukan, tampilkan detailnya
+                if employee_data is not None and selected_nik is not None:
+                    st.subheader("Employee Information")
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.write(f"**NIK:** {employee_data['nik']}")
+                        st.write(f"**Name:** {employee_data['employee_name']}")
+                        st.write(f"**Birth Date:** {employee_data['birth_date']}")
+                    with col2:
+                        st.write(f"**Position:** {employee_data['position']}")
+                        st.write(f"**Hire Date:** {employee_data['hire_date']}")
+                        st.write(f"**Work Period:** {employee_data['work_period']}")
+                    with col3:
+                        st.write(f"**MCU Date:** {employee_data['mcu_date']}")
+                        st.write(f"**MCU Expired:** {employee_data['mcu_expired']}")
+                        # Tambahkan tampilan Employment Status
+                        st.write(f"**Employment Status:** {employee_data['employment_status']}")
+                        status = profile['status']
+                        color = "green" if status == "Active" else "orange" if status == "Will Expire" else "red"
+                        st.write(f"**Status:** <span style='color:{color};font-weight:bold'>{status}</span>", unsafe_allow_html=True)
+
+                    st.subheader("Examination Result")
+                    st.write(employee_data['examination_result'])
+
+                    st.subheader("Diagnosis & Recommendation")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.write(f"**Diagnosis:**")
+                        st.write(employee_data['diagnosis'])
+                    with col2:
+                        st.write(f"**Recommendation:**")
+                        st.write(employee_data['recommendation'])
+
+                    st.subheader("Employee MCU History (Expander per record)")
+                    history_list(employee_data['nik'])
+
+                    st.markdown("---")
+                    # Form untuk menambah MCU baru
+                    add_mcu_form(selected_nik)
+
+                    st.markdown("---")
+                    edit_employee_section(employee_data)
+            else:
+                st.warning("No data found for the search")
         else:
-            st.warning("No data found for the search")
-    else:
-        st.warning("Database is empty. Please input MCU data first.")
+            st.warning("Database is empty. Please input MCU data first.")
 
-elif page == "Export MCU Excel":
-    show_logo()
-    st.title("📤 Export MCU Data for Vendor")
+    elif page == "Export MCU Excel":
+        show_logo()
+        st.title("📤 Export MCU Data for Vendor")
 
-    try:
-        conn = sqlite3.connect("database/mcu_database.db")
-        df_emp = pd.read_sql("SELECT nik, employee_name, position, employment_status FROM employee", conn) # Tambahkan employment_status
-        conn.close()
-    except Exception as e:
-        st.error("Failed to load employee data!")
-        logging.error(f"Export DB error: {e}")
-        df_emp = pd.DataFrame()
-
-    # Tambahkan filter untuk memilih karyawan
-    st.subheader("Filter Data untuk Export")
-    col1, col2, col3 = st.columns(3) # Tambah kolom
-    with col1:
-        positions = []
-        if not df_emp.empty:
-            positions = sorted(df_emp['position'].dropna().unique().tolist())
-        selected_department = st.selectbox(
-            "Pilih Department/Posisi",
-            options=["All"] + positions
-        )
-    with col2:
-        # Filter berdasarkan status MCU
-        conn = sqlite3.connect("database/mcu_database.db")
-        df_status = pd.read_sql("SELECT nik, status FROM employee", conn)
-        conn.close()
-        selected_status = st.selectbox(
-            "Pilih Status MCU",
-            options=["All", "Active", "Will Expire", "Expired", "No MCU", "Free Employee", "Berkala", "Pre Employee"] # Tambahkan status baru
-        )
-    with col3:
-        # Filter berdasarkan employment status
-        selected_emp_status = st.selectbox(
-            "Pilih Employment Status",
-            options=["All", "Probation", "Permanent"]
-        )
+        snapshot = {}
+        try:
+            df_emp, snapshot = load_from_replica("SELECT nik, employee_name, position, employment_status, status FROM employee")
+        except Exception as e:
+            st.error("Failed to load employee data!")
+            logging.error(f"Export DB error: {e}")
+            df_emp = pd.DataFrame(columns=["nik", "employee_name", "position", "employment_status", "status"])
+        snapshot_caption(snapshot)
+
+        # Tambahkan filter untuk memilih karyawan
+        st.subheader("Filter Data untuk Export")
+        col1, col2, col3 = st.columns(3) # Tambah kolom
+        with col1:
+            positions = []
+            if not df_emp.empty:
+                positions = sorted(df_emp['position'].dropna().unique().tolist())
+            selected_department = st.selectbox(
+                "Pilih Department/Posisi",
+                options=["All"] + positions
+            )
+        with col2:
+            # Filter berdasarkan status MCU
+            selected_status = st.selectbox(
+                "Pilih Status MCU",
+                options=["All", "Active", "Will Expire", "Expired", "No MCU", "Free Employee", "Berkala", "Pre Employee"] # Tambahkan status baru
+            )
+        with col3:
+            # Filter berdasarkan employment status
+            selected_emp_status = st.selectbox(
+                "Pilih Employment Status",
+                options=["All", "Probation", "Permanent"]
+            )
 
-    # Apply filters
-    df_emp_filtered = df_emp.merge(df_status[['nik', 'status']], on='nik', how='left') # Gabungkan status
-    if selected_department != "All":
-        df_emp_filtered = df_emp_filtered[df_emp_filtered['position'] == selected_department]
-    if selected_status != "All":
-        df_emp_filtered = df_emp_filtered[df_emp_filtered['status'] == selected_status]
-    if selected_emp_status != "All":
-        df_emp_filtered = df_emp_filtered[df_emp_filtered['employment_status'] == selected_emp_status] # Filter employment status
-
-    st.info(f"Jumlah karyawan yang akan diexport: {len(df_emp_filtered)}")
-
-    # Pilihan format export
-    export_format = st.radio(
-        "Format Export",
-        ["Excel dengan Link GitHub", "Excel dengan Info Lengkap"]
-    )
+        # Apply filters
+        df_emp_filtered = df_emp
+        if selected_department != "All":
+            df_emp_filtered = df_emp_filtered[df_emp_filtered['position'] == selected_department]
+        if selected_status != "All":
+            df_emp_filtered = df_emp_filtered[df_emp_filtered['status'] == selected_status]
+        if selected_emp_status != "All":
+            df_emp_filtered = df_emp_filtered[df_emp_filtered['employment_status'] == selected_emp_status] # Filter employment status
 
-    export_btn = st.button("Export Data")
-
-    if export_btn and not df_emp_filtered.empty:
-        export_rows = []
-        meta_years = []
-        for idx, emp in df_emp_filtered.iterrows():
-            nik = emp['nik']
-            nama = emp['employee_name']
-            position = emp.get('position', '')
-            employment_status = emp.get('employment_status', '') # Ambil employment_status
-            history_df = get_mcu_history_db(nik)
-            last3 = history_df.head(3)
-            if export_format == "Excel dengan Link GitHub":
-                mcu_urls = []
-                mcu_years = []
-                for i, row in last3.iterrows():
-                    github_url = get_github_mcu_url(nik, row['file_name'])
-                    mcu_urls.append(github_url)
-                    mcu_years.append(str(row['mcu_year']) if pd.notna(row['mcu_year']) else "")
-                while len(mcu_urls) < 3:
-                    mcu_urls.append("")
-                    mcu_years.append("")
-                export_rows.append({
-                    "NIK": nik,
-                    "Employee Name": nama,
-                    "Position": position,
-                    "Employment Status": employment_status, # Tambahkan kolom
-                    "MCU 1": mcu_urls[0],
-                    "MCU 2": mcu_urls[1],
-                    "MCU 3": mcu_urls[2]
-                })
-                meta_years.append(mcu_years)
+        st.info(f"Jumlah karyawan yang akan diexport: {len(df_emp_filtered)}")
+
+        # Pilihan format export
+        export_format = st.radio(
+            "Format Export",
+            mcu_export.EXPORT_FORMATS
+        )
+        export_filters = {"position": selected_department, "status": selected_status, "employment_status": selected_emp_status}
+        if export_format == mcu_export.EXPORT_FORMAT_BUNDLE:
+            # ZIP berisi Excel + N file MCU terakhir per karyawan (link relatif, bisa dibuka offline)
+            export_filters["files_per_employee"] = int(st.number_input(
+                "Jumlah file MCU terakhir per karyawan", value=3, min_value=1, max_value=20, step=1
+            ))
+
+        export_btn = st.button("Export Data")
+
+        if export_btn and not df_emp_filtered.empty:
+            # Export jalan di background; hasil yang sama (filter + versi data) diambil dari cache
+            st.session_state["export_job_id"] = mcu_export.submit_export(export_filters, export_format)
+
+        export_job = mcu_export.get_job(st.session_state.get("export_job_id"))
+        if export_job is not None:
+            if export_job["status"] in ("queued", "running"):
+                export_job_progress(export_job["id"])
+            elif export_job["status"] == "failed":
+                st.error(f"Export gagal: {export_job['error']}")
+            else:
+                if export_job["cached"]:
+                    st.caption("Hasil export diambil dari cache.")
+                # File hasil export hanya dibaca saat benar-benar diunduh, di bawah antrian pool download
+                if st.button("⬇️ Siapkan Download", key="export_prepare_download"):
+                    file_name, mime = mcu_export.EXPORT_DOWNLOADS[export_job["format"]]
+                    try:
+                        with governed("download", export_job["size"] or 0, "download export"):
+                            artifact = mcu_export.open_artifact(export_job["id"])
+                            if artifact is None:
+                                st.warning("File export sudah tidak ada di cache, silakan klik Export Data lagi.")
+                            else:
+                                with artifact:
+                                    st.download_button(
+                                        label="💾 Simpan ZIP Bundle" if export_job["format"] == mcu_export.EXPORT_FORMAT_BUNDLE else "💾 Simpan Excel File",
+                                        data=artifact,
+                                        file_name=file_name,
+                                        mime=mime
+                                    )
+                    except mcu_governor.AdmissionTimeout:
+                        st.error("Server sedang sibuk, silakan coba lagi.")
+
+    elif page == "Health Monitoring":
+        show_logo()
+        st.title("📈 Employee Health Monitoring")
+
+        snapshot = {}
+        try:
+            df, snapshot = load_from_replica("SELECT * FROM employee")
+        except Exception as e:
+            st.error("Failed to load data!")
+            logging.error(f"Monitoring error: {e}")
+            df = pd.DataFrame()
+        snapshot_caption(snapshot)
+
+        if not df.empty and 'diagnosis' in df.columns:
+            st.header("Health Trend Chart")
+            st.subheader("Employee Age Histogram")
+            df['birth_date'] = pd.to_datetime(df['birth_date'], errors='coerce')
+            df['age'] = ((datetime.now() - df['birth_date']).dt.days // 365).fillna(0).astype(int)
+            fig1, ax1 = plt.subplots(figsize=(4,3))
+            ax1.hist(df['age'].dropna(), bins=10, color='skyblue', edgecolor='black')
+            ax1.set_title("Employee Age Distribution")
+            ax1.set_xlabel("Age (years)")
+            ax1.set_ylabel("Count")
+            st.pyplot(fig1)
+
+            st.subheader("Diagnosis Trends per Year")
+            df['mcu_date_parsed'] = pd.to_datetime(df['mcu_date'], errors='coerce')
+            # Trend dihitung dari seluruh mcu_history (bukan hanya MCU terakhir di tabel employee)
+            try:
+                prevalence = mcu_analytics.diagnosis_prevalence_per_year()
+            except Exception as e:
+                logging.error(f"Prevalence analytics error: {e}")
+                prevalence = pd.DataFrame()
+            if prevalence.empty:
+                st.info("Tidak ada data MCU tahun untuk trend.")
+            else:
+                top_diagnoses = prevalence.groupby('diagnosis')['employees'].sum().nlargest(8).index
+                yearly_trend = prevalence[prevalence['diagnosis'].isin(top_diagnoses)].pivot_table(
+                    index='mcu_year', columns='diagnosis', values='prevalence', fill_value=0
+                )
+                fig2, ax2 = plt.subplots(figsize=(5,3))
+                (yearly_trend * 100).plot(kind='line', marker='o', ax=ax2)
+                ax2.set_title('Diagnosis Prevalence per Year (MCU History)')
+                ax2.set_xlabel('MCU Year')
+                ax2.set_ylabel('% of examined employees')
+                ax2.legend(title='Diagnosis', bbox_to_anchor=(1,1))
+                st.pyplot(fig2)
+
+            st.subheader("Diagnosis Transitions per Year")
+            try:
+                transitions = mcu_analytics.diagnosis_transitions_per_year()
+            except Exception as e:
+                logging.error(f"Transition analytics error: {e}")
+                transitions = pd.DataFrame()
+            transitions = transitions[transitions['transition'] != 'first'] if not transitions.empty else transitions
+            if transitions.empty:
+                st.info("Belum ada karyawan dengan lebih dari satu tahun MCU.")
             else:
-                mcu_info = []
-                for i, row in last3.iterrows():
-                    mcu_info.append(
-                        f"Tahun: {row['mcu_year']}, "
-                        f"Tanggal: {row['mcu_date']}, "
-                        f"Kedaluwarsa: {row['expired_date']}, "
-                        f"Diagnosis: {row['diagnosis']}"
+                transition_table = transitions.pivot_table(index='mcu_year', columns='transition', values='employees', fill_value=0)
+                transition_table = transition_table.rename(columns=mcu_analytics.TRANSITION_LABELS)
+                fig_tr, ax_tr = plt.subplots(figsize=(5,3))
+                transition_table.plot(kind='bar', stacked=True, ax=ax_tr)
+                ax_tr.set_title('Diagnosis vs Previous MCU Year')
+                ax_tr.set_xlabel('MCU Year')
+                ax_tr.set_ylabel('Employees')
+                ax_tr.legend(title='Transition', bbox_to_anchor=(1,1))
+                st.pyplot(fig_tr)
+                with st.expander("📋 Lihat karyawan per transisi"):
+                    tr_col1, tr_col2 = st.columns(2)
+                    with tr_col1:
+                        tr_year = st.selectbox("Tahun MCU", sorted(transitions['mcu_year'].unique(), reverse=True), key="tr_year")
+                    with tr_col2:
+                        tr_type = st.selectbox(
+                            "Transisi", ["new", "persisting", "changed", "resolved"],
+                            format_func=lambda t: mcu_analytics.TRANSITION_LABELS[t], key="tr_type"
+                        )
+                    st.dataframe(mcu_analytics.employee_transitions(tr_year, tr_type), hide_index=True)
+
+            st.subheader("Cohort by Hire Year (Abnormal Rate)")
+            try:
+                cohort = mcu_analytics.cohort_by_hire_year()
+            except Exception as e:
+                logging.error(f"Cohort analytics error: {e}")
+                cohort = pd.DataFrame()
+            if cohort.empty:
+                st.info("Tidak ada data cohort.")
+            else:
+                cohort_table = cohort.pivot_table(index='hire_year', columns='mcu_year', values='abnormal_rate')
+                st.dataframe(cohort_table.style.format("{:.1%}", na_rep="-").background_gradient(cmap="Reds", axis=None))
+
+            st.subheader("MCU Trend per Month")
+            df['mcu_month'] = df['mcu_date_parsed'].dt.to_period('M').astype(str)
+            monthly_counts = df['mcu_month'].value_counts().sort_index()
+            if monthly_counts.empty:
+                st.info("Tidak ada data MCU per bulan.")
+            else:
+                fig3, (ax3, ax4) = plt.subplots(1, 2, figsize=(8,3))
+                monthly_counts.plot(kind='line', marker='o', ax=ax3, color='green', linewidth=2)
+                ax3.set_title('MCU Count per Month')
+                ax3.set_ylabel('MCU Count')
+                ax3.grid(True)
+                ax3.tick_params(axis='x', rotation=45)
+
+                monthly_counts.plot(kind='pie', ax=ax4, autopct='%1.1f%%',
+                                  startangle=90, shadow=True,
+                                  colors=plt.cm.Paired.colors)
+                ax4.set_title('MCU Distribution per Month')
+                ax4.set_ylabel('')
+                st.pyplot(fig3)
+
+            st.header("Health Risk Notification")
+            # Skor risiko dihitung untuk seluruh karyawan sekaligus dan disimpan di tabel employee_risk
+            try:
+                if mcu_risk.ensure_scores(wait=False):
+                    st.caption("⏳ Skor risiko sedang diperbarui di background, data di bawah dari perhitungan sebelumnya.")
+                risk_meta = mcu_risk.get_score_meta()
+            except Exception as e:
+                logging.error(f"Risk scoring error: {e}")
+                risk_meta = None
+            risk_col1, risk_col2 = st.columns(2)
+            with risk_col1:
+                risk_top_n = st.number_input("Top N karyawan berisiko", min_value=5, max_value=500, value=20, step=5, key="risk_top_n")
+            with risk_col2:
+                risk_emp_status = st.selectbox("Employment Status", ["Permanent", "All", "Probation"], key="risk_emp_status")
+            try:
+                at_risk = mcu_risk.top_at_risk(
+                    limit=risk_top_n,
+                    employment_status=None if risk_emp_status == "All" else risk_emp_status
+                )
+            except Exception as e:
+                logging.error(f"Risk query error: {e}")
+                at_risk = pd.DataFrame()
+            if not at_risk.empty:
+                st.warning(f"**⚠️ Warning:** {len(at_risk)} karyawan dengan skor risiko tertinggi ({risk_emp_status}):")
+                st.dataframe(
+                    at_risk[['nik', 'employee_name', 'position', 'employment_status', 'score', 'reasons']],
+                    hide_index=True,
+                    column_config={"score": st.column_config.ProgressColumn(
+                        "Risk Score", format="%.1f", min_value=0, max_value=float(at_risk['score'].max())
+                    )}
+                )
+            else:
+                st.success("✅ No health risks detected for the selected employees.")
+            if risk_meta:
+                st.caption(f"Skor dihitung: {risk_meta['computed_at']} ({risk_meta['employees']} karyawan)")
+
+            with st.expander("⚙️ Bobot Skor Risiko"):
+                weights = mcu_risk.get_risk_weights()
+                with st.form("risk_weights_form"):
+                    w_col1, w_col2 = st.columns(2)
+                    with w_col1:
+                        w_recurring = st.number_input("Diagnosis berulang (per tahun tambahan)", value=float(weights["recurring_diagnosis"]), step=0.5)
+                        w_finding = st.number_input("Diagnosis MCU terakhir abnormal", value=float(weights["current_finding"]), step=0.5)
+                        w_no_mcu = st.number_input("Belum ada MCU", value=float(weights["no_mcu"]), step=0.5)
+                    with w_col2:
+                        w_expired = st.number_input("MCU Expired", value=float(weights["mcu_expired"]), step=0.5)
+                        w_will_expire = st.number_input("MCU Will Expire", value=float(weights["mcu_will_expire"]), step=0.5)
+                    st.write("Kelompok umur (umur minimum → poin)")
+                    age_bands = st.data_editor(
+                        pd.DataFrame({"min_age": [int(k) for k in weights["age_bands"]], "points": list(weights["age_bands"].values())}),
+                        num_rows="dynamic", hide_index=True, key="risk_age_bands"
                     )
-                while len(mcu_info) < 3:
-                    mcu_info.append("")
-                export_rows.append({
-                    "NIK": nik,
-                    "Employee Name": nama,
-                    "Position": position,
-                    "Employment Status": employment_status, # Tambahkan kolom
-                    "MCU Terbaru": mcu_info[0],
-                    "MCU Ke-2": mcu_info[1],
-                    "MCU Ke-3": mcu_info[2]
-                })
+                    st.write("Posisi berisiko (posisi → poin)")
+                    position_weights = st.data_editor(
+                        pd.DataFrame({"position": list(weights["positions"]), "points": list(weights["positions"].values())},
+                                     columns=["position", "points"]).astype({"position": str, "points": float}),
+                        num_rows="dynamic", hide_index=True, key="risk_positions"
+                    )
+                    if st.form_submit_button("Simpan Bobot"):
+                        age_bands = age_bands.dropna()
+                        position_weights = position_weights.dropna()
+                        mcu_risk.save_risk_weights({
+                            "recurring_diagnosis": w_recurring,
+                            "current_finding": w_finding,
+                            "no_mcu": w_no_mcu,
+                            "mcu_expired": w_expired,
+                            "mcu_will_expire": w_will_expire,
+                            "age_bands": {str(int(r.min_age)): float(r.points) for r in age_bands.itertuples()},
+                            "positions": {str(r.position): float(r.points) for r in position_weights.itertuples() if str(r.position).strip()},
+                        })
+                        mcu_risk.ensure_scores()
+                        st.toast("Bobot disimpan dan skor dihitung ulang.")
+                        safe_rerun()
+        else:
+            st.warning("Diagnosis data not available for monitoring.")
 
-        df_export = pd.DataFrame(export_rows)
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df_export.to_excel(writer, index=False, sheet_name='MCU Data')
-            workbook = writer.book
-            worksheet = writer.sheets['MCU Data']
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'top',
-                'fg_color': '#D7E4BC',
-                'border': 1
-            })
-            for col_num, value in enumerate(df_export.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-
-            for i, col in enumerate(df_export.columns):
-                try:
-                    max_len = max(
-                        df_export[col].astype(str).map(len).max(),
-                        len(col)
-                    ) + 2
-                except Exception:
-                    max_len = len(col) + 2
-                worksheet.set_column(i, i, max_len)
-
-            if export_format == "Excel dengan Link GitHub":
-                for row_idx, row_dict in enumerate(export_rows, start=1):
-                    years = meta_years[row_idx - 1] if (row_idx - 1) < len(meta_years) else ["", "", ""]
-                    for col_offset, col_name in enumerate(["MCU 1", "MCU 2", "MCU 3"]):
-                        url = row_dict.get(col_name, "")
-                        display_year = years[col_offset] if years[col_offset] else ""
-                        if isinstance(url, str) and url.startswith("http"):
-                            display_text = f"MCU {display_year}" if display_year else "MCU"
-                            worksheet.write_url(row_idx, 4 + col_offset, url, string=display_text) # Kolom MCU dimulai dari indeks 4
-                        else:
-                            pass # Jika bukan URL, biarkan kosong di cell
-
-        excel_data = output.getvalue()
-        st.download_button(
-            label="⬇️ Download Excel File",
-            data=excel_data,
-            file_name="mcu_export.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+    elif page == "Multi-Site":
+        show_logo()
+        st.title("🏢 Multi-Site (Konsolidasi Head Office)")
 
-elif page == "Health Monitoring":
-    show_logo()
-    st.title("📈 Employee Health Monitoring")
+        with st.expander("⚙️ Daftar Site"):
+            st.dataframe(mcu_sites.list_sites(enabled_only=False), hide_index=True)
+            # Site = path database di server, jadi hanya admin yang boleh mengubah daftar
+            if not is_admin():
+                st.caption("Hanya admin (MCU_ADMIN_USERS) yang bisa menambah atau menghapus site.")
+            else:
+                with st.form("site_register_form"):
+                    site_name = st.text_input("Nama Site")
+                    site_db_path = st.text_input("Path database site (mcu_database.db)")
+                    site_upload_dir = st.text_input("Path folder uploads site (opsional)")
+                    if st.form_submit_button("Daftarkan Site"):
+                        try:
+                            mcu_sites.register_site(site_name.strip(), site_db_path.strip(), site_upload_dir.strip() or None)
+                            logging.info(f"Site {site_name.strip()} registered by {st.session_state.get('username')}")
+                            st.success(f"Site {site_name} terdaftar.")
+                        except Exception as e:
+                            st.error(f"Gagal mendaftarkan site: {e}")
+                registered = mcu_sites.list_sites(enabled_only=False)['site'].tolist()
+                if registered:
+                    site_to_remove = st.selectbox("Hapus site dari daftar", registered, key="site_remove")
+                    if st.button("Hapus Site", key="site_remove_btn"):
+                        mcu_sites.remove_site(site_to_remove)
+                        logging.info(f"Site {site_to_remove} removed by {st.session_state.get('username')}")
+                        safe_rerun()
 
-    try:
-        conn = sqlite3.connect("database/mcu_database.db")
-        df = pd.read_sql("SELECT * FROM employee", conn)
-        conn.close()
-    except Exception as e:
-        st.error("Failed to load data!")
-        logging.error(f"Monitoring error: {e}")
-        df = pd.DataFrame()
-
-    if not df.empty and 'diagnosis' in df.columns:
-        st.header("Health Trend Chart")
-        st.subheader("Employee Age Histogram")
-        df['birth_date'] = pd.to_datetime(df['birth_date'], errors='coerce')
-        df['age'] = ((datetime.now() - df['birth_date']).dt.days // 365).fillna(0).astype(int)
-        fig1, ax1 = plt.subplots(figsize=(4,3))
-        ax1.hist(df['age'].dropna(), bins=10, color='skyblue', edgecolor='black')
-        ax1.set_title("Employee Age Distribution")
-        ax1.set_xlabel("Age (years)")
-        ax1.set_ylabel("Count")
-        st.pyplot(fig1)
-
-        st.subheader("Diagnosis Trends per Year")
-        df['mcu_date_parsed'] = pd.to_datetime(df['mcu_date'], errors='coerce')
-        df['mcu_year'] = df['mcu_date_parsed'].dt.year
-        if df['mcu_year'].isna().all():
-            st.info("Tidak ada data MCU tahun untuk trend.")
+        sites_df = mcu_sites.list_sites()
+        if sites_df.empty:
+            st.info("Belum ada site terdaftar. Daftarkan database tiap site di atas atau lewat `python mcu_jobs.py site-add`.")
         else:
-            yearly_trend = df.groupby(['mcu_year', 'diagnosis']).size().unstack(fill_value=0)
-            fig2, ax2 = plt.subplots(figsize=(5,3))
-            yearly_trend.plot(kind='bar', stacked=True, ax=ax2)
-            ax2.set_title('Health Diagnosis Trend per Year')
-            ax2.set_xlabel('MCU Year')
-            ax2.set_ylabel('Cases')
-            ax2.legend(title='Diagnosis', bbox_to_anchor=(1,1))
-            st.pyplot(fig2)
-
-        st.subheader("MCU Trend per Month")
-        df['mcu_month'] = df['mcu_date_parsed'].dt.to_period('M').astype(str)
-        monthly_counts = df['mcu_month'].value_counts().sort_index()
-        if monthly_counts.empty:
-            st.info("Tidak ada data MCU per bulan.")
-        else:
-            fig3, (ax3, ax4) = plt.subplots(1, 2, figsize=(8,3))
-            monthly_counts.plot(kind='line', marker='o', ax=ax3, color='green', linewidth=2)
-            ax3.set_title('MCU Count per Month')
-            ax3.set_ylabel('MCU Count')
-            ax3.grid(True)
-            ax3.tick_params(axis='x', rotation=45)
-
-            monthly_counts.plot(kind='pie', ax=ax4, autopct='%1.1f%%',
-                              startangle=90, shadow=True,
-                              colors=plt.cm.Paired.colors)
-            ax4.set_title('MCU Distribution per Month')
-            ax4.set_ylabel('')
-            st.pyplot(fig3)
-
-        st.header("Health Risk Notification")
-        # Filter hanya karyawan tetap untuk peringatan kesehatan
-        df_active = df[df['employment_status'] == 'Permanent']
-        common_issues = df_active['diagnosis'].value_counts().head(3)
-        if not common_issues.empty:
-            st.warning("**⚠️ Warning:** Some common health issues detected (Permanent Employees Only):")
-            for issue, count in common_issues.items():
-                st.write(f"- **{issue}**: {count} employee")
-            expander = st.expander("📋 See Employee Details")
-            for issue in common_issues.index:
-                affected = df_active[df_active['diagnosis'] == issue]
-                for idx, row in affected.iterrows():
-                    expander.markdown(
-                        f"<b>{row['employee_name']} ({row['nik']})</b> | Position: {row.get('position','-')} | Status: {row.get('employment_status', '-')}", unsafe_allow_html=True
-                    )
+            selected_sites = st.multiselect("Site", sites_df['site'].tolist(), default=sites_df['site'].tolist(), key="fed_sites")
+            summary, site_errors = mcu_sites.status_summary(sites=selected_sites)
+            for site_name, error in site_errors.items():
+                st.warning(f"Site {site_name} tidak bisa dibaca: {error}")
+
+            st.header("Status MCU per Site")
+            if summary.empty:
+                st.info("Tidak ada data karyawan di site terpilih.")
+            else:
+                col1, col2, col3, col4 = st.columns(4)
+                by_status = summary.groupby('status')['employees'].sum()
+                col1.metric("Total Employee", int(summary['employees'].sum()))
+                col2.metric("MCU Expired", int(by_status.get("Expired", 0)))
+                col3.metric("Will Expire", int(by_status.get("Will Expire", 0)))
+                col4.metric("Pre Employee", int(by_status.get("Pre Employee", 0)))
+                site_table = summary.pivot_table(index='site', columns='status', values='employees', aggfunc='sum', fill_value=0)
+                st.dataframe(site_table)
+                fig_site, ax_site = plt.subplots(figsize=(5,3))
+                site_table.plot(kind='bar', stacked=True, ax=ax_site)
+                ax_site.set_ylabel('Employees')
+                ax_site.legend(title='Status', bbox_to_anchor=(1,1))
+                st.pyplot(fig_site)
+
+            st.header("Cari Karyawan di Semua Site")
+            fed_query = st.text_input("🔍 Search by NIK or Employee Name", key="fed_search")
+            if fed_query:
+                found, search_errors = mcu_sites.search_employees(fed_query, sites=selected_sites)
+                for site_name, error in search_errors.items():
+                    st.warning(f"Site {site_name} tidak bisa dibaca: {error}")
+                if found.empty:
+                    st.warning("No data found for the search")
+                else:
+                    st.dataframe(found, hide_index=True)
+
+            st.header("Export Konsolidasi")
+            exp_col1, exp_col2 = st.columns(2)
+            with exp_col1:
+                fed_status = st.selectbox("Status MCU", ["All"] + (sorted(summary['status'].dropna().unique().tolist()) if not summary.empty else []), key="fed_status")
+            with exp_col2:
+                fed_emp_status = st.selectbox("Employment Status", ["All", "Permanent", "Probation"], key="fed_emp_status")
+            if st.button("Siapkan Export", key="fed_export_btn"):
+                fed_employees, export_errors = mcu_sites.filtered_employees(
+                    status=fed_status, employment_status=fed_emp_status, sites=selected_sites
+                )
+                if export_errors:
+                    st.warning(f"Site dilewati: {', '.join(export_errors)}")
+                st.download_button(
+                    label="⬇️ Download Excel Konsolidasi",
+                    data=mcu_sites.build_consolidated_workbook(fed_employees, summary),
+                    file_name="mcu_consolidated.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+
+    elif page == "Compliance Trend":
+        show_logo()
+        st.title("📉 Compliance Trend")
+        # Snapshot hari ini diambil otomatis jika job terjadwal belum jalan (idempotent, satu GROUP BY)
+        if not mcu_compliance.has_snapshot():
+            try:
+                mcu_compliance.take_snapshot(include_sites=False)
+            except Exception as e:
+                logging.error(f"Compliance snapshot from page failed: {e}")
+
+        trend_filters = mcu_compliance.snapshot_filters()
+        tcol1, tcol2, tcol3, tcol4 = st.columns(4)
+        with tcol1:
+            trend_range = st.selectbox("Periode", ["90 hari", "1 tahun", "3 tahun", "Semua"], key="trend_range")
+        with tcol2:
+            trend_site = st.selectbox("Site", ["All"] + trend_filters["site"], key="trend_site")
+        with tcol3:
+            trend_position = st.selectbox("Position", ["All"] + trend_filters["position"], key="trend_position")
+        with tcol4:
+            trend_emp_status = st.selectbox("Employment Status", ["All"] + trend_filters["employment_status"], key="trend_emp_status")
+        range_days = {"90 hari": 90, "1 tahun": 365, "3 tahun": 3 * 365}.get(trend_range)
+        since = (datetime.now() - timedelta(days=range_days)).date().isoformat() if range_days else None
+        trend = mcu_compliance.status_trend(since, trend_site, trend_position, trend_emp_status)
+        if trend.empty:
+            st.info("Belum ada snapshot. Jalankan `python mcu_jobs.py compliance-snapshot` secara terjadwal.")
         else:
-            st.success("✅ No common health issues detected among permanent employees.")
-    else:
-        st.warning("Diagnosis data not available for monitoring.")
+            trend_table = trend.pivot(index="snapshot_date", columns="status", values="employees").fillna(0).astype(int)
+            trend_table.index = pd.to_datetime(trend_table.index)
+            first_day, last_day = trend_table.iloc[0], trend_table.iloc[-1]
+            mcol1, mcol2, mcol3, mcol4 = st.columns(4)
+            for column, label, status_name in ((mcol1, "Total Employee", None), (mcol2, "MCU Expired", "Expired"),
+                                               (mcol3, "Will Expire", "Will Expire"), (mcol4, "Pre Employee", "Pre Employee")):
+                now_value = int(last_day.sum() if status_name is None else last_day.get(status_name, 0))
+                start_value = int(first_day.sum() if status_name is None else first_day.get(status_name, 0))
+                column.metric(label, now_value, delta=now_value - start_value,
+                              delta_color="off" if status_name in (None, "Pre Employee") else "inverse")
+            st.caption(f"Perubahan sejak {trend_table.index[0].date()} ({len(trend_table)} hari snapshot)")
+            st.line_chart(trend_table)
+            with st.expander("Data snapshot"):
+                st.dataframe(trend_table.sort_index(ascending=False))
@@ -0,0 +1,198 @@
+"""
+Longitudinal analytics over mcu_history.
+
+The employee table only holds the latest MCU per person, so trends over time
+have to come from mcu_history. All three views (prevalence per year,
+diagnosis transitions, hire-year cohorts) are derived from one "cube": a
+single scan of the full history (hot and archived rows, see mcu_archive)
+reduced with vectorized pandas to counts per (mcu_year, diagnosis,
+is_normal, transition, hire_year). Reads go to the in-memory analytics
+replica (mcu_replica), not the database file. The cube is cached per
+snapshot write version, so the page only pays for the scan after a write.
+
+Transitions compare an employee's diagnosis with their previous MCU year
+(a LAG over the rows sorted by nik, mcu_year).
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+import mcu_replica
+
+# Diagnoses treated as "no finding" when classifying transitions
+NORMAL_DIAGNOSES = ("", "-", "normal", "sehat", "fit", "fit to work", "tidak ada")
+
+TRANSITION_LABELS = {
+    "first": "First MCU",
+    "new": "New",
+    "persisting": "Persisting",
+    "changed": "Changed",
+    "resolved": "Resolved",
+    "normal": "Stays normal",
+}
+
+CUBE_COLUMNS = ["mcu_year", "diagnosis", "is_normal", "transition", "hire_year"]
+
+
+def init_analytics_indexes(conn):
+    # Serves the per-employee LAG lookups below and get_mcu_history_db
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mcu_history_nik_year ON mcu_history (nik, mcu_year)")
+    conn.commit()
+
+
+def _classify(df):
+    """
+    Add is_normal and transition columns to rows sorted by (nik, mcu_year)
+    with one row per employee per year. Diagnoses are expected trimmed.
+    """
+    diagnosis = pd.Categorical(df["diagnosis"].fillna(""))
+    # Lower-case once per distinct diagnosis, then broadcast through the category codes
+    lowered = np.asarray(diagnosis.categories.str.lower(), dtype=object)[diagnosis.codes]
+    is_normal = np.isin(lowered, NORMAL_DIAGNOSES)
+    nik = df["nik"].to_numpy()
+    has_prev = np.zeros(len(df), dtype=bool)
+    has_prev[1:] = nik[1:] == nik[:-1]
+    prev_normal = np.ones(len(df), dtype=bool)
+    prev_normal[1:] = is_normal[:-1]
+    same_diag = np.zeros(len(df), dtype=bool)
+    same_diag[1:] = lowered[1:] == lowered[:-1]
+    transition = np.select(
+        [~has_prev,
+         prev_normal & ~is_normal,
+         ~prev_normal & is_normal,
+         ~prev_normal & same_diag,
+         ~prev_normal],
+        ["first", "new", "resolved", "persisting", "changed"],
+        default="normal"
+    )
+    return df.assign(diagnosis=diagnosis, is_normal=is_normal, transition=transition)
+
+
+def _build_cube(conn):
+    # Trimmed and sorted by SQLite, so pandas only has to compare neighbouring rows
+    rows = conn.execute('''
+    SELECT nik, mcu_year, TRIM(COALESCE(diagnosis, ''))
+    FROM mcu_history_all
+    WHERE mcu_year IS NOT NULL
+    ORDER BY nik, mcu_year, mcu_date, id
+    ''').fetchall()
+    hire_year = dict(conn.execute(
+        "SELECT nik, CAST(SUBSTR(hire_date, 1, 4) AS INTEGER) FROM employee WHERE COALESCE(hire_date, '') != ''"
+    ).fetchall())
+    if not rows:
+        return pd.DataFrame(columns=CUBE_COLUMNS + ["employees"])
+    df = pd.DataFrame.from_records(rows, columns=["nik", "mcu_year", "diagnosis"])
+    # One row per employee per year: the latest MCU of that year is the last row of its run
+    nik = df["nik"].to_numpy()
+    year = df["mcu_year"].to_numpy()
+    last_of_year = np.ones(len(df), dtype=bool)
+    last_of_year[:-1] = (nik[:-1] != nik[1:]) | (year[:-1] != year[1:])
+    df = _classify(df[last_of_year].reset_index(drop=True))
+    df["hire_year"] = df["nik"].map(hire_year)
+    cube = df.groupby(CUBE_COLUMNS, dropna=False, observed=True).size().rename("employees").reset_index()
+    cube["mcu_year"] = cube["mcu_year"].astype(int)
+    cube["diagnosis"] = cube["diagnosis"].astype(str)
+    return cube
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_cube():
+    """
+    The aggregated cube for the current replica snapshot (built at most once
+    per version). Keyed by the snapshot's write version, not the database's:
+    a write only makes the cube stale once the replica has caught up with it.
+    """
+    with _cache_lock:
+        if _cache.get("version") != mcu_replica.snapshot_info()["write_version"]:
+            with mcu_replica.reader() as (conn, snapshot):
+                _cache["cube"] = _build_cube(conn)
+                _cache["version"] = snapshot["write_version"]
+        return _cache["cube"]
+
+
+def diagnosis_prevalence_per_year():
+    """
+    One row per (mcu_year, diagnosis) for abnormal findings: employees with
+    that diagnosis, employees examined that year and the prevalence ratio.
+    """
+    cube = get_cube()
+    if cube.empty:
+        return pd.DataFrame(columns=["mcu_year", "diagnosis", "employees", "examined", "prevalence"])
+    examined = cube.groupby("mcu_year")["employees"].sum().rename("examined")
+    abnormal = cube[~cube["is_normal"]].groupby(["mcu_year", "diagnosis"])["employees"].sum().reset_index()
+    result = abnormal.join(examined, on="mcu_year")
+    result["prevalence"] = (result["employees"] / result["examined"]).round(4)
+    return result.sort_values(["mcu_year", "employees"], ascending=[True, False]).reset_index(drop=True)
+
+
+def diagnosis_transitions_per_year():
+    """
+    Count of employees per (mcu_year, transition): new, persisting, changed,
+    resolved, stays normal, or first MCU.
+    """
+    cube = get_cube()
+    if cube.empty:
+        return pd.DataFrame(columns=["mcu_year", "transition", "employees"])
+    return cube.groupby(["mcu_year", "transition"])["employees"].sum().reset_index()
+
+
+def cohort_by_hire_year():
+    """
+    For each hire-year cohort and MCU year: employees examined, employees
+    with an abnormal finding and the abnormal rate.
+    """
+    cube = get_cube()
+    cube = cube[cube["hire_year"].notna()] if not cube.empty else cube
+    if cube.empty:
+        return pd.DataFrame(columns=["hire_year", "mcu_year", "examined", "abnormal", "abnormal_rate"])
+    cube = cube.assign(abnormal=np.where(cube["is_normal"], 0, cube["employees"]), hire_year=cube["hire_year"].astype(int))
+    result = cube.groupby(["hire_year", "mcu_year"]).agg(examined=("employees", "sum"), abnormal=("abnormal", "sum")).reset_index()
+    result["abnormal_rate"] = (result["abnormal"] / result["examined"]).round(4)
+    return result
+
+
+def employee_transitions(mcu_year, transition, limit=200):
+    """
+    Employees with a given transition in a given year. Not cached: only the
+    rows of that year are read, and each one looks up its previous MCU
+    through the (nik, mcu_year) index.
+    """
+    sql = '''
+    WITH cur AS (
+        SELECT nik, mcu_year, diagnosis,
+               ROW_NUMBER() OVER (PARTITION BY nik ORDER BY mcu_date DESC, id DESC) AS rn
+        FROM mcu_history_all
+        WHERE mcu_year = ?
+    )
+    SELECT c.nik, c.mcu_year, c.diagnosis,
+           (SELECT p.diagnosis FROM mcu_history_all p
+            WHERE p.nik = c.nik AND p.mcu_year < c.mcu_year
+            ORDER BY p.mcu_year DESC, p.mcu_date DESC, p.id DESC LIMIT 1) AS prev_diagnosis,
+           EXISTS (SELECT 1 FROM mcu_history_all p WHERE p.nik = c.nik AND p.mcu_year < c.mcu_year) AS has_prev
+    FROM cur c
+    WHERE c.rn = 1
+    ORDER BY c.nik
+    '''
+    with mcu_replica.reader() as (conn, _):
+        df = pd.read_sql(sql, conn, params=(int(mcu_year),))
+        if df.empty:
+            return pd.DataFrame(columns=["nik", "employee_name", "position", "prev_diagnosis", "diagnosis"])
+        # Classify each row against its previous MCU with the same rules as the cube
+        pairs = pd.DataFrame({
+            "nik": np.repeat(df["nik"].to_numpy(), 2),
+            "diagnosis": np.column_stack([df["prev_diagnosis"].to_numpy(), df["diagnosis"].to_numpy()]).ravel(),
+        })
+        pairs["diagnosis"] = pairs["diagnosis"].fillna("").astype(str).str.strip()
+        classified = _classify(pairs).iloc[1::2].reset_index(drop=True)
+        transitions = np.where(df["has_prev"].astype(bool), classified["transition"], "first")
+        df = df[transitions == transition].head(int(limit))
+        niks = df["nik"].tolist()
+        names = pd.read_sql(
+            f"SELECT nik, employee_name, position FROM employee WHERE nik IN ({','.join('?' * len(niks))})",
+            conn, params=niks
+        ) if niks else pd.DataFrame(columns=["nik", "employee_name", "position"])
+    return df.merge(names, on="nik", how="left")[["nik", "employee_name", "position", "prev_diagnosis", "diagnosis"]]
@@ -0,0 +1,200 @@
+"""
+Hot/cold split of mcu_history.
+
+Rows for MCU years older than MCU_HISTORY_HOT_YEARS are moved by
+archive_old_history() into the same-named table of a separate database
+(database/mcu_archive.db), attached to connections as `archive`. The hot
+table stays small, so the per-employee history page, the export and the
+dashboard only read recent rows.
+
+Callers that need the full history (analytics, risk scoring, file GC) call
+attach_archive() and read `mcu_history_all` instead of mcu_history: a
+temporary view over both tables with the same columns. Row ids are kept when
+rows are moved (mcu_history.id is AUTOINCREMENT, so an id is never reused),
+so manifest rows pointing at mcu_history_id stay valid.
+
+Each employee's latest row always stays hot, however old: it is the row
+the latest-MCU projection on employee (mcu_projection) is read from.
+"""
+import logging
+import os
+from datetime import datetime
+
+import pandas as pd
+
+import mcu_changelog
+from mcu_db import DB_DIR, get_connection
+
+ARCHIVE_DB_PATH = os.path.join(DB_DIR, "mcu_archive.db")
+ARCHIVE_SCHEMA = "archive"
+HOT_YEARS = int(os.environ.get("MCU_HISTORY_HOT_YEARS", "5"))
+ARCHIVE_BATCH_SIZE = 5000
+
+HISTORY_COLUMNS = ("id", "nik", "mcu_year", "mcu_date", "expired_date", "file_name", "diagnosis", "recommendation")
+
+# Old enough to archive and not the employee's latest row
+ARCHIVABLE_SQL = '''
+mcu_year < ? AND EXISTS (
+    SELECT 1 FROM main.mcu_history n WHERE n.nik = h.nik
+    AND (n.mcu_year, n.mcu_date, n.id) > (h.mcu_year, h.mcu_date, h.id)
+)
+'''
+
+
+def attach_archive(conn, archive_path=ARCHIVE_DB_PATH):
+    """
+    Attach the archive database (created on first use) and define the
+    temporary mcu_history_all view on this connection. Safe to call twice.
+    """
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if ARCHIVE_SCHEMA not in attached:
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_path,))
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.mcu_history (
+        id INTEGER PRIMARY KEY,
+        nik TEXT,
+        mcu_year INTEGER,
+        mcu_date TEXT,
+        expired_date TEXT,
+        file_name TEXT,
+        diagnosis TEXT,
+        recommendation TEXT,
+        archived_at TEXT
+    )
+    ''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_archive_history_nik_year ON mcu_history (nik, mcu_year)")
+    columns = ", ".join(HISTORY_COLUMNS)
+    conn.execute(f'''
+    CREATE TEMP VIEW IF NOT EXISTS mcu_history_all AS
+    SELECT {columns} FROM main.mcu_history
+    UNION ALL
+    SELECT {columns} FROM {ARCHIVE_SCHEMA}.mcu_history
+    ''')
+    return conn
+
+
+def init_archive_tables(conn):
+    attach_archive(conn)
+    conn.commit()
+
+
+def get_full_connection():
+    """
+    Connection with the archive attached, for readers of mcu_history_all.
+    """
+    return attach_archive(get_connection())
+
+
+def get_history(conn, nik, full=False):
+    """
+    MCU history of one employee, newest first. With full=True archived rows
+    are included (the connection gets the archive attached).
+    """
+    table = "mcu_history"
+    if full:
+        attach_archive(conn)
+        table = "mcu_history_all"
+    return pd.read_sql(
+        f"SELECT {', '.join(HISTORY_COLUMNS)} FROM {table} WHERE nik=? ORDER BY mcu_year DESC",
+        conn, params=(nik,)
+    )
+
+
+def count_archived(nik, conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        attach_archive(conn)
+        return conn.execute(f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.mcu_history WHERE nik=?", (nik,)).fetchone()[0]
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def delete_archived(conn, where, params):
+    """
+    Delete archived rows matching `where` (e.g. "nik=?"), so deleting an
+    employee or a history entry also removes its cold rows. Does not commit.
+    The archive has no write_version triggers, so the counter is bumped here.
+    """
+    attach_archive(conn)
+    mcu_changelog.record_deletes(conn, "mcu_history", f"{ARCHIVE_SCHEMA}.mcu_history", where, params)
+    # The archive has no triggers either: drop the owners' profile documents (mcu_profile)
+    conn.execute(f"DELETE FROM employee_profile WHERE nik IN (SELECT nik FROM {ARCHIVE_SCHEMA}.mcu_history WHERE {where})",
+                 params)
+    removed = conn.execute(f"DELETE FROM {ARCHIVE_SCHEMA}.mcu_history WHERE {where}", params).rowcount
+    if removed:
+        conn.execute("UPDATE write_version SET version = version + 1 WHERE id = 1")
+    return removed
+
+
+def restore_latest(conn, nik):
+    """
+    Move an employee's latest archived row back to the hot table when no hot
+    row is left (its newer rows were deleted), so the latest-MCU projection
+    has its source again. Does not commit. Returns the number of rows moved.
+    """
+    attach_archive(conn)
+    if conn.execute("SELECT 1 FROM main.mcu_history WHERE nik=? LIMIT 1", (nik,)).fetchone():
+        return 0
+    row = conn.execute(
+        f"SELECT id FROM {ARCHIVE_SCHEMA}.mcu_history WHERE nik=? ORDER BY mcu_year DESC, mcu_date DESC, id DESC LIMIT 1",
+        (nik,)
+    ).fetchone()
+    if row is None:
+        return 0
+    columns = ", ".join(HISTORY_COLUMNS)
+    # Only the row's move is kept out of the feed; the employee re-projection it causes is logged
+    mcu_changelog.set_capture(conn, "mcu_history", False)
+    conn.execute(f"INSERT INTO main.mcu_history ({columns}) SELECT {columns} FROM {ARCHIVE_SCHEMA}.mcu_history WHERE id=?", row)
+    conn.execute(f"DELETE FROM {ARCHIVE_SCHEMA}.mcu_history WHERE id=?", row)
+    mcu_changelog.set_capture(conn, "mcu_history", True)
+    return 1
+
+
+def archive_old_history(older_than_years=HOT_YEARS, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """
+    Move mcu_history rows with mcu_year older than the cutoff (except each
+    employee's latest row) into the archive, `batch_size` rows per transaction. Each batch is copied and
+    deleted in one transaction spanning both databases, so a row is never
+    lost or visible twice. Returns {"cutoff_year", "rows"}.
+    """
+    cutoff_year = datetime.now().year - older_than_years
+    conn = get_full_connection()
+    moved = 0
+    try:
+        if dry_run:
+            rows = conn.execute(f"SELECT COUNT(*) FROM main.mcu_history h WHERE {ARCHIVABLE_SQL}", (cutoff_year,)).fetchone()[0]
+            return {"cutoff_year": cutoff_year, "rows": rows}
+        columns = ", ".join(HISTORY_COLUMNS)
+        archived_at = datetime.now().isoformat(timespec="seconds")
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [r[0] for r in conn.execute(
+                    f"SELECT id FROM main.mcu_history h WHERE {ARCHIVABLE_SQL} ORDER BY id LIMIT ?",
+                    (cutoff_year, batch_size)
+                )]
+                if not ids:
+                    conn.rollback()
+                    break
+                placeholders = ",".join("?" * len(ids))
+                conn.execute(f'''
+                INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.mcu_history ({columns}, archived_at)
+                SELECT {columns}, ? FROM main.mcu_history WHERE id IN ({placeholders})
+                ''', [archived_at] + ids)
+                # A move, not a delete: keep it out of the change feed
+                mcu_changelog.set_capture(conn, "mcu_history", False)
+                conn.execute(f"DELETE FROM main.mcu_history WHERE id IN ({placeholders})", ids)
+                mcu_changelog.set_capture(conn, "mcu_history", True)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            moved += len(ids)
+    finally:
+        conn.close()
+    logging.info(f"Archived {moved} mcu_history row(s) older than {cutoff_year}",
+                 extra={"operation": "archive_history", "rows": moved})
+    return {"cutoff_year": cutoff_year, "rows": moved}
@@ -0,0 +1,346 @@
+"""
+Online backup of the MCU database and incremental snapshots of uploads.
+
+Layout of a backup destination:
+
+    <dest>/snapshots/<snapshot_id>/mcu_database.db   online copy of the database
+    <dest>/snapshots/<snapshot_id>/mcu_archive.db    online copy of the history archive (if any)
+    <dest>/snapshots/<snapshot_id>/snapshot.json     upload listing (path, size, mtime, sha256)
+    <dest>/objects/<sha[:2]>/<sha>                   upload contents, stored once per hash
+
+The database is copied with the SQLite online backup API a few pages at a
+time, so writers in the app are only blocked for one short step at a time.
+The database is not in WAL mode, so every commit from the app restarts that
+copy from page 1; after MAX_BACKUP_RESTARTS restarts it falls back to one
+step, which holds the read lock for the whole copy (writers wait, up to
+their busy timeout) but always finishes. Once a history archive exists,
+the database and the archive are copied together in one read transaction
+instead, since archive_old_history moves rows between them.
+Uploads are content-addressed: a file whose size and mtime match the previous
+snapshot is not read again, and a hash already present in objects/ is never
+copied again.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from mcu_archive import ARCHIVE_DB_PATH, ARCHIVE_SCHEMA, get_full_connection
+from mcu_db import DB_PATH, UPLOAD_DIR, get_connection
+
+SNAPSHOT_DIR = "snapshots"
+OBJECT_DIR = "objects"
+DB_FILE_NAME = "mcu_database.db"
+ARCHIVE_FILE_NAME = "mcu_archive.db"
+SNAPSHOT_INDEX = "snapshot.json"
+# Microseconds keep two runs in the same second apart; ids sort chronologically
+SNAPSHOT_ID_FORMAT = "%Y%m%dT%H%M%S%f"
+# Snapshots taken before ids carried microseconds
+LEGACY_SNAPSHOT_ID_FORMAT = "%Y%m%dT%H%M%S"
+COPY_CHUNK_SIZE = 1024 * 1024
+MAX_BACKUP_RESTARTS = int(os.environ.get("MCU_BACKUP_MAX_RESTARTS", "3"))
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def _object_path(dest, sha256):
+    return os.path.join(dest, OBJECT_DIR, sha256[:2], sha256)
+
+
+def list_snapshots(dest):
+    snap_root = os.path.join(dest, SNAPSHOT_DIR)
+    if not os.path.isdir(snap_root):
+        return []
+    return sorted(name for name in os.listdir(snap_root)
+                  if not name.endswith(".tmp") and os.path.exists(os.path.join(snap_root, name, SNAPSHOT_INDEX)))
+
+
+def _load_index(dest, snapshot_id):
+    with open(os.path.join(dest, SNAPSHOT_DIR, snapshot_id, SNAPSHOT_INDEX)) as f:
+        return json.load(f)
+
+
+def backup_database(target_path, pages=64, sleep=0.05, db_path=DB_PATH, max_restarts=MAX_BACKUP_RESTARTS):
+    """
+    Copy the live database with the online backup API, `pages` pages per step.
+    The source lock is released between steps, so app requests interleave;
+    a write by another connection in between restarts the copy, and after
+    `max_restarts` restarts the rest is copied in one step.
+    """
+    restarts = 0
+    last_remaining = None
+
+    def _progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                # Raising aborts the stepped backup
+                raise _BackupRestarted()
+        last_remaining = remaining
+
+    src = get_connection(db_path)
+    dst = sqlite3.connect(target_path)
+    try:
+        try:
+            src.backup(dst, pages=pages, sleep=sleep, progress=_progress)
+        except _BackupRestarted:
+            logging.warning(f"Backup of {db_path} restarted {restarts} times by writers, copying in one step")
+            src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return restarts
+
+
+def backup_database_with_archive(target_path, archive_target_path):
+    """
+    Copy the database and the history archive at one point in time: one
+    connection with the archive attached holds a read transaction on both
+    files while each is copied in one step (as mcu_replica does), so an
+    archive_old_history batch can never land between the two copies.
+    Writers wait for the copy, up to their busy timeout.
+    """
+    src = get_full_connection()
+    dst = sqlite3.connect(target_path)
+    archive_dst = sqlite3.connect(archive_target_path)
+    try:
+        src.execute("BEGIN")
+        try:
+            # Shared locks on both files before either is copied
+            src.execute("SELECT COUNT(*) FROM main.sqlite_master")
+            src.execute(f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.sqlite_master")
+            src.backup(dst, name="main")
+            src.backup(archive_dst, name=ARCHIVE_SCHEMA)
+        finally:
+            src.rollback()
+    finally:
+        archive_dst.close()
+        dst.close()
+        src.close()
+
+
+def _walk_uploads(upload_dir, exclude_dir=None):
+    exclude = os.path.realpath(exclude_dir) if exclude_dir else None
+    for root, dirs, files in os.walk(upload_dir):
+        if exclude and os.path.realpath(root).startswith(exclude):
+            dirs[:] = []
+            continue
+        for fname in files:
+            file_path = os.path.join(root, fname)
+            rel_path = os.path.relpath(file_path, upload_dir).replace(os.sep, "/")
+            yield rel_path, file_path
+
+
+def _store_object(dest, file_path):
+    """
+    Stream a file into objects/ while hashing it. Returns (sha256, copied).
+    """
+    tmp_dir = os.path.join(dest, OBJECT_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{os.getpid()}-{time.time_ns()}")
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as src, open(tmp_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            dst.write(chunk)
+    sha256 = digest.hexdigest()
+    obj_path = _object_path(dest, sha256)
+    if os.path.exists(obj_path):
+        os.remove(tmp_path)
+        return sha256, False
+    os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+    os.replace(tmp_path, obj_path)
+    return sha256, True
+
+
+def create_snapshot(dest, pages=64, sleep=0.05, workers=4, upload_dir=UPLOAD_DIR):
+    """
+    Take one snapshot (database + uploads) into `dest`. Returns a summary dict.
+    The snapshot directory is written as <id>.tmp and renamed when complete,
+    so an interrupted run never leaves a half snapshot behind.
+    """
+    started = time.time()
+    snapshot_id = datetime.now().strftime(SNAPSHOT_ID_FORMAT)
+    snap_root = os.path.join(dest, SNAPSHOT_DIR)
+    work_dir = os.path.join(snap_root, snapshot_id + ".tmp")
+    os.makedirs(snap_root, exist_ok=True)
+    if os.path.exists(os.path.join(snap_root, snapshot_id)):
+        raise FileExistsError(f"Snapshot {snapshot_id} already exists")
+    # Fails if another run already writes this id, instead of mixing both into one snapshot
+    os.mkdir(work_dir)
+
+    if os.path.exists(ARCHIVE_DB_PATH):
+        # Rows move between the two files, so they are copied together
+        backup_database_with_archive(os.path.join(work_dir, DB_FILE_NAME), os.path.join(work_dir, ARCHIVE_FILE_NAME))
+    else:
+        backup_database(os.path.join(work_dir, DB_FILE_NAME), pages=pages, sleep=sleep)
+    db_seconds = time.time() - started
+
+    # Size+mtime of the previous snapshot lets unchanged files skip hashing entirely
+    previous = {}
+    earlier = list_snapshots(dest)
+    if earlier:
+        previous = {e["path"]: e for e in _load_index(dest, earlier[-1])["files"]}
+
+    def _snapshot_file(item):
+        rel_path, file_path = item
+        st_ = os.stat(file_path)
+        prev = previous.get(rel_path)
+        if prev and prev["size"] == st_.st_size and prev["mtime"] == st_.st_mtime \
+                and os.path.exists(_object_path(dest, prev["sha256"])):
+            return {"path": rel_path, "size": st_.st_size, "mtime": st_.st_mtime, "sha256": prev["sha256"]}, False
+        sha256, copied = _store_object(dest, file_path)
+        return {"path": rel_path, "size": st_.st_size, "mtime": st_.st_mtime, "sha256": sha256}, copied
+
+    files = list(_walk_uploads(upload_dir, exclude_dir=dest))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(_snapshot_file, files))
+
+    entries = [entry for entry, _ in results]
+    copied = [entry for entry, was_copied in results if was_copied]
+    index = {
+        "snapshot_id": snapshot_id,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "files": entries,
+    }
+    with open(os.path.join(work_dir, SNAPSHOT_INDEX), "w") as f:
+        json.dump(index, f)
+    os.replace(work_dir, os.path.join(snap_root, snapshot_id))
+
+    summary = {
+        "snapshot_id": snapshot_id,
+        "files": len(entries),
+        "files_copied": len(copied),
+        "bytes_copied": sum(e["size"] for e in copied),
+        "db_seconds": round(db_seconds, 2),
+        "total_seconds": round(time.time() - started, 2),
+    }
+    logging.info(f"Backup snapshot created: {summary}")
+    return summary
+
+
+def snapshot_time(snapshot_id):
+    fmt = SNAPSHOT_ID_FORMAT if len(snapshot_id) > len("YYYYmmddTHHMMSS") else LEGACY_SNAPSHOT_ID_FORMAT
+    return datetime.strptime(snapshot_id, fmt)
+
+
+def resolve_snapshot(dest, at=None):
+    """
+    Pick the snapshot to restore: the latest one, or the latest taken at or
+    before `at` (datetime) for point-in-time restore.
+    """
+    snapshots = list_snapshots(dest)
+    if at is not None:
+        snapshots = [s for s in snapshots if snapshot_time(s) <= at]
+    if not snapshots:
+        raise ValueError("No snapshot available for the requested time")
+    return snapshots[-1]
+
+
+def verify_snapshot(dest, snapshot_id, deep=True):
+    """
+    Check the database copy with PRAGMA integrity_check and make sure every
+    upload object exists (and, with deep=True, still hashes to its name).
+    Returns a list of problems; empty means the snapshot is restorable.
+    """
+    problems = []
+    for file_name in (DB_FILE_NAME, ARCHIVE_FILE_NAME):
+        db_copy = os.path.join(dest, SNAPSHOT_DIR, snapshot_id, file_name)
+        if file_name == ARCHIVE_FILE_NAME and not os.path.exists(db_copy):
+            continue
+        try:
+            conn = sqlite3.connect(f"file:{db_copy}?mode=ro", uri=True)
+            result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            conn.close()
+            if result != "ok":
+                problems.append(f"{file_name}: {result}")
+        except Exception as e:
+            problems.append(f"{file_name}: {e}")
+
+    checked = set()
+    for entry in _load_index(dest, snapshot_id)["files"]:
+        sha256 = entry["sha256"]
+        if sha256 in checked:
+            continue
+        checked.add(sha256)
+        obj_path = _object_path(dest, sha256)
+        if not os.path.exists(obj_path):
+            problems.append(f"missing object for {entry['path']}")
+        elif deep:
+            digest = hashlib.sha256()
+            with open(obj_path, "rb") as f:
+                for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            if digest.hexdigest() != sha256:
+                problems.append(f"corrupt object for {entry['path']}")
+    return problems
+
+
+def restore_snapshot(dest, snapshot_id, target_dir):
+    """
+    Materialise a snapshot as a fresh database directory in `target_dir`
+    (target_dir/mcu_database.db, mcu_archive.db if the snapshot has one, and
+    target_dir/uploads/...). Restore into an empty directory and swap it in
+    while the app is stopped.
+    """
+    if os.path.exists(target_dir) and os.listdir(target_dir):
+        raise ValueError(f"Restore target {target_dir} is not empty")
+    os.makedirs(target_dir, exist_ok=True)
+    for file_name in (DB_FILE_NAME, ARCHIVE_FILE_NAME):
+        db_copy = os.path.join(dest, SNAPSHOT_DIR, snapshot_id, file_name)
+        if os.path.exists(db_copy):
+            shutil.copy2(db_copy, os.path.join(target_dir, file_name))
+    index = _load_index(dest, snapshot_id)
+    for entry in index["files"]:
+        out_path = os.path.join(target_dir, "uploads", *entry["path"].split("/"))
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        shutil.copyfile(_object_path(dest, entry["sha256"]), out_path)
+        os.utime(out_path, (entry["mtime"], entry["mtime"]))
+    logging.info(f"Restored snapshot {snapshot_id} into {target_dir}")
+    return len(index["files"])
+
+
+def prune_snapshots(dest, keep):
+    """
+    Keep the newest `keep` snapshots and delete objects no longer referenced.
+    """
+    snapshots = list_snapshots(dest)
+    removed = snapshots[:-keep] if keep and len(snapshots) > keep else []
+    for snapshot_id in removed:
+        shutil.rmtree(os.path.join(dest, SNAPSHOT_DIR, snapshot_id))
+    if removed:
+        live = set()
+        for snapshot_id in list_snapshots(dest):
+            live.update(e["sha256"] for e in _load_index(dest, snapshot_id)["files"])
+        obj_root = os.path.join(dest, OBJECT_DIR)
+        for root, _, files in os.walk(obj_root):
+            if os.path.basename(root) == "tmp":
+                continue
+            for fname in files:
+                if fname not in live:
+                    os.remove(os.path.join(root, fname))
+    return removed
+
+
+def run_scheduled(dest, every_minutes, keep, **kwargs):
+    """
+    Blocking loop for the scheduled mode: snapshot, verify (shallow), prune, sleep.
+    """
+    while True:
+        try:
+            summary = create_snapshot(dest, **kwargs)
+            problems = verify_snapshot(dest, summary["snapshot_id"], deep=False)
+            if problems:
+                logging.error(f"Snapshot {summary['snapshot_id']} failed verification: {problems}")
+            prune_snapshots(dest, keep)
+        except Exception as e:
+            logging.error(f"Scheduled backup failed: {e}")
+        time.sleep(every_minutes * 60)
@@ -0,0 +1,210 @@
+"""
+Append-only change feed of employee and mcu_history for downstream sync.
+
+Triggers on both tables append one row per inserted, updated or deleted
+record to change_log. Like write_version, capture happens in the database,
+so every writer (the app forms, bulk actions, imports, the CLI) is covered
+without bookkeeping in the write paths. Updates that do not change a synced
+column (e.g. the reminder_sent flag) are not logged.
+
+Each change has a strictly increasing `seq` (AUTOINCREMENT, never reused).
+Consumers keep the last seq they applied as their cursor and ask for the
+changes after it, one page at a time:
+
+    python mcu_jobs.py changes --after 0 --limit 1000 > page.ndjson
+    curl 'http://host:8601/changes?after=0&limit=1000'   (python mcu_jobs.py changes-serve)
+
+Each NDJSON line is {"seq", "table", "op", "key", "nik", "changed_at",
+"data"}; `data` is the full row after the change (null for deletes). The
+next cursor is the seq of the last line (also returned in the
+X-Next-Cursor header / on stderr). To bootstrap, import the full export
+and start from the cursor returned by head_seq() just before it.
+"""
+import json
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from mcu_db import get_connection
+
+CHANGES_PAGE_SIZE = 1000
+CHANGES_MAX_PAGE_SIZE = 10000
+CHANGES_PORT = int(os.environ.get("MCU_CHANGES_PORT", "8601"))
+
+# Columns carried in `data`; employee.reminder_sent is internal bookkeeping
+SYNC_COLUMNS = {
+    "employee": ("id", "nik", "employee_name", "birth_date", "position", "hire_date", "work_period",
+                 "mcu_date", "mcu_expired", "file_mcu_main", "examination_result", "diagnosis",
+                 "recommendation", "status", "email", "employment_status"),
+    "mcu_history": ("id", "nik", "mcu_year", "mcu_date", "expired_date", "file_name", "diagnosis",
+                    "recommendation"),
+}
+# Record key per table: employees are identified by NIK, history rows by id
+KEY_COLUMNS = {"employee": "nik", "mcu_history": "id"}
+
+
+def _json_object(prefix, columns):
+    return "json_object(" + ", ".join(f"'{c}', {prefix}.{c}" for c in columns) + ")"
+
+
+def init_changelog(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        op TEXT NOT NULL,
+        row_key TEXT NOT NULL,
+        nik TEXT,
+        changed_at TEXT NOT NULL,
+        data TEXT
+    )
+    ''')
+    # capture=0 for a table while a job moves its rows without changing them (mcu_archive);
+    # per table, so what those moves cause in other tables (the employee projection) is still logged
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS change_log_capture (
+        table_name TEXT PRIMARY KEY,
+        capture INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+    conn.executemany("INSERT OR IGNORE INTO change_log_capture (table_name, capture) VALUES (?, 1)",
+                     [(table,) for table in SYNC_COLUMNS])
+    # Triggers of the former single switch (change_log_state) are recreated below
+    for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND sql LIKE '%change_log_state%'"
+    ).fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.execute("DROP TABLE IF EXISTS change_log_state")
+    now = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, columns in SYNC_COLUMNS.items():
+        # The CLI may run before the app created the tables; init_db adds the triggers later
+        if table not in existing:
+            continue
+        key = KEY_COLUMNS[table]
+        capturing = f"(SELECT capture FROM change_log_capture WHERE table_name = '{table}') = 1"
+        changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in columns)
+        statements = {
+            "insert": (capturing, "NEW", _json_object("NEW", columns)),
+            "update": (f"{capturing} AND ({changed})", "NEW", _json_object("NEW", columns)),
+            "delete": (capturing, "OLD", "NULL"),
+        }
+        for op, (when, row, data) in statements.items():
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_changelog AFTER {op.upper()} ON {table}
+            WHEN {when}
+            BEGIN
+                INSERT INTO change_log (table_name, op, row_key, nik, changed_at, data)
+                VALUES ('{table}', '{op}', {row}.{key}, {row}.nik, {now}, {data});
+            END
+            ''')
+    conn.commit()
+
+
+def set_capture(conn, table, enabled):
+    """
+    Turn trigger capture of `table` on/off inside the caller's write
+    transaction. Only for jobs that move rows of that table without changing
+    them; turn it back on before committing.
+    """
+    conn.execute("UPDATE change_log_capture SET capture = ? WHERE table_name = ?", (1 if enabled else 0, table))
+
+
+def record_deletes(conn, table, source, where, params):
+    """
+    Log deletes of rows from a table without triggers (the attached history
+    archive). Call before the DELETE, in the same transaction.
+    """
+    key = KEY_COLUMNS[table]
+    conn.execute(f'''
+    INSERT INTO change_log (table_name, op, row_key, nik, changed_at, data)
+    SELECT '{table}', 'delete', {key}, nik, strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'), NULL
+    FROM {source} WHERE {where}
+    ''', params)
+
+
+def head_seq(conn=None):
+    """
+    The latest sequence number (0 when nothing was logged yet).
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def read_changes(after=0, limit=CHANGES_PAGE_SIZE, tables=None):
+    """
+    One page of changes with seq > after, oldest first, read through the
+    primary key. Returns a list of dicts; an empty list means up to date.
+    """
+    limit = max(1, min(int(limit), CHANGES_MAX_PAGE_SIZE))
+    sql = "SELECT seq, table_name, op, row_key, nik, changed_at, data FROM change_log WHERE seq > ?"
+    params = [int(after)]
+    if tables:
+        sql += f" AND table_name IN ({','.join('?' * len(tables))})"
+        params.extend(tables)
+    sql += " ORDER BY seq LIMIT ?"
+    params.append(limit)
+    conn = get_connection()
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    return [
+        {"seq": seq, "table": table, "op": op, "key": key, "nik": nik, "changed_at": changed_at,
+         "data": json.loads(data) if data else None}
+        for seq, table, op, key, nik, changed_at, data in rows
+    ]
+
+
+def to_ndjson(changes):
+    return "".join(json.dumps(c, ensure_ascii=False) + "\n" for c in changes)
+
+
+class _ChangesHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/changes":
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        try:
+            after = int(query.get("after", ["0"])[0])
+            limit = int(query.get("limit", [str(CHANGES_PAGE_SIZE)])[0])
+            changes = read_changes(after, limit, query.get("table"))
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        except Exception as e:
+            logging.error(f"Change feed request failed: {e}")
+            self.send_error(500)
+            return
+        body = to_ndjson(changes).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Next-Cursor", str(changes[-1]["seq"] if changes else after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(f"changes {self.address_string()} {format % args}")
+
+
+def serve(host="127.0.0.1", port=CHANGES_PORT):
+    """
+    Blocking HTTP endpoint: GET /changes?after=<seq>&limit=<n>[&table=employee].
+    Read-only; put it behind the same network rules as the dashboard.
+    """
+    server = ThreadingHTTPServer((host, port), _ChangesHandler)
+    logging.info(f"Change feed listening on http://{host}:{port}/changes")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,235 @@
+"""
+Cache coherence between dashboard replicas sharing one database volume.
+
+Every in-process cache keys on, or is cleared by, the shared write_version
+counter (mcu_db.init_write_version): triggers bump it on any write to
+employee/mcu_history, whichever container made the write. This module
+watches that counter cheaply:
+
+- current_write_version() runs `PRAGMA data_version` on one long-lived
+  connection per process. SQLite changes that value whenever another
+  connection (in this or any other process) commits, without reading any
+  table, so the counter itself is only re-read after a commit. Reads are
+  therefore never stale, at a fraction of the cost of opening a connection
+  for get_write_version() on every call.
+- A daemon poller does the same check every MCU_COHERENCE_POLL_MS and
+  calls the invalidation hooks registered with on_change(), so caches are
+  dropped within that delay of a write anywhere even if nobody reads them.
+
+Renditions and export artifacts are keyed by content hash / write version
+on the shared volume and need no hook. `python mcu_jobs.py coherence-check`
+runs several reader processes against a scratch database and reports how
+quickly each one saw each write.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from mcu_db import DB_PATH, init_write_version
+
+POLL_INTERVAL = int(os.environ.get("MCU_COHERENCE_POLL_MS", "250")) / 1000
+
+
+class VersionWatcher:
+    def __init__(self, db_path=DB_PATH, poll_interval=POLL_INTERVAL):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._write_version = None
+        self._hooks = []
+        self._poller = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        # Autocommit: a lingering read transaction would freeze data_version
+        conn.isolation_level = None
+        return conn
+
+    def _check(self):
+        """
+        Re-read write_version if anything was committed since the last check.
+        Returns (version, changed). Caller holds the lock.
+        """
+        if self._conn is None:
+            self._conn = self._connect()
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version and self._write_version is not None:
+            return self._write_version, False
+        row = self._conn.execute("SELECT version FROM write_version WHERE id = 1").fetchone()
+        version = row[0] if row else 0
+        changed = self._write_version is not None and version != self._write_version
+        self._data_version, self._write_version = data_version, version
+        return version, changed
+
+    def current_write_version(self):
+        with self._lock:
+            try:
+                version, changed = self._check()
+            except sqlite3.Error:
+                # Reopen on the next call (e.g. the volume was remounted)
+                self._close()
+                raise
+        if changed:
+            self._fire(version)
+        return version
+
+    def on_change(self, hook):
+        """
+        Call hook(new_version) after a write_version change is seen, from the
+        poller thread or from the reader that noticed it first.
+        """
+        self._hooks.append(hook)
+        self.start_poller()
+
+    def _fire(self, version):
+        for hook in list(self._hooks):
+            try:
+                hook(version)
+            except Exception as e:
+                logging.warning(f"Cache invalidation hook failed: {e}")
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.current_write_version()
+            except Exception as e:
+                logging.warning(f"Write version poll failed: {e}")
+
+    def start_poller(self):
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name="mcu-coherence", daemon=True)
+                self._poller.start()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._data_version = self._write_version = None
+
+
+_watcher = VersionWatcher()
+
+
+def current_write_version():
+    """
+    The shared write_version, checked against other writers on every call.
+    """
+    return _watcher.current_write_version()
+
+
+def on_change(hook):
+    _watcher.on_change(hook)
+
+
+# ----------------- multi-process self-check
+
+def _reader_replica(replica, db_path, poll_interval, commands, results, passive):
+    watcher = VersionWatcher(db_path, poll_interval)
+    watcher.current_write_version()
+    watcher.on_change(lambda version: results.put(("push", replica, version, time.time())))
+    results.put(("ready", replica, None, None))
+    while True:
+        expected = commands.get()
+        if expected is None:
+            break
+        if passive:
+            # Never reads: only the poller can notice the write
+            continue
+        # Read right after the writer's commit: must already see it
+        results.put(("pull", replica, expected, watcher.current_write_version()))
+    results.put(("done", replica, None, None))
+
+
+def run_self_check(replicas=3, writes=20, poll_interval=POLL_INTERVAL, interval=0.2):
+    """
+    Start `replicas` (at least 2) reader processes on a scratch database, commit
+    `writes` employee updates from this process and collect:
+      - pull: active replicas call current_write_version() right after each
+        commit; it must never be older than the commit
+      - push: passive replicas never read; the delay between a commit and
+        their invalidation hook must stay within the poll interval plus
+        scheduling slack
+    Returns a report dict with "ok".
+    """
+    replicas = max(2, replicas)
+    work_dir = tempfile.mkdtemp(prefix="mcu-coherence-")
+    db_path = os.path.join(work_dir, "mcu_database.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE employee (id INTEGER PRIMARY KEY, nik TEXT UNIQUE, status TEXT)")
+    conn.execute("CREATE TABLE mcu_history (id INTEGER PRIMARY KEY, nik TEXT)")
+    conn.execute("INSERT INTO employee (nik, status) VALUES ('1', 'Valid')")
+    init_write_version(conn)
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    commands = [ctx.Queue() for _ in range(replicas)]
+    procs = [ctx.Process(target=_reader_replica, args=(i, db_path, poll_interval, commands[i], results, i % 2 == 1), daemon=True)
+             for i in range(replicas)]
+    committed = {}
+    events = []
+    try:
+        for p in procs:
+            p.start()
+        ready = 0
+        while ready < replicas:
+            kind, *_ = results.get(timeout=60)
+            ready += kind == "ready"
+        for i in range(writes):
+            conn.execute("UPDATE employee SET status = ? WHERE nik = '1'", (f"v{i}",))
+            conn.commit()
+            committed_at = time.time()
+            version = conn.execute("SELECT version FROM write_version WHERE id = 1").fetchone()[0]
+            committed[version] = committed_at
+            for q in commands:
+                q.put(version)
+            time.sleep(interval)
+        time.sleep(poll_interval * 2)
+        for q in commands:
+            q.put(None)
+        done = 0
+        while done < replicas:
+            event = results.get(timeout=60)
+            done += event[0] == "done"
+            events.append(event)
+    finally:
+        for p in procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+        conn.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    stale_reads = [(r, expected, seen) for kind, r, expected, seen in events if kind == "pull" and seen < expected]
+    first_push = {}
+    for kind, replica, version, seen_at in events:
+        if kind == "push" and version in committed:
+            key = (replica, version)
+            first_push[key] = min(first_push.get(key, seen_at), seen_at)
+    # A replica may skip straight past a version when two commits land in one
+    # poll; it is covered by the next version it saw
+    delays = []
+    for replica in range(1, replicas, 2):
+        seen = sorted((v, t) for (r, v), t in first_push.items() if r == replica)
+        for version, committed_at in committed.items():
+            later = [t for v, t in seen if v >= version]
+            delays.append(max(0.0, min(later) - committed_at) if later else float("inf"))
+    bound = poll_interval * 2 + 0.5
+    return {
+        "replicas": replicas,
+        "writes": writes,
+        "poll_ms": round(poll_interval * 1000),
+        "stale_reads": len(stale_reads),
+        "push_p50_ms": round(statistics.median(delays) * 1000, 1) if delays else None,
+        "push_max_ms": round(max(delays) * 1000, 1) if delays else None,
+        "bound_ms": round(bound * 1000),
+        "ok": not stale_reads and bool(delays) and max(delays) <= bound,
+    }
@@ -0,0 +1,183 @@
+"""
+Daily compliance snapshots: employee counts per (site, position,
+employment_status, status) and day.
+
+take_snapshot() runs one GROUP BY over employee inside SQLite (per site, for
+the local database and every registered site in mcu_sites) and replaces that
+day's rows, so running it twice a day or re-running a failed day is safe.
+Statuses are those of employee.status (re-derived for the day first, see
+mcu_projection), i.e. the same numbers the Dashboard MCU page shows that day.
+
+A day is a few hundred rows at most, keyed by (snapshot_date, site, ...).
+compliance_site_status keeps the same day rolled up to (site, status), so
+the unfiltered trend (the common case) reads a handful of rows per day and
+years of history come back in milliseconds; position/employment filters
+read the detail table with a date range scan.
+"""
+import logging
+import os
+import time
+from datetime import date, datetime
+
+import pandas as pd
+
+from mcu_db import get_connection
+import mcu_projection
+import mcu_sites
+
+LOCAL_SITE = os.environ.get("MCU_SITE_NAME", "local")
+
+SNAPSHOT_AGGREGATE_SQL = '''
+SELECT COALESCE(position, '') AS position, COALESCE(employment_status, '') AS employment_status,
+       COALESCE(status, '') AS status, COUNT(*) AS employees
+FROM employee
+GROUP BY 1, 2, 3
+'''
+
+
+def init_compliance_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS compliance_snapshot (
+        snapshot_date TEXT NOT NULL,
+        site TEXT NOT NULL,
+        position TEXT NOT NULL,
+        employment_status TEXT NOT NULL,
+        status TEXT NOT NULL,
+        employees INTEGER NOT NULL,
+        PRIMARY KEY (snapshot_date, site, position, employment_status, status)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS compliance_site_status (
+        snapshot_date TEXT NOT NULL,
+        site TEXT NOT NULL,
+        status TEXT NOT NULL,
+        employees INTEGER NOT NULL,
+        PRIMARY KEY (snapshot_date, site, status)
+    ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+
+def _replace_day(conn, snapshot_date, site, rows):
+    conn.execute("DELETE FROM compliance_snapshot WHERE snapshot_date = ? AND site = ?", (snapshot_date, site))
+    conn.executemany(
+        "INSERT INTO compliance_snapshot (snapshot_date, site, position, employment_status, status, employees) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(snapshot_date, site) + tuple(row) for row in rows]
+    )
+
+
+def take_snapshot(snapshot_date=None, include_sites=True):
+    """
+    Record today's (or `snapshot_date`'s) counts for the local database and,
+    with include_sites=True, every enabled registered site. Returns
+    {"snapshot_date", "rows", "sites", "errors"}.
+    """
+    snapshot_date = (snapshot_date or date.today()).isoformat()
+    started = time.perf_counter()
+    per_site = {}
+    errors = {}
+    if include_sites:
+        # Aggregated on each site's own read-only connection; only the grouped rows travel
+        site_counts, errors = mcu_sites.federated_query(SNAPSHOT_AGGREGATE_SQL)
+        for site, group in site_counts.groupby("site") if not site_counts.empty else ():
+            if site != LOCAL_SITE:
+                per_site[site] = list(group[["position", "employment_status", "status", "employees"]]
+                                      .itertuples(index=False, name=None))
+    conn = get_connection()
+    rows = 0
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # Statuses that moved with the calendar (e.g. Berkala -> Will Expire) are re-derived first
+        mcu_projection.refresh_status(conn)
+        # Local counts are aggregated straight into the snapshot table
+        conn.execute("DELETE FROM compliance_snapshot WHERE snapshot_date = ? AND site = ?", (snapshot_date, LOCAL_SITE))
+        rows += conn.execute(f'''
+        INSERT INTO compliance_snapshot (snapshot_date, site, position, employment_status, status, employees)
+        SELECT ?, ?, agg.* FROM ({SNAPSHOT_AGGREGATE_SQL}) agg
+        ''', (snapshot_date, LOCAL_SITE)).rowcount
+        for site, site_rows in per_site.items():
+            _replace_day(conn, snapshot_date, site, site_rows)
+            rows += len(site_rows)
+        conn.execute("DELETE FROM compliance_site_status WHERE snapshot_date = ?", (snapshot_date,))
+        conn.execute('''
+        INSERT INTO compliance_site_status (snapshot_date, site, status, employees)
+        SELECT snapshot_date, site, status, SUM(employees) FROM compliance_snapshot
+        WHERE snapshot_date = ? GROUP BY site, status
+        ''', (snapshot_date,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    logging.info(f"Compliance snapshot {snapshot_date}: {rows} row(s)",
+                 extra={"operation": "compliance_snapshot", "rows": rows,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 1)})
+    return {"snapshot_date": snapshot_date, "rows": rows, "sites": [LOCAL_SITE] + list(per_site), "errors": errors}
+
+
+def has_snapshot(snapshot_date=None, site=LOCAL_SITE):
+    snapshot_date = (snapshot_date or date.today()).isoformat()
+    conn = get_connection()
+    try:
+        return conn.execute(
+            "SELECT 1 FROM compliance_snapshot WHERE snapshot_date = ? AND site = ? LIMIT 1", (snapshot_date, site)
+        ).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def run_scheduled(at_hour=1, include_sites=True):
+    """
+    Blocking loop for the scheduled mode: take today's snapshot once the
+    clock passes `at_hour` (and right away if today is missing), then sleep.
+    """
+    while True:
+        try:
+            if datetime.now().hour >= at_hour and not has_snapshot():
+                take_snapshot(include_sites=include_sites)
+        except Exception as e:
+            logging.error(f"Scheduled compliance snapshot failed: {e}")
+        time.sleep(600)
+
+
+def snapshot_filters():
+    """
+    Sites, positions and employment statuses of the latest snapshot day
+    (read through the primary key instead of scanning every day).
+    """
+    conn = get_connection()
+    try:
+        latest = conn.execute("SELECT MAX(snapshot_date) FROM compliance_snapshot").fetchone()[0]
+        return {
+            column: [r[0] for r in conn.execute(
+                f"SELECT DISTINCT {column} FROM compliance_snapshot WHERE snapshot_date = ? ORDER BY 1", (latest,)
+            )]
+            for column in ("site", "position", "employment_status")
+        }
+    finally:
+        conn.close()
+
+
+def status_trend(since=None, site="All", position="All", employment_status="All"):
+    """
+    Employees per (snapshot_date, status) from `since` (ISO date) on, summed
+    over the dimensions not filtered. Long format: snapshot_date, status, employees.
+    """
+    detail = position != "All" or employment_status != "All"
+    table = "compliance_snapshot" if detail else "compliance_site_status"
+    sql = f"SELECT snapshot_date, status, SUM(employees) AS employees FROM {table} WHERE snapshot_date >= ?"
+    params = [since or "0000-00-00"]
+    filters = (("site", site), ("position", position), ("employment_status", employment_status)) if detail else (("site", site),)
+    for column, value in filters:
+        if value != "All":
+            sql += f" AND {column} = ?"
+            params.append(value)
+    sql += " GROUP BY snapshot_date, status ORDER BY snapshot_date"
+    conn = get_connection()
+    try:
+        return pd.read_sql(sql, conn, params=params)
+    finally:
+        conn.close()
@@ -0,0 +1,57 @@
+"""
+Shared paths and connection helper for the MCU dashboard.
+This module does not import streamlit so background jobs (mcu_jobs.py)
+can use it outside of a Streamlit session.
+"""
+import os
+import sqlite3
+
+DB_DIR = "database"
+DB_PATH = os.path.join(DB_DIR, "mcu_database.db")
+UPLOAD_DIR = os.path.join(DB_DIR, "uploads")
+HISTORY_UPLOAD_DIR = os.path.join(UPLOAD_DIR, "mcu_history")
+
+
+def get_connection(db_path=DB_PATH, timeout=30):
+    """
+    Open a connection to the MCU database.
+    A generous timeout lets short writers queue behind each other instead of
+    failing immediately with 'database is locked'.
+    """
+    return sqlite3.connect(db_path, timeout=timeout)
+
+
+def init_write_version(conn):
+    """
+    Single-row counter bumped by triggers on every write to employee and
+    mcu_history. Caches key on it, so any writer (app, CLI, another
+    process) invalidates them without extra bookkeeping in the write paths.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS write_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO write_version (id, version) VALUES (1, 0)")
+    for table in ("employee", "mcu_history"):
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_version AFTER {op} ON {table}
+            BEGIN
+                UPDATE write_version SET version = version + 1 WHERE id = 1;
+            END
+            ''')
+    conn.commit()
+
+
+def get_write_version(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        row = conn.execute("SELECT version FROM write_version WHERE id = 1").fetchone()
+        return row[0] if row else 0
+    finally:
+        if own_conn:
+            conn.close()
@@ -0,0 +1,559 @@
+"""
+Vendor export ("Export MCU Excel") as background jobs with a disk cache.
+
+Besides the two Excel formats there is a ZIP bundle for vendors on closed
+networks: the workbook plus the last N MCU files of every employee under
+files/<nik>/<file>, with the workbook linking to those relative paths. The
+bundle is streamed entry by entry into a file on disk and can resume after
+an interruption (see write_vendor_bundle).
+
+Exports run on a small thread pool shared by all sessions of the process,
+wait their turn in the export pool of mcu_governor (status "queued", with
+a queue position) and read the in-memory analytics replica (mcu_replica):
+each job keeps a connection to the snapshot current when it was submitted.
+Finished workbooks are cached in database/export_cache/ under a key built
+from the filter set, the export format and that snapshot's write version,
+so an identical request is served from disk and any write to employee or
+mcu_history makes old artifacts unreachable. The cache is size-bounded and
+evicts least recently used artifacts first.
+
+A finished artifact is only opened when the user asks for it on the
+Export page (open_artifact), under a ticket of the download pool of
+mcu_governor, so downloads never read it on an ordinary rerun.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+
+from mcu_db import DB_DIR, get_connection
+import mcu_governor
+import mcu_manifest
+import mcu_pack
+import mcu_replica
+
+# ======== SETTING REPO GITHUB UNTUK LINK MCU PDF =========
+GITHUB_OWNER = "Maliqa"
+GITHUB_REPO = "mcu-history"
+GITHUB_BRANCH = "main"
+
+EXPORT_FORMAT_GITHUB = "Excel dengan Link GitHub"
+EXPORT_FORMAT_INFO = "Excel dengan Info Lengkap"
+EXPORT_FORMAT_BUNDLE = "ZIP Bundle (Excel + File MCU)"
+EXPORT_FORMATS = [EXPORT_FORMAT_GITHUB, EXPORT_FORMAT_INFO, EXPORT_FORMAT_BUNDLE]
+
+EXPORT_CACHE_DIR = os.path.join(DB_DIR, "export_cache")
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("MCU_EXPORT_CACHE_MAX_MB", "500")) * 1024 * 1024
+EXPORT_WORKERS = int(os.environ.get("MCU_EXPORT_WORKERS", "2"))
+HISTORY_QUERY_CHUNK = 500
+# Admission cost estimate per exported employee (row, its history rows and workbook cells)
+EXPORT_BYTES_PER_ROW = 8 * 1024
+EXPORT_MIN_JOB_BYTES = 8 * 1024 * 1024
+MAX_TRACKED_JOBS = 200
+BUNDLE_WORKBOOK_NAME = "mcu_export.xlsx"
+
+def get_github_mcu_url(nik, file_name):
+    return f"https://github.com/{GITHUB_OWNER}/{GITHUB_REPO}/blob/{GITHUB_BRANCH}/mcu_files/{nik}/{file_name}?raw=true"
+
+
+def _filter_clause(position="All", status="All", employment_status="All"):
+    where = " WHERE 1=1"
+    params = []
+    if position != "All":
+        where += " AND position = ?"
+        params.append(position)
+    if status != "All":
+        where += " AND status = ?"
+        params.append(status)
+    if employment_status != "All":
+        where += " AND employment_status = ?"
+        params.append(employment_status)
+    return where, params
+
+
+def load_filtered_employees(conn, position="All", status="All", employment_status="All"):
+    """
+    Employees matching the export filters, filtered in SQL.
+    """
+    where, params = _filter_clause(position, status, employment_status)
+    query = "SELECT nik, employee_name, position, employment_status, status FROM employee" + where
+    return pd.read_sql(query + " ORDER BY id", conn, params=params)
+
+
+def estimate_job_bytes(conn, filters):
+    """
+    Rough peak memory of an export job (DataFrames plus the workbook held
+    in memory), for admission control (mcu_governor).
+    """
+    filters = dict(filters)
+    filters.pop("files_per_employee", None)
+    where, params = _filter_clause(**filters)
+    rows = conn.execute("SELECT COUNT(*) FROM employee" + where, params).fetchone()[0]
+    return max(EXPORT_MIN_JOB_BYTES, rows * EXPORT_BYTES_PER_ROW)
+
+
+def load_recent_history(conn, niks, per_employee=3):
+    """
+    Last `per_employee` mcu_history rows for each NIK, fetched in a few
+    chunked queries instead of one query per employee.
+    Returns {nik: DataFrame ordered by mcu_year DESC}.
+    """
+    frames = []
+    for start in range(0, len(niks), HISTORY_QUERY_CHUNK):
+        chunk = list(niks[start:start + HISTORY_QUERY_CHUNK])
+        placeholders = ",".join("?" * len(chunk))
+        frames.append(pd.read_sql(
+            f"SELECT * FROM mcu_history WHERE nik IN ({placeholders}) ORDER BY nik, mcu_year DESC",
+            conn, params=chunk
+        ))
+    if not frames:
+        return {}
+    history = pd.concat(frames, ignore_index=True)
+    history = history.groupby("nik", sort=False).head(per_employee)
+    return {nik: group for nik, group in history.groupby("nik", sort=False)}
+
+
+def bundle_entry_name(nik, file_name):
+    return f"files/{nik}/{file_name}"
+
+
+def build_vendor_workbook(df_emp, history_by_nik, export_format, progress_callback=None,
+                          bundle_paths=None, files_per_employee=3):
+    """
+    Build the vendor workbook (xlsx bytes). Same layout as the original
+    in-page export: MCU columns with either links or info text. GitHub
+    links always use three columns; the ZIP bundle uses files_per_employee
+    columns linking to the relative paths in bundle_paths {(nik, file_name): path}.
+    """
+    export_rows = []
+    meta_years = []
+    linked = export_format in (EXPORT_FORMAT_GITHUB, EXPORT_FORMAT_BUNDLE)
+    link_cols = [f"MCU {i}" for i in range(1, (files_per_employee if export_format == EXPORT_FORMAT_BUNDLE else 3) + 1)]
+    empty = pd.DataFrame(columns=["mcu_year", "mcu_date", "expired_date", "diagnosis", "file_name"])
+    total = len(df_emp)
+    for n, emp in enumerate(df_emp.itertuples(index=False), start=1):
+        nik = emp.nik
+        last3 = history_by_nik.get(nik, empty)
+        if linked:
+            mcu_urls = []
+            mcu_years = []
+            for row in last3.itertuples(index=False):
+                if export_format == EXPORT_FORMAT_BUNDLE:
+                    mcu_urls.append(bundle_paths.get((nik, row.file_name), ""))
+                else:
+                    mcu_urls.append(get_github_mcu_url(nik, row.file_name))
+                mcu_years.append(str(row.mcu_year) if pd.notna(row.mcu_year) else "")
+            while len(mcu_urls) < len(link_cols):
+                mcu_urls.append("")
+                mcu_years.append("")
+            row_dict = {
+                "NIK": nik,
+                "Employee Name": emp.employee_name,
+                "Position": emp.position,
+                "Employment Status": emp.employment_status,
+            }
+            row_dict.update(zip(link_cols, mcu_urls))
+            export_rows.append(row_dict)
+            meta_years.append(mcu_years)
+        else:
+            mcu_info = []
+            for row in last3.itertuples(index=False):
+                mcu_info.append(
+                    f"Tahun: {row.mcu_year}, "
+                    f"Tanggal: {row.mcu_date}, "
+                    f"Kedaluwarsa: {row.expired_date}, "
+                    f"Diagnosis: {row.diagnosis}"
+                )
+            while len(mcu_info) < 3:
+                mcu_info.append("")
+            export_rows.append({
+                "NIK": nik,
+                "Employee Name": emp.employee_name,
+                "Position": emp.position,
+                "Employment Status": emp.employment_status,
+                "MCU Terbaru": mcu_info[0],
+                "MCU Ke-2": mcu_info[1],
+                "MCU Ke-3": mcu_info[2]
+            })
+        if progress_callback and (n % 200 == 0 or n == total):
+            progress_callback(n, total)
+
+    df_export = pd.DataFrame(export_rows)
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df_export.to_excel(writer, index=False, sheet_name='MCU Data')
+        workbook = writer.book
+        worksheet = writer.sheets['MCU Data']
+        header_format = workbook.add_format({
+            'bold': True,
+            'text_wrap': True,
+            'valign': 'top',
+            'fg_color': '#D7E4BC',
+            'border': 1
+        })
+        for col_num, value in enumerate(df_export.columns.values):
+            worksheet.write(0, col_num, value, header_format)
+
+        for i, col in enumerate(df_export.columns):
+            try:
+                max_len = max(
+                    df_export[col].astype(str).map(len).max(),
+                    len(col)
+                ) + 2
+            except Exception:
+                max_len = len(col) + 2
+            worksheet.set_column(i, i, max_len)
+
+        if linked:
+            for row_idx, row_dict in enumerate(export_rows, start=1):
+                years = meta_years[row_idx - 1]
+                for col_offset, col_name in enumerate(link_cols):
+                    url = row_dict.get(col_name, "")
+                    display_year = years[col_offset] if years[col_offset] else ""
+                    display_text = f"MCU {display_year}" if display_year else "MCU"
+                    if isinstance(url, str) and url.startswith("http"):
+                        worksheet.write_url(row_idx, 4 + col_offset, url, string=display_text) # Kolom MCU dimulai dari indeks 4
+                    elif isinstance(url, str) and url.startswith("files/"):
+                        # Link relatif ke file di dalam ZIP bundle
+                        worksheet.write_url(row_idx, 4 + col_offset, "external:" + url, string=display_text)
+    return output.getvalue()
+
+
+# ---------------- ZIP bundle ----------------
+
+_ZIPINFO_FIELDS = ("filename", "date_time", "compress_type", "CRC", "compress_size", "file_size",
+                   "header_offset", "flag_bits", "external_attr", "create_system", "create_version",
+                   "extract_version", "volume", "internal_attr", "reserved")
+
+
+def _zipinfo_to_dict(zinfo):
+    data = {field: getattr(zinfo, field) for field in _ZIPINFO_FIELDS}
+    data["extra"] = zinfo.extra.hex()
+    return data
+
+
+def _zipinfo_from_dict(data):
+    zinfo = zipfile.ZipInfo(data["filename"], tuple(data["date_time"]))
+    for field in _ZIPINFO_FIELDS[2:]:
+        setattr(zinfo, field, data[field])
+    zinfo.extra = bytes.fromhex(data["extra"])
+    return zinfo
+
+
+def _open_resumable_zip(out_path, bundle_key):
+    """
+    Open <out_path>.partial for writing. If a journal for the same bundle key
+    exists, truncate the partial file to the last complete journal record
+    (a torn or unreadable header starts over) and re-seed
+    the ZipFile with the entries already written, so writing continues where
+    it stopped. Returns (zipfile, raw file, journal file, done entry names).
+    """
+    partial_path = out_path + ".partial"
+    journal_path = out_path + ".journal"
+    done = []
+    end_offset = 0
+    journal_end = 0
+    if os.path.exists(partial_path) and os.path.exists(journal_path):
+        records = []
+        with open(journal_path, "rb") as jf:
+            for line in jf:
+                # A crash mid-append leaves a torn last line: resume from the last complete record
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                journal_end += len(line)
+        if records and records[0].get("key") == bundle_key:
+            for record in records[1:]:
+                done.append(record["info"])
+                end_offset = record["end"]
+    if done:
+        raw = open(partial_path, "r+b")
+        raw.truncate(end_offset)
+        raw.seek(end_offset)
+        journal = open(journal_path, "r+")
+        journal.truncate(journal_end)
+        journal.seek(journal_end)
+        logging.info(f"Resuming bundle {out_path} after {len(done)} entries ({end_offset} bytes)")
+    else:
+        raw = open(partial_path, "w+b")
+        journal = open(journal_path, "w")
+        journal.write(json.dumps({"key": bundle_key}) + "\n")
+        journal.flush()
+    zf = zipfile.ZipFile(raw, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    for data in done:
+        zinfo = _zipinfo_from_dict(data)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+    return zf, raw, journal, {d["filename"] for d in done}
+
+
+def _journal_entry(zf, raw, journal, name):
+    raw.flush()
+    os.fsync(raw.fileno())
+    journal.write(json.dumps({"info": _zipinfo_to_dict(zf.NameToInfo[name]), "end": raw.tell()}) + "\n")
+    journal.flush()
+
+
+def write_vendor_bundle(out_path, df_emp, history_by_nik, files_per_employee=3, bundle_key="", progress_callback=None):
+    """
+    Write the vendor ZIP bundle to out_path, one entry at a time.
+
+    MCU files are copied in chunks from the loose upload or its pack
+    (mcu_pack.iter_file) straight into the archive, so memory use does not
+    depend on bundle size. Entries are stored uncompressed (scans are already
+    compressed). After each entry the archive is fsync'ed and the entry is
+    appended to <out_path>.journal; a rerun with the same bundle_key skips
+    journaled entries instead of starting over.
+    Returns the number of MCU files included.
+    """
+    conn = get_connection()
+    try:
+        bundle_paths = {}
+        files = []
+        for nik, group in history_by_nik.items():
+            for row in group.itertuples(index=False):
+                if not row.file_name:
+                    continue
+                rel_path = mcu_manifest.manifest_path(nik, row.file_name)
+                if mcu_pack.exists(conn, rel_path):
+                    entry_name = bundle_entry_name(nik, row.file_name)
+                    bundle_paths[(nik, row.file_name)] = entry_name
+                    files.append((entry_name, rel_path))
+        sizes = {}
+        for rel_path, size in conn.execute("SELECT path, size FROM file_manifest"):
+            sizes[rel_path] = size
+    finally:
+        conn.close()
+
+    def _size(rel_path):
+        # Files without a manifest entry still count for progress
+        return sizes.get(rel_path) or 1
+
+    total_bytes = sum(_size(rel_path) for _, rel_path in files) or 1
+    done_bytes = 0
+    zf, raw, journal, done = _open_resumable_zip(out_path, bundle_key)
+    try:
+        for entry_name, rel_path in files:
+            if entry_name not in done:
+                with zf.open(entry_name, "w", force_zip64=True) as dst:
+                    for chunk in mcu_pack.iter_file(rel_path):
+                        dst.write(chunk)
+                _journal_entry(zf, raw, journal, entry_name)
+            done_bytes += _size(rel_path)
+            if progress_callback:
+                progress_callback(min(done_bytes, total_bytes), total_bytes)
+        if BUNDLE_WORKBOOK_NAME not in done:
+            workbook = build_vendor_workbook(df_emp, history_by_nik, EXPORT_FORMAT_BUNDLE,
+                                             bundle_paths=bundle_paths, files_per_employee=files_per_employee)
+            zf.writestr(BUNDLE_WORKBOOK_NAME, workbook)
+            _journal_entry(zf, raw, journal, BUNDLE_WORKBOOK_NAME)
+        zf.close()
+    finally:
+        journal.close()
+        raw.close()
+    os.replace(out_path + ".partial", out_path)
+    os.remove(out_path + ".journal")
+    return len(files)
+
+
+# ---------------- artifact cache ----------------
+
+EXPORT_FILE_EXTENSIONS = {
+    EXPORT_FORMAT_GITHUB: ".xlsx",
+    EXPORT_FORMAT_INFO: ".xlsx",
+    EXPORT_FORMAT_BUNDLE: ".zip",
+}
+EXPORT_DOWNLOADS = {
+    EXPORT_FORMAT_GITHUB: ("mcu_export.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    EXPORT_FORMAT_INFO: ("mcu_export.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    EXPORT_FORMAT_BUNDLE: ("mcu_export_bundle.zip", "application/zip"),
+}
+
+
+def cache_key(filters, export_format, write_version):
+    payload = json.dumps({"filters": filters, "format": export_format, "write_version": write_version}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _artifact_path(key, export_format):
+    return os.path.join(EXPORT_CACHE_DIR, key + EXPORT_FILE_EXTENSIONS.get(export_format, ".bin"))
+
+
+def _evict_cache(max_bytes=EXPORT_CACHE_MAX_BYTES, keep=None):
+    """
+    Drop least recently used artifacts until the cache fits in max_bytes.
+    """
+    if not os.path.isdir(EXPORT_CACHE_DIR):
+        return
+    entries = []
+    for fname in os.listdir(EXPORT_CACHE_DIR):
+        file_path = os.path.join(EXPORT_CACHE_DIR, fname)
+        # Partial bundles belong to running (or resumable) jobs and are never evicted
+        if fname.endswith((".tmp", ".partial", ".journal")) or not os.path.isfile(file_path):
+            continue
+        st_ = os.stat(file_path)
+        entries.append((st_.st_mtime, st_.st_size, file_path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, file_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if file_path == keep:
+            continue
+        try:
+            os.remove(file_path)
+            total -= size
+        except OSError as e:
+            logging.warning(f"Failed to evict export artifact {file_path}: {e}")
+
+
+# ---------------- background jobs ----------------
+
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="mcu-export")
+_jobs = {}
+_jobs_by_key = {}
+_jobs_lock = threading.Lock()
+
+
+def _run_job(job):
+    def _progress(done, total):
+        job["progress"] = done / total if total else 1.0
+
+    # Waits here (status "queued") while the export pool is full
+    job["ticket"].wait()
+    job["status"] = "running"
+    started = time.perf_counter()
+    try:
+        filters = dict(job["filters"])
+        files_per_employee = filters.pop("files_per_employee", 3)
+        conn = job.pop("conn", None) or get_connection()
+        try:
+            df_emp = load_filtered_employees(conn, **filters)
+            history_by_nik = load_recent_history(conn, df_emp["nik"].tolist(), per_employee=files_per_employee)
+        finally:
+            conn.close()
+        job["rows"] = len(df_emp)
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+        if job["format"] == EXPORT_FORMAT_BUNDLE:
+            write_vendor_bundle(job["artifact_path"], df_emp, history_by_nik, files_per_employee=files_per_employee,
+                                bundle_key=job["key"], progress_callback=_progress)
+        else:
+            data = build_vendor_workbook(df_emp, history_by_nik, job["format"], progress_callback=_progress)
+            tmp_path = job["artifact_path"] + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, job["artifact_path"])
+        job["size"] = os.path.getsize(job["artifact_path"])
+        _evict_cache(keep=job["artifact_path"])
+        job["progress"] = 1.0
+        job["status"] = "done"
+        logging.info(f"Export job {job['id']} finished: {job['rows']} row(s), {job['size']} bytes", extra={
+            "operation": "export", "job_id": job["id"], "rows": job["rows"], "status": "done",
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        logging.error(f"Export job {job['id']} failed: {e}", extra={
+            "operation": "export", "job_id": job["id"], "status": "failed",
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+    finally:
+        job["ticket"].release()
+        with _jobs_lock:
+            if _jobs_by_key.get(job["key"]) == job["id"]:
+                del _jobs_by_key[job["key"]]
+
+
+def submit_export(filters, export_format):
+    """
+    Start (or join) an export for this filter set. Returns the job id.
+    A cached artifact for the current snapshot yields a finished job
+    immediately; an identical running job is shared instead of duplicated.
+    """
+    conn, snapshot = mcu_replica.open_reader()
+    try:
+        cost = estimate_job_bytes(conn, filters)
+    except Exception:
+        conn.close()
+        raise
+    key = cache_key(filters, export_format, snapshot["write_version"])
+    artifact_path = _artifact_path(key, export_format)
+    with _jobs_lock:
+        if key in _jobs_by_key:
+            conn.close()
+            return _jobs_by_key[key]
+        job = {
+            "id": uuid.uuid4().hex,
+            "key": key,
+            "filters": dict(filters),
+            "format": export_format,
+            "artifact_path": artifact_path,
+            "status": "queued",
+            "progress": 0.0,
+            "rows": None,
+            "error": None,
+            "cached": False,
+            "size": None,
+            "snapshot_at": snapshot["taken_at"],
+        }
+        _jobs[job["id"]] = job
+        if len(_jobs) > MAX_TRACKED_JOBS:
+            # Forget the oldest finished jobs; their artifacts stay in the cache
+            finished = [jid for jid, j in _jobs.items() if j["status"] in ("done", "failed")]
+            for jid in finished[:len(_jobs) - MAX_TRACKED_JOBS]:
+                del _jobs[jid]
+        if os.path.exists(artifact_path):
+            # Touch so LRU eviction sees the hit
+            os.utime(artifact_path, None)
+            job.update(status="done", progress=1.0, cached=True, size=os.path.getsize(artifact_path))
+            conn.close()
+            return job["id"]
+        _jobs_by_key[key] = job["id"]
+    # The job reads the snapshot its key was built from, even if a newer one is swapped in meanwhile
+    job["conn"] = conn
+    # Queue position is taken now, in submission order
+    job["ticket"] = mcu_governor.enqueue("export", cost)
+    _executor.submit(_run_job, job)
+    return job["id"]
+
+
+def queue_position(job_id):
+    """
+    Place of a queued job in the export queue (0 once it runs).
+    """
+    job = _jobs.get(job_id)
+    if not job or job["status"] != "queued" or "ticket" not in job:
+        return 0
+    return job["ticket"].position()
+
+
+def get_job(job_id):
+    return _jobs.get(job_id)
+
+
+# ---------------- downloads ----------------
+
+def open_artifact(job_id):
+    """
+    Binary handle on a finished export, or None if the job is unknown or
+    its artifact was evicted in the meantime. An open handle stays readable
+    even if the cache evicts the file while it is read.
+    """
+    job = _jobs.get(job_id)
+    if not job or job["status"] != "done":
+        return None
+    try:
+        return open(job["artifact_path"], "rb")
+    except FileNotFoundError:
+        return None
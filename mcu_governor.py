@@ -0,0 +1,242 @@
+"""
+Admission control for the memory-heavy work of the dashboard process.
+
+Uploads, file views/downloads (the original plus its base64 copy for the
+PDF viewer), exports (DataFrames and the workbook) and export downloads
+(the finished artifact handed to st.download_button) each go through a
+pool with a concurrency limit and a memory budget. A request states its estimated cost in bytes and waits in FIFO
+order until both fit; a request larger than the whole budget runs alone.
+Everything beyond the limits queues instead of running in parallel, and the
+caller can show the queue position while it waits.
+
+Limits per pool (environment):
+
+    MCU_UPLOAD_CONCURRENCY=2   MCU_UPLOAD_MEMORY_MB=256
+    MCU_PREVIEW_CONCURRENCY=4  MCU_PREVIEW_MEMORY_MB=256
+    MCU_EXPORT_CONCURRENCY=<MCU_EXPORT_WORKERS>  MCU_EXPORT_MEMORY_MB=512
+    MCU_DOWNLOAD_CONCURRENCY=2 MCU_DOWNLOAD_MEMORY_MB=512
+
+Streamlit buffers an uploaded file in memory before the script sees it, so
+the upload pool cannot keep those bytes out of RAM: it limits the
+concurrent disk writes (and their copies) of files that are already
+buffered. What Streamlit buffers per file is capped by
+server.maxUploadSize (set to the app's 100 MB limit in the Dockerfile).
+
+Interactive requests give up after MCU_GOVERNOR_MAX_WAIT_S. Every admission
+is logged with its wait time and the queue depth (operation "governor"),
+and every MCU_GOVERNOR_STATS_S a summary per pool (queue depth, running,
+memory in use, wait p50/p95/max) is logged as operation "governor_stats";
+both land in the JSON log like the other metrics.
+"""
+import itertools
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+MB = 1024 * 1024
+MAX_WAIT = int(os.environ.get("MCU_GOVERNOR_MAX_WAIT_S", "300"))
+STATS_INTERVAL = int(os.environ.get("MCU_GOVERNOR_STATS_S", "60"))
+WAIT_SAMPLES = 500
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+class Ticket:
+    def __init__(self, pool, cost, seq):
+        self.pool = pool
+        self.cost = cost
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.released = False
+
+    @property
+    def admitted(self):
+        return self.admitted_at is not None
+
+    def position(self):
+        """
+        1-based place in the queue; 0 once admitted.
+        """
+        return self.pool.position(self)
+
+    def wait(self, timeout=None):
+        """
+        Block until admitted or `timeout` seconds passed. Returns admitted.
+        """
+        return self.pool.wait(self, timeout)
+
+    def release(self):
+        self.pool.release(self)
+
+
+class ResourcePool:
+    def __init__(self, name, max_concurrent, memory_budget):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.memory_budget = memory_budget
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._running = 0
+        self._in_use = 0
+        self._seq = itertools.count(1)
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._admitted_total = 0
+        self._gave_up_total = 0
+
+    def enqueue(self, cost):
+        """
+        Join the queue with an estimated cost in bytes. Returns a Ticket,
+        possibly already admitted.
+        """
+        # More than the whole budget: charge the whole budget, so it runs alone
+        cost = min(max(0, int(cost)), self.memory_budget)
+        with self._cond:
+            ticket = Ticket(self, cost, next(self._seq))
+            self._queue.append(ticket)
+            self._admit()
+        return ticket
+
+    def _admit(self):
+        # FIFO: only the head may start, so large requests are not starved by small ones
+        admitted = False
+        while self._queue:
+            head = self._queue[0]
+            if self._running >= self.max_concurrent or self._in_use + head.cost > self.memory_budget:
+                break
+            self._queue.popleft()
+            self._running += 1
+            self._in_use += head.cost
+            head.admitted_at = time.monotonic()
+            wait_ms = round((head.admitted_at - head.enqueued_at) * 1000, 1)
+            self._waits.append(wait_ms)
+            self._admitted_total += 1
+            logging.info(f"Admitted {self.name} request after {wait_ms} ms", extra={
+                "operation": "governor", "pool": self.name, "wait_ms": wait_ms, "queue_depth": len(self._queue),
+                "running": self._running, "cost_mb": round(head.cost / MB, 1)
+            })
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def position(self, ticket):
+        with self._cond:
+            if ticket.admitted:
+                return 0
+            for i, queued in enumerate(self._queue, start=1):
+                if queued is ticket:
+                    return i
+            return 0
+
+    def wait(self, ticket, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not ticket.admitted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def release(self, ticket):
+        """
+        Give back an admitted ticket's share, or leave the queue.
+        """
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted:
+                self._running -= 1
+                self._in_use -= ticket.cost
+            else:
+                self._queue.remove(ticket)
+                self._gave_up_total += 1
+            self._admit()
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                "pool": self.name,
+                "queue_depth": len(self._queue),
+                "running": self._running,
+                "max_concurrent": self.max_concurrent,
+                "in_use_mb": round(self._in_use / MB, 1),
+                "budget_mb": round(self.memory_budget / MB, 1),
+                "admitted_total": self._admitted_total,
+                "gave_up_total": self._gave_up_total,
+                "wait_ms_p50": statistics.median(waits) if waits else None,
+                "wait_ms_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else None,
+                "wait_ms_max": waits[-1] if waits else None,
+            }
+
+
+_export_default = os.environ.get("MCU_EXPORT_WORKERS", "2")
+POOLS = {
+    "upload": ResourcePool("upload", int(os.environ.get("MCU_UPLOAD_CONCURRENCY", "2")),
+                           int(os.environ.get("MCU_UPLOAD_MEMORY_MB", "256")) * MB),
+    "preview": ResourcePool("preview", int(os.environ.get("MCU_PREVIEW_CONCURRENCY", "4")),
+                            int(os.environ.get("MCU_PREVIEW_MEMORY_MB", "256")) * MB),
+    "export": ResourcePool("export", int(os.environ.get("MCU_EXPORT_CONCURRENCY", _export_default)),
+                           int(os.environ.get("MCU_EXPORT_MEMORY_MB", "512")) * MB),
+    "download": ResourcePool("download", int(os.environ.get("MCU_DOWNLOAD_CONCURRENCY", "2")),
+                             int(os.environ.get("MCU_DOWNLOAD_MEMORY_MB", "512")) * MB),
+}
+
+_reporter = None
+_reporter_lock = threading.Lock()
+
+
+def _report_stats():
+    while True:
+        time.sleep(STATS_INTERVAL)
+        for pool in POOLS.values():
+            stats = pool.stats()
+            if stats["admitted_total"] or stats["queue_depth"]:
+                logging.info(f"Governor {pool.name}: {stats['queue_depth']} queued, {stats['running']} running",
+                             extra=dict(stats, operation="governor_stats"))
+
+
+def _start_reporter():
+    global _reporter
+    with _reporter_lock:
+        if _reporter is None:
+            _reporter = threading.Thread(target=_report_stats, name="mcu-governor-stats", daemon=True)
+            _reporter.start()
+
+
+def enqueue(pool, cost):
+    _start_reporter()
+    return POOLS[pool].enqueue(cost)
+
+
+@contextmanager
+def admit(pool, cost, on_wait=None, poll=0.5, max_wait=MAX_WAIT):
+    """
+    Run the block once `pool` admits a request of `cost` bytes. While
+    queued, on_wait(position) is called every `poll` seconds (e.g. to show
+    the position in the page). Raises AdmissionTimeout after max_wait.
+    """
+    ticket = enqueue(pool, cost)
+    try:
+        started = time.monotonic()
+        while not ticket.admitted:
+            if max_wait is not None and time.monotonic() - started > max_wait:
+                raise AdmissionTimeout(f"{pool} queue: no slot after {max_wait} s")
+            if on_wait is not None:
+                on_wait(ticket.position())
+            ticket.wait(poll)
+        yield ticket
+    finally:
+        ticket.release()
+
+
+def stats():
+    return [pool.stats() for pool in POOLS.values()]
@@ -0,0 +1,544 @@
+"""
+Command line entry point for MCU maintenance jobs.
+
+Run from the app directory (same working directory as `streamlit run mcu.py`):
+
+    python mcu_jobs.py fsck [--workers 8] [--fix] [--collect-orphans] [--json]
+    python mcu_jobs.py gc
+    python mcu_jobs.py manifest-backfill
+    python mcu_jobs.py pack [--older-than-years 3] [--compress] [--max-pack-mb 1024] [--dry-run]
+    python mcu_jobs.py compact-packs [--min-live-ratio 0.5]
+    python mcu_jobs.py storage-stats
+    python mcu_jobs.py archive-history [--older-than-years 5] [--batch-size 5000] [--dry-run]
+    python mcu_jobs.py rebuild-latest-mcu
+    python mcu_jobs.py build-profiles
+    python mcu_jobs.py renditions [--workers 2] [--prune]
+    python mcu_jobs.py coherence-check [--replicas 4] [--writes 20] [--poll-ms 250]
+    python mcu_jobs.py compliance-snapshot [--date 2026-01-31] [--local-only] [--daily --at-hour 1]
+    python mcu_jobs.py changes [--after SEQ] [--limit 1000] [--table employee] [--head]
+    python mcu_jobs.py changes-serve [--host 127.0.0.1] [--port 8601]
+    python mcu_jobs.py export-bundle --out bundle.zip [--position X] [--status Y] [--employment-status Z] [--files-per-employee 3]
+    python mcu_jobs.py backup --dest /backups [--every-minutes 60 --keep 48]
+    python mcu_jobs.py backup-list --dest /backups
+    python mcu_jobs.py backup-verify --dest /backups [--snapshot ID] [--shallow]
+    python mcu_jobs.py backup-restore --dest /backups --target /restore [--snapshot ID | --at 2026-01-31T18:00]
+    python mcu_jobs.py risk-score [--top 20]
+    python mcu_jobs.py site-add --site JKT --db /sites/jkt/mcu_database.db [--upload-dir /sites/jkt/uploads]
+    python mcu_jobs.py site-list
+    python mcu_jobs.py site-remove --site JKT
+    python mcu_jobs.py federated-export --out consolidated.xlsx [--status X] [--employment-status Y] [--site JKT ...]
+    python mcu_jobs.py clinic-add --clinic "Klinik A" --capacity 40 [--weekdays 0,1,2,3,4] [--disabled]
+    python mcu_jobs.py clinic-list
+    python mcu_jobs.py clinic-remove --clinic "Klinik A"
+    python mcu_jobs.py blackout-add --date 2026-12-25 [--clinic "Klinik A"] [--reason Natal]
+    python mcu_jobs.py blackout-list
+    python mcu_jobs.py schedule-build [--start 2026-11-01] [--horizon-days 90] [--lead-days 45] [--out schedule.xlsx]
+    python mcu_jobs.py schedule-export --out schedule.xlsx|schedule.csv [--run-id N]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+from mcu_db import DB_DIR, get_connection, get_write_version
+import mcu_archive
+import mcu_backup
+import mcu_changelog
+import mcu_coherence
+import mcu_compliance
+import mcu_export
+import mcu_manifest
+import mcu_pack
+import mcu_profile
+import mcu_projection
+import mcu_renditions
+import mcu_risk
+import mcu_schedule
+import mcu_sites
+
+
+def _init_tables():
+    os.makedirs(DB_DIR, exist_ok=True)
+    conn = get_connection()
+    mcu_manifest.init_manifest_tables(conn)
+    mcu_pack.init_pack_tables(conn)
+    mcu_risk.init_risk_tables(conn)
+    mcu_sites.init_site_tables(conn)
+    mcu_archive.init_archive_tables(conn)
+    mcu_changelog.init_changelog(conn)
+    mcu_projection.init_latest_mcu_projection(conn)
+    mcu_compliance.init_compliance_tables(conn)
+    mcu_schedule.init_schedule_tables(conn)
+    mcu_profile.init_profile_tables(conn)
+    conn.close()
+
+
+def cmd_fsck(args):
+    report = mcu_manifest.fsck(workers=args.workers, fix=args.fix, collect_orphans=args.collect_orphans)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Scanned {report['scanned']} loose file(s), {report['packed']} packed")
+        for key in ("orphan_files", "untracked_files", "missing_files", "changed_files",
+                    "dangling_rows", "stale_manifest", "errors"):
+            print(f"{key}: {len(report[key])}")
+            for item in report[key]:
+                print(f"  {item}")
+        print(f"gc_pending: {report['gc_pending']}")
+    problems = sum(len(report[k]) for k in ("missing_files", "changed_files", "dangling_rows", "errors"))
+    return 1 if problems and not args.fix else 0
+
+
+def cmd_manifest_backfill(args):
+    registered = mcu_manifest.backfill_manifest()
+    if registered is None:
+        print("Manifest backfill already done or running elsewhere")
+    else:
+        print(f"Registered {registered} existing upload(s)")
+    return 0
+
+
+def cmd_gc(args):
+    result = mcu_manifest.run_gc(limit=args.limit)
+    print(f"deleted={result['deleted']} kept={result['kept']} failed={result['failed']}")
+    return 1 if result["failed"] else 0
+
+
+def cmd_pack(args):
+    result = mcu_pack.pack_old_files(
+        older_than_years=args.older_than_years,
+        compress=args.compress,
+        max_pack_bytes=args.max_pack_mb * 1024 * 1024,
+        dry_run=args.dry_run
+    )
+    if args.dry_run:
+        print(f"Would pack {result['files']} file(s), {result['bytes_in']} bytes")
+    else:
+        print(f"Packed {result['files']} file(s): {result['bytes_in']} bytes -> {result['bytes_stored']} bytes "
+              f"in {len(result['packs'])} pack(s), skipped {result['skipped']}")
+    return 0
+
+
+def cmd_compact_packs(args):
+    rewritten = mcu_pack.compact_packs(min_live_ratio=args.min_live_ratio)
+    print(f"Rewrote {len(rewritten)} pack(s)")
+    return 0
+
+
+def cmd_storage_stats(args):
+    for key, value in mcu_pack.storage_stats().items():
+        print(f"{key}: {value}")
+    return 0
+
+
+def cmd_archive_history(args):
+    result = mcu_archive.archive_old_history(
+        older_than_years=args.older_than_years, batch_size=args.batch_size, dry_run=args.dry_run
+    )
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"{verb} {result['rows']} mcu_history row(s) with mcu_year < {result['cutoff_year']}")
+    return 0
+
+
+def cmd_rebuild_latest_mcu(args):
+    conn = get_connection()
+    try:
+        added, projected = mcu_projection.rebuild_projection(conn)
+    finally:
+        conn.close()
+    print(f"Added {added} mcu_history row(s) from employee data; projected latest MCU onto {projected} employee(s)")
+    return 0
+
+
+def cmd_build_profiles(args):
+    print(f"Built {mcu_profile.rebuild_all()} employee profile document(s)")
+    return 0
+
+
+def cmd_renditions(args):
+    if not mcu_renditions.available():
+        print("Pillow is not installed; renditions are disabled", file=sys.stderr)
+        return 1
+    result = mcu_renditions.build_all(workers=args.workers)
+    print(f"images={result['images']} built={result['built']} failed={result['failed']}")
+    if args.prune:
+        print(f"pruned={mcu_renditions.prune_renditions()}")
+    return 1 if result["failed"] else 0
+
+
+def cmd_coherence_check(args):
+    report = mcu_coherence.run_self_check(replicas=args.replicas, writes=args.writes, poll_interval=args.poll_ms / 1000)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    return 0 if report["ok"] else 1
+
+
+def cmd_compliance_snapshot(args):
+    if args.daily:
+        mcu_compliance.run_scheduled(at_hour=args.at_hour, include_sites=not args.local_only)
+        return 0
+    snapshot_date = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+    result = mcu_compliance.take_snapshot(snapshot_date, include_sites=not args.local_only)
+    print(f"{result['snapshot_date']}: {result['rows']} row(s) for {', '.join(result['sites'])}")
+    for site, error in result["errors"].items():
+        print(f"  {site}: {error}")
+    return 1 if result["errors"] else 0
+
+
+def cmd_changes(args):
+    if args.head:
+        print(mcu_changelog.head_seq())
+        return 0
+    changes = mcu_changelog.read_changes(args.after, args.limit, args.table)
+    sys.stdout.write(mcu_changelog.to_ndjson(changes))
+    # Next cursor on stderr so stdout stays pure NDJSON
+    print(f"next_cursor={changes[-1]['seq'] if changes else args.after}", file=sys.stderr)
+    return 0
+
+
+def cmd_changes_serve(args):
+    mcu_changelog.serve(args.host, args.port)
+    return 0
+
+
+def cmd_export_bundle(args):
+    conn = get_connection()
+    try:
+        df_emp = mcu_export.load_filtered_employees(conn, args.position, args.status, args.employment_status)
+        history_by_nik = mcu_export.load_recent_history(conn, df_emp["nik"].tolist(), per_employee=args.files_per_employee)
+    finally:
+        conn.close()
+    # Same key on rerun -> resume from <out>.journal instead of starting over
+    bundle_key = mcu_export.cache_key(
+        {"position": args.position, "status": args.status, "employment_status": args.employment_status,
+         "files_per_employee": args.files_per_employee},
+        mcu_export.EXPORT_FORMAT_BUNDLE, get_write_version()
+    )
+
+    def _progress(done, total):
+        print(f"\r{done * 100 // total}%", end="", flush=True)
+
+    count = mcu_export.write_vendor_bundle(args.out, df_emp, history_by_nik, args.files_per_employee,
+                                           bundle_key=bundle_key, progress_callback=_progress)
+    print(f"\nWrote {args.out}: {len(df_emp)} employee(s), {count} MCU file(s)")
+    return 0
+
+
+def cmd_backup(args):
+    options = {"pages": args.pages, "sleep": args.sleep_ms / 1000.0, "workers": args.workers}
+    if args.every_minutes:
+        mcu_backup.run_scheduled(args.dest, args.every_minutes, args.keep, **options)
+        return 0
+    summary = mcu_backup.create_snapshot(args.dest, **options)
+    print(f"Snapshot {summary['snapshot_id']}: {summary['files']} file(s), {summary['files_copied']} copied "
+          f"({summary['bytes_copied']} bytes), db {summary['db_seconds']}s, total {summary['total_seconds']}s")
+    if args.keep:
+        mcu_backup.prune_snapshots(args.dest, args.keep)
+    return 0
+
+
+def cmd_backup_list(args):
+    for snapshot_id in mcu_backup.list_snapshots(args.dest):
+        print(snapshot_id)
+    return 0
+
+
+def cmd_backup_verify(args):
+    snapshot_id = args.snapshot or mcu_backup.resolve_snapshot(args.dest)
+    problems = mcu_backup.verify_snapshot(args.dest, snapshot_id, deep=not args.shallow)
+    for problem in problems:
+        print(problem)
+    print(f"Snapshot {snapshot_id}: {'OK' if not problems else f'{len(problems)} problem(s)'}")
+    return 1 if problems else 0
+
+
+def cmd_backup_restore(args):
+    at = datetime.fromisoformat(args.at) if args.at else None
+    snapshot_id = args.snapshot or mcu_backup.resolve_snapshot(args.dest, at)
+    problems = mcu_backup.verify_snapshot(args.dest, snapshot_id, deep=False)
+    if problems:
+        print(f"Snapshot {snapshot_id} failed verification: {problems}")
+        return 1
+    count = mcu_backup.restore_snapshot(args.dest, snapshot_id, args.target)
+    print(f"Restored snapshot {snapshot_id} ({count} file(s)) into {args.target}")
+    return 0
+
+
+def cmd_risk_score(args):
+    count = mcu_risk.refresh_scores()
+    print(f"Scored {count} employee(s)")
+    if args.top:
+        print(mcu_risk.top_at_risk(limit=args.top)[["nik", "employee_name", "score", "reasons"]].to_string(index=False))
+    return 0
+
+
+def cmd_site_add(args):
+    mcu_sites.register_site(args.site, args.db, args.upload_dir)
+    print(f"Registered site {args.site}")
+    return 0
+
+
+def cmd_site_list(args):
+    sites = mcu_sites.list_sites(enabled_only=False)
+    print(sites.to_string(index=False) if not sites.empty else "No sites registered")
+    return 0
+
+
+def cmd_site_remove(args):
+    removed = mcu_sites.remove_site(args.site)
+    print(f"Removed {removed} site(s)")
+    return 0 if removed else 1
+
+
+def cmd_federated_export(args):
+    sites = args.site or None
+    summary, errors = mcu_sites.status_summary(sites=sites)
+    df_emp, export_errors = mcu_sites.filtered_employees(
+        status=args.status, employment_status=args.employment_status, sites=sites
+    )
+    errors.update(export_errors)
+    for site, error in errors.items():
+        print(f"Skipped site {site}: {error}")
+    with open(args.out, "wb") as f:
+        f.write(mcu_sites.build_consolidated_workbook(df_emp, summary))
+    print(f"Wrote {args.out}: {len(df_emp)} employee(s) from {df_emp['site'].nunique() if not df_emp.empty else 0} site(s)")
+    return 1 if errors else 0
+
+
+def cmd_clinic_add(args):
+    mcu_schedule.set_clinic(args.clinic, args.capacity, args.weekdays, enabled=not args.disabled)
+    print(f"Saved clinic {args.clinic}: {args.capacity} per day on weekdays {args.weekdays}")
+    return 0
+
+
+def cmd_clinic_list(args):
+    clinics = mcu_schedule.list_clinics()
+    print(clinics.to_string(index=False) if not clinics.empty else "No clinics registered")
+    return 0
+
+
+def cmd_clinic_remove(args):
+    removed = mcu_schedule.remove_clinic(args.clinic)
+    print(f"Removed {removed} clinic(s)")
+    return 0 if removed else 1
+
+
+def cmd_blackout_add(args):
+    mcu_schedule.add_blackout(args.date, args.clinic, args.reason)
+    print(f"Blackout {args.date} for {args.clinic or 'all clinics'}")
+    return 0
+
+
+def cmd_blackout_list(args):
+    blackouts = mcu_schedule.list_blackouts()
+    print(blackouts.to_string(index=False) if not blackouts.empty else "No blackout dates")
+    return 0
+
+
+def _write_schedule(path, run_id=None):
+    df_schedule = mcu_schedule.load_schedule(run_id)
+    if path.lower().endswith(".csv"):
+        df_schedule.to_csv(path, index=False)
+    else:
+        with open(path, "wb") as f:
+            f.write(mcu_schedule.schedule_to_excel(df_schedule))
+    print(f"Wrote {path}: {len(df_schedule)} row(s)")
+
+
+def cmd_schedule_build(args):
+    if mcu_schedule.list_clinics(enabled_only=True).empty:
+        print("No enabled clinics; add one with clinic-add first", file=sys.stderr)
+        return 1
+    result = mcu_schedule.build_schedule(start=args.start, horizon_days=args.horizon_days, lead_days=args.lead_days)
+    print(f"Run {result['run_id']}: {result['due']} due, {result['scheduled']} scheduled, {result['late']} late, "
+          f"{result['overdue']} overdue, {result['unscheduled']} unscheduled ({result['duration_ms']} ms)")
+    if args.out:
+        _write_schedule(args.out, result["run_id"])
+    return 1 if result["unscheduled"] else 0
+
+
+def cmd_schedule_export(args):
+    _write_schedule(args.out, args.run_id)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="MCU dashboard maintenance jobs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fsck", help="Reconcile uploads, file manifest and database")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    p.add_argument("--fix", action="store_true", help="Register untracked files and drop missing manifest rows")
+    p.add_argument("--collect-orphans", action="store_true", help="Queue orphan files for GC")
+    p.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    p.set_defaults(func=cmd_fsck)
+
+    p = sub.add_parser("manifest-backfill", help="Register uploads that predate the file manifest (once)")
+    p.set_defaults(func=cmd_manifest_backfill)
+
+    p = sub.add_parser("gc", help="Delete files queued for garbage collection")
+    p.add_argument("--limit", type=int, default=None)
+    p.set_defaults(func=cmd_gc)
+
+    p = sub.add_parser("pack", help="Move old MCU files into pack files")
+    p.add_argument("--older-than-years", type=int, default=3)
+    p.add_argument("--compress", action="store_true", help="zlib-compress each entry")
+    p.add_argument("--max-pack-mb", type=int, default=1024)
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_pack)
+
+    p = sub.add_parser("compact-packs", help="Rewrite packs with many GC'd entries")
+    p.add_argument("--min-live-ratio", type=float, default=0.5)
+    p.set_defaults(func=cmd_compact_packs)
+
+    p = sub.add_parser("storage-stats", help="Show loose vs packed file counts and sizes")
+    p.set_defaults(func=cmd_storage_stats)
+
+    p = sub.add_parser("archive-history", help="Move old mcu_history rows into the archive database")
+    p.add_argument("--older-than-years", type=int, default=mcu_archive.HOT_YEARS)
+    p.add_argument("--batch-size", type=int, default=mcu_archive.ARCHIVE_BATCH_SIZE)
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_archive_history)
+
+    p = sub.add_parser("rebuild-latest-mcu", help="Re-project the latest mcu_history row and status onto employee")
+    p.set_defaults(func=cmd_rebuild_latest_mcu)
+
+    p = sub.add_parser("build-profiles", help="Build missing or outdated per-employee profile documents")
+    p.set_defaults(func=cmd_build_profiles)
+
+    p = sub.add_parser("renditions", help="Build missing image previews/thumbnails")
+    p.add_argument("--workers", type=int, default=mcu_renditions.RENDITION_WORKERS)
+    p.add_argument("--prune", action="store_true", help="Also delete renditions of files no longer in the manifest")
+    p.set_defaults(func=cmd_renditions)
+
+    p = sub.add_parser("coherence-check", help="Multi-process check that replicas see writes promptly")
+    p.add_argument("--replicas", type=int, default=4)
+    p.add_argument("--writes", type=int, default=20)
+    p.add_argument("--poll-ms", type=int, default=int(mcu_coherence.POLL_INTERVAL * 1000))
+    p.set_defaults(func=cmd_coherence_check)
+
+    p = sub.add_parser("compliance-snapshot", help="Record today's status counts per site/position/employment status")
+    p.add_argument("--date", default=None, help="Snapshot date label (counts are always taken from current data)")
+    p.add_argument("--local-only", action="store_true", help="Skip registered sites")
+    p.add_argument("--daily", action="store_true", help="Run forever, one snapshot per day")
+    p.add_argument("--at-hour", type=int, default=1)
+    p.set_defaults(func=cmd_compliance_snapshot)
+
+    p = sub.add_parser("changes", help="Print changes after a cursor as NDJSON")
+    p.add_argument("--after", type=int, default=0, help="Last seq already applied by the consumer")
+    p.add_argument("--limit", type=int, default=mcu_changelog.CHANGES_PAGE_SIZE)
+    p.add_argument("--table", action="append", choices=sorted(mcu_changelog.SYNC_COLUMNS), help="Repeatable")
+    p.add_argument("--head", action="store_true", help="Only print the latest seq")
+    p.set_defaults(func=cmd_changes)
+
+    p = sub.add_parser("changes-serve", help="Serve the change feed over HTTP (GET /changes)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=mcu_changelog.CHANGES_PORT)
+    p.set_defaults(func=cmd_changes_serve)
+
+    p = sub.add_parser("export-bundle", help="Write the vendor ZIP bundle (resumable)")
+    p.add_argument("--out", required=True)
+    p.add_argument("--position", default="All")
+    p.add_argument("--status", default="All")
+    p.add_argument("--employment-status", default="All")
+    p.add_argument("--files-per-employee", type=int, default=3)
+    p.set_defaults(func=cmd_export_bundle)
+
+    p = sub.add_parser("backup", help="Online database backup + incremental upload snapshot")
+    p.add_argument("--dest", default="backups")
+    p.add_argument("--pages", type=int, default=64, help="Database pages copied per backup step")
+    p.add_argument("--sleep-ms", type=int, default=50, help="Pause between backup steps")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--every-minutes", type=int, default=0, help="Run forever, one snapshot every N minutes")
+    p.add_argument("--keep", type=int, default=0, help="Number of snapshots to keep (0 = all)")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("backup-list", help="List backup snapshots")
+    p.add_argument("--dest", default="backups")
+    p.set_defaults(func=cmd_backup_list)
+
+    p = sub.add_parser("backup-verify", help="Verify a backup snapshot")
+    p.add_argument("--dest", default="backups")
+    p.add_argument("--snapshot", default=None)
+    p.add_argument("--shallow", action="store_true", help="Only check that objects exist")
+    p.set_defaults(func=cmd_backup_verify)
+
+    p = sub.add_parser("backup-restore", help="Restore a snapshot into an empty directory")
+    p.add_argument("--dest", default="backups")
+    p.add_argument("--target", required=True)
+    p.add_argument("--snapshot", default=None)
+    p.add_argument("--at", default=None, help="Restore the latest snapshot taken at or before this ISO time")
+    p.set_defaults(func=cmd_backup_restore)
+
+    p = sub.add_parser("risk-score", help="Recompute health-risk scores for all employees")
+    p.add_argument("--top", type=int, default=0, help="Print the N highest scores afterwards")
+    p.set_defaults(func=cmd_risk_score)
+
+    p = sub.add_parser("site-add", help="Register a site database for the multi-site view")
+    p.add_argument("--site", required=True)
+    p.add_argument("--db", required=True, help="Path to the site's mcu_database.db")
+    p.add_argument("--upload-dir", default=None)
+    p.set_defaults(func=cmd_site_add)
+
+    p = sub.add_parser("site-list", help="List registered sites")
+    p.set_defaults(func=cmd_site_list)
+
+    p = sub.add_parser("site-remove", help="Unregister a site")
+    p.add_argument("--site", required=True)
+    p.set_defaults(func=cmd_site_remove)
+
+    p = sub.add_parser("federated-export", help="Consolidated Excel export across registered sites")
+    p.add_argument("--out", required=True)
+    p.add_argument("--status", default="All")
+    p.add_argument("--employment-status", default="All")
+    p.add_argument("--site", action="append", help="Limit to this site (repeatable)")
+    p.set_defaults(func=cmd_federated_export)
+
+    p = sub.add_parser("clinic-add", help="Add or update a vendor clinic for MCU appointments")
+    p.add_argument("--clinic", required=True)
+    p.add_argument("--capacity", type=int, required=True, help="Appointments per day")
+    p.add_argument("--weekdays", default=mcu_schedule.DEFAULT_WEEKDAYS, help="Comma separated, 0 = Monday")
+    p.add_argument("--disabled", action="store_true")
+    p.set_defaults(func=cmd_clinic_add)
+
+    p = sub.add_parser("clinic-list", help="List vendor clinics")
+    p.set_defaults(func=cmd_clinic_list)
+
+    p = sub.add_parser("clinic-remove", help="Remove a vendor clinic and its blackout dates")
+    p.add_argument("--clinic", required=True)
+    p.set_defaults(func=cmd_clinic_remove)
+
+    p = sub.add_parser("blackout-add", help="Close one clinic (or all) on a date")
+    p.add_argument("--date", required=True)
+    p.add_argument("--clinic", default="", help="Default: all clinics")
+    p.add_argument("--reason", default=None)
+    p.set_defaults(func=cmd_blackout_add)
+
+    p = sub.add_parser("blackout-list", help="List blackout dates")
+    p.set_defaults(func=cmd_blackout_list)
+
+    p = sub.add_parser("schedule-build", help="Assign clinic appointments to employees due for MCU renewal")
+    p.add_argument("--start", default=None, help="First appointment day (default today)")
+    p.add_argument("--horizon-days", type=int, default=mcu_schedule.DEFAULT_HORIZON_DAYS)
+    p.add_argument("--lead-days", type=int, default=mcu_schedule.LEAD_DAYS, help="Earliest booking before expiry")
+    p.add_argument("--out", default=None, help="Also write the run to .xlsx or .csv")
+    p.set_defaults(func=cmd_schedule_build)
+
+    p = sub.add_parser("schedule-export", help="Write a schedule run (default: latest) to .xlsx or .csv")
+    p.add_argument("--out", required=True)
+    p.add_argument("--run-id", type=int, default=None)
+    p.set_defaults(func=cmd_schedule_export)
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = build_parser().parse_args(argv)
+    _init_tables()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+"""
+Concurrent-session load test for the MCU dashboard, built on
+streamlit.testing.v1.AppTest.
+
+    python mcu_loadtest.py --sessions 8 --iterations 3 [--employees 5000] [--out run.json] [--compare base.json]
+
+Each session is a separate process driving its own AppTest against a copy
+of the app in a scratch directory (never the real database/). The
+database is seeded with --employees employees, --history-years history
+rows each, and a few MCU files. All sessions start together behind a
+barrier and repeat this scripted visit --iterations times:
+
+    login -> dashboard -> history search (open employee) -> view file
+          -> edit employee (write) -> export (until download is ready)
+          -> health monitoring
+
+AppTest swaps process-wide Streamlit globals on every run, so sessions
+cannot share one process. Separate processes still contend for the same
+SQLite file, CPU and disk, like several users on one container, but they
+do not share one interpreter (GIL) as sessions in a single Streamlit
+server do.
+
+Reported per step: count, errors, p50/p90/p95/p99/max latency in ms.
+Also reported:
+- throughput (completed steps and session iterations per second)
+- lock contention: a probe samples every --probe-ms whether a writer could
+  take the RESERVED lock immediately (writer_busy_ratio); app log records
+  mentioning "database is locked" are counted too.
+
+The JSON report records the parameters, seed and versions, so two runs
+can be compared with --compare.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+APP_FILES_EXT = (".py",)
+APP_ASSETS = ("cistech.png",)
+POSITIONS = ["Operator", "HSE", "Driver", "Admin", "Welder", "Mechanic"]
+DIAGNOSES = ["Normal", "Normal", "Normal", "Hipertensi", "Obesitas", "Kolesterol", "Asam Urat"]
+FILES_PER_SEEDED_EMPLOYEE = 2
+SEEDED_FILE_BYTES = 256 * 1024
+EXPORT_POLL_SECONDS = 0.25
+EXPORT_TIMEOUT_SECONDS = 300
+STEPS = ["login", "dashboard", "history_search", "view_file", "edit_employee", "export", "health_monitoring"]
+
+
+# ---------------------------------------------------------------- seeding
+
+def prepare_workdir(src_dir, work_dir):
+    """
+    Copy the app (python modules + assets) into work_dir so the test never
+    touches the real database/ folder.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    for name in os.listdir(src_dir):
+        if name.endswith(APP_FILES_EXT) or name in APP_ASSETS:
+            shutil.copy(os.path.join(src_dir, name), work_dir)
+
+
+def seed_database(work_dir, employees, history_years, files_for, seed):
+    """
+    Create the schema through one AppTest run (init_db) and insert synthetic
+    employees, history rows and MCU files. Returns the list of NIKs that
+    have files (used by the history/view steps).
+    """
+    from streamlit.testing.v1 import AppTest
+
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        at = AppTest.from_file("mcu.py", default_timeout=120)
+        # init_db only runs past the login form
+        at.session_state["logged_in"] = True
+        at.run()
+        rng = random.Random(seed)
+        today = datetime.now().date()
+        conn = sqlite3.connect("database/mcu_database.db")
+        emp_rows, hist_rows = [], []
+        for i in range(employees):
+            nik = f"{seed:02d}{i:07d}"
+            mcu_date = today - timedelta(days=rng.randint(0, 500))
+            mcu_expired = mcu_date + timedelta(days=365)
+            status = "Expired" if mcu_expired < today else "Will Expire" if (mcu_expired - today).days <= 30 else "Berkala"
+            emp_status = "Permanent" if rng.random() < 0.8 else "Probation"
+            # No email: the dashboard sends real SMTP reminders for "Will Expire" rows
+            emp_rows.append((
+                nik, f"Employee {i}", f"{rng.randint(1965, 2003)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+                rng.choice(POSITIONS), f"{rng.randint(2005, 2024)}-01-15", "1 year",
+                mcu_date.isoformat(), mcu_expired.isoformat(), f"{mcu_date.year}.pdf", "-",
+                rng.choice(DIAGNOSES), "-", status if emp_status == "Permanent" else "Pre Employee",
+                None, emp_status
+            ))
+            for year in range(today.year - history_years + 1, today.year + 1):
+                hist_rows.append((nik, year, f"{year}-03-01", f"{year + 1}-03-01", f"{year}.pdf",
+                                  rng.choice(DIAGNOSES), "-"))
+        conn.executemany('''
+            INSERT INTO employee (nik, employee_name, birth_date, position, hire_date, work_period, mcu_date,
+                                  mcu_expired, file_mcu_main, examination_result, diagnosis, recommendation,
+                                  status, email, employment_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', emp_rows)
+        conn.executemany('''
+            INSERT INTO mcu_history (nik, mcu_year, mcu_date, expired_date, file_name, diagnosis, recommendation)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', hist_rows)
+        conn.commit()
+        conn.close()
+
+        file_niks = [row[0] for row in emp_rows[:files_for]]
+        payload = b"%PDF-1.4\n" + bytes(SEEDED_FILE_BYTES)
+        for nik in file_niks:
+            nik_dir = os.path.join("database", "uploads", "mcu_history", nik)
+            os.makedirs(nik_dir, exist_ok=True)
+            for year in range(today.year - FILES_PER_SEEDED_EMPLOYEE + 1, today.year + 1):
+                with open(os.path.join(nik_dir, f"{year}.pdf"), "wb") as f:
+                    f.write(payload)
+        # Register the files in the manifest the same way an operator would
+        subprocess.run([sys.executable, "mcu_jobs.py", "fsck", "--fix"], check=True, capture_output=True)
+        return file_niks
+    finally:
+        os.chdir(cwd)
+
+
+def _seed_worker(work_dir, employees, history_years, files_for, seed, out):
+    try:
+        out.put(seed_database(work_dir, employees, history_years, files_for, seed))
+    except Exception:
+        traceback.print_exc()
+        out.put(None)
+
+
+# ---------------------------------------------------------------- sessions
+
+def _click(at, label):
+    button = next(b for b in at.button if b.label == label)
+    return button.click().run()
+
+
+def _session_iteration(at, nik, position, timings, record):
+    def step(name, action):
+        started = time.perf_counter()
+        error = None
+        try:
+            action()
+            if at.exception:
+                error = str(at.exception[0].message)[:200]
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:200]
+        timings.append({"step": name, "ms": (time.perf_counter() - started) * 1000, "error": error})
+        return error is None
+
+    def login():
+        at.session_state["logged_in"] = False
+        at.run()
+        at.text_input[0].set_value("MAA")
+        at.text_input[1].set_value("MAA")
+        _click(at, "Login")
+
+    def history_search():
+        at.sidebar.radio[0].set_value("MCU History").run()
+        next(t for t in at.text_input if t.label == "🔍 Search by NIK or Employee Name").set_value(nik).run()
+
+    def view_file():
+        _click(at, "View File")
+
+    def edit_employee():
+        at.checkbox(key="edit_employee").check().run()
+        _click(at, "Save Changes")
+        at.checkbox(key="edit_employee").uncheck().run()
+
+    def export():
+        at.sidebar.radio[0].set_value("Export MCU Excel").run()
+        next(s for s in at.selectbox if s.label == "Pilih Department/Posisi").set_value(position).run()
+        next(r for r in at.radio if r.label == "Format Export").set_value("Excel dengan Info Lengkap").run()
+        _click(at, "Export Data")
+        deadline = time.time() + EXPORT_TIMEOUT_SECONDS
+        # The artifact is only read once "Siapkan Download" is clicked
+        while not any(b.label == "⬇️ Siapkan Download" for b in at.button) and not at.exception:
+            if time.time() > deadline:
+                raise TimeoutError("export did not finish")
+            time.sleep(EXPORT_POLL_SECONDS)
+            at.run()
+        _click(at, "⬇️ Siapkan Download")
+        if not at.get("download_button"):
+            raise RuntimeError("export download was not offered")
+
+    record(step("login", login)
+           and step("dashboard", lambda: at.sidebar.radio[0].set_value("Dashboard MCU").run())
+           and step("history_search", history_search)
+           and step("view_file", view_file)
+           and step("edit_employee", edit_employee)
+           and step("export", export)
+           and step("health_monitoring", lambda: at.sidebar.radio[0].set_value("Health Monitoring").run()))
+
+
+def _session_worker(work_dir, session_id, iterations, file_niks, seed, barrier, results):
+    timings = []
+    completed = [0]
+    try:
+        os.chdir(work_dir)
+        sys.path.insert(0, work_dir)
+        from streamlit.testing.v1 import AppTest
+
+        rng = random.Random(seed * 1000 + session_id)
+        at = AppTest.from_file("mcu.py", default_timeout=120)
+        barrier.wait()
+        for _ in range(iterations):
+            _session_iteration(at, rng.choice(file_niks), rng.choice(POSITIONS), timings,
+                               lambda ok: completed.__setitem__(0, completed[0] + (1 if ok else 0)))
+    except Exception:
+        timings.append({"step": "session", "ms": 0.0, "error": traceback.format_exc(limit=3)[-200:]})
+    results.put({"session": session_id, "timings": timings, "completed_iterations": completed[0]})
+
+
+# ---------------------------------------------------------------- lock probe
+
+class LockProbe(threading.Thread):
+    """
+    Every `interval` seconds, try to take the write (RESERVED) lock without
+    waiting. The share of failed attempts is the writer_busy_ratio.
+    """
+
+    def __init__(self, db_path, interval):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.interval = interval
+        self.samples = 0
+        self.busy = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path, timeout=0, isolation_level=None)
+        while not self._stop_event.wait(self.interval):
+            self.samples += 1
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("ROLLBACK")
+            except sqlite3.OperationalError:
+                self.busy += 1
+        conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _count_locked_log_records(log_path):
+    if not os.path.exists(log_path):
+        return 0
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        return sum(1 for line in f if "database is locked" in line)
+
+
+# ---------------------------------------------------------------- report
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(all_timings, wall_seconds, completed_iterations):
+    steps = {}
+    for name in STEPS + sorted({t["step"] for t in all_timings} - set(STEPS)):
+        entries = [t for t in all_timings if t["step"] == name]
+        if not entries:
+            continue
+        values = sorted(t["ms"] for t in entries if t["error"] is None)
+        errors = [t["error"] for t in entries if t["error"] is not None]
+        steps[name] = {
+            "count": len(entries),
+            "errors": len(errors),
+            "error_samples": sorted(set(errors))[:3],
+            "p50_ms": _percentile(values, 50),
+            "p90_ms": _percentile(values, 90),
+            "p95_ms": _percentile(values, 95),
+            "p99_ms": _percentile(values, 99),
+            "max_ms": values[-1] if values else None,
+            "mean_ms": sum(values) / len(values) if values else None,
+        }
+    ok_steps = sum(1 for t in all_timings if t["error"] is None)
+    return {
+        "steps": steps,
+        "throughput": {
+            "wall_seconds": wall_seconds,
+            "steps_per_second": ok_steps / wall_seconds if wall_seconds else None,
+            "iterations_per_second": completed_iterations / wall_seconds if wall_seconds else None,
+            "completed_iterations": completed_iterations,
+        },
+    }
+
+
+def _git_revision(src_dir):
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=src_dir,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_report(report, baseline=None):
+    cfg = report["config"]
+    print(f"MCU load test: {cfg['sessions']} session(s) x {cfg['iterations']} iteration(s), "
+          f"{cfg['employees']} employees, rev {cfg['git_revision']}")
+    header = f"{'step':<18}{'count':>6}{'err':>5}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>13}"
+    print(header)
+    fmt = lambda v: f"{v:9.0f}" if v is not None else f"{'-':>9}"
+    for name, s in report["steps"].items():
+        line = f"{name:<18}{s['count']:>6}{s['errors']:>5}" + "".join(
+            fmt(s[k]) for k in ("p50_ms", "p90_ms", "p95_ms", "p99_ms", "max_ms"))
+        base = (baseline or {}).get("steps", {}).get(name)
+        if base and base.get("p95_ms") and s["p95_ms"] is not None:
+            line += f"{(s['p95_ms'] / base['p95_ms'] - 1) * 100:+12.1f}%"
+        print(line)
+    tp = report["throughput"]
+    print(f"throughput: {tp['steps_per_second']:.2f} steps/s, {tp['iterations_per_second']:.3f} session iterations/s "
+          f"over {tp['wall_seconds']:.1f}s")
+    if baseline:
+        base_tp = baseline["throughput"]["steps_per_second"]
+        if base_tp:
+            print(f"throughput vs base: {(tp['steps_per_second'] / base_tp - 1) * 100:+.1f}%")
+    lock = report["lock_contention"]
+    print(f"lock contention: writer_busy_ratio {lock['writer_busy_ratio']:.3f} "
+          f"({lock['busy_samples']}/{lock['samples']} samples), 'database is locked' log records: {lock['locked_log_records']}")
+    for name, s in report["steps"].items():
+        for sample in s["error_samples"]:
+            print(f"  {name} error: {sample}")
+
+
+def run_load_test(args):
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    work_dir = args.workdir or tempfile.mkdtemp(prefix="mcu_loadtest_")
+    if os.path.exists(os.path.join(work_dir, "database")):
+        raise SystemExit(f"{work_dir} already contains a database/ folder; use an empty directory")
+    prepare_workdir(src_dir, work_dir)
+    print(f"Seeding {args.employees} employees into {work_dir} ...")
+    ctx = mp.get_context("spawn")
+    # Seed in a child too: an AppTest run replaces __main__, which spawn needs intact
+    seeded = ctx.Queue()
+    seeder = ctx.Process(target=_seed_worker, args=(work_dir, args.employees, args.history_years,
+                                                    args.files_for, args.seed, seeded))
+    seeder.start()
+    file_niks = seeded.get()
+    seeder.join()
+    if seeder.exitcode != 0 or file_niks is None:
+        raise SystemExit("Seeding failed")
+
+    barrier = ctx.Barrier(args.sessions + 1)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_session_worker,
+                           args=(work_dir, i, args.iterations, file_niks, args.seed, barrier, results))
+               for i in range(args.sessions)]
+    for w in workers:
+        w.start()
+    probe = LockProbe(os.path.join(work_dir, "database", "mcu_database.db"), args.probe_ms / 1000.0)
+    barrier.wait()
+    started = time.perf_counter()
+    probe.start()
+    session_results = [results.get() for _ in workers]
+    wall_seconds = time.perf_counter() - started
+    probe.stop()
+    for w in workers:
+        w.join()
+
+    all_timings = [t for r in session_results for t in r["timings"]]
+    report = summarize(all_timings, wall_seconds, sum(r["completed_iterations"] for r in session_results))
+    report["config"] = {
+        "sessions": args.sessions,
+        "iterations": args.iterations,
+        "employees": args.employees,
+        "history_years": args.history_years,
+        "files_for": args.files_for,
+        "seed": args.seed,
+        "git_revision": _git_revision(src_dir),
+        "python": platform.python_version(),
+        "streamlit": __import__("streamlit").__version__,
+        "cpu_count": os.cpu_count(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    report["lock_contention"] = {
+        "samples": probe.samples,
+        "busy_samples": probe.busy,
+        "writer_busy_ratio": probe.busy / probe.samples if probe.samples else 0.0,
+        "locked_log_records": _count_locked_log_records(os.path.join(work_dir, "database", "app.log")),
+    }
+    if not args.keep_workdir and not args.workdir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for mcu.py (AppTest based)")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--employees", type=int, default=2000)
+    parser.add_argument("--history-years", type=int, default=5)
+    parser.add_argument("--files-for", type=int, default=50, help="Employees that get MCU files (searched by sessions)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--probe-ms", type=int, default=20, help="Lock probe interval")
+    parser.add_argument("--workdir", default=None, help="Empty scratch directory (default: a temp dir)")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--out", default=None, help="Write the JSON report here")
+    parser.add_argument("--compare", default=None, help="Baseline JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if {k: baseline["config"].get(k) for k in ("sessions", "iterations", "employees", "seed")} != \
+                {k: report["config"][k] for k in ("sessions", "iterations", "employees", "seed")}:
+            print("warning: baseline was run with different parameters")
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = sum(s["errors"] for s in report["steps"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
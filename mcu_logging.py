@@ -0,0 +1,179 @@
+"""
+Structured, non-blocking logging for the MCU dashboard.
+
+Request threads only put records on an in-memory queue (QueueHandler); a
+single QueueListener thread formats them as one JSON object per line and
+writes database/app.log. The file rotates when it exceeds MCU_LOG_MAX_MB or
+at midnight, whichever comes first, and rotated files are gzip-compressed
+by the listener thread (app.log.1.gz is the newest).
+
+Every record carries the fields set with set_context() for the current
+script run (page, user) plus any `extra` fields of the call, e.g.
+
+    with timed("add_mcu_history", nik=nik) as fields:
+        ...
+        fields["rows"] = 1
+
+writes {"operation": "add_mcu_history", "nik": ..., "rows": 1, "duration_ms": ...}.
+"""
+import atexit
+import contextvars
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+LOG_MAX_BYTES = int(os.environ.get("MCU_LOG_MAX_MB", "20")) * 1024 * 1024
+LOG_BACKUP_COUNT = int(os.environ.get("MCU_LOG_BACKUPS", "14"))
+LOG_QUEUE_SIZE = 10000
+
+# Attributes every LogRecord has; anything else on a record came from `extra`/context
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_context = contextvars.ContextVar("mcu_log_context", default={})
+_setup_lock = threading.Lock()
+_listener = None
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that also rolls over at midnight and gzips the
+    rotated files.
+    """
+
+    def __init__(self, filename, max_bytes, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._gzip_rotator
+        self._next_midnight = self._compute_next_midnight()
+
+    @staticmethod
+    def _compute_next_midnight():
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+    @staticmethod
+    def _gzip_rotator(source, dest):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if time.time() >= self._next_midnight:
+            # Nothing to rotate if the file was never written today
+            return os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._next_midnight = self._compute_next_midnight()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Stamp the caller's context (page, user) on the record before it is
+    queued, since the listener thread does not see the caller's contextvars.
+    """
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if getattr(record, key, None) is None:
+                setattr(record, key, value)
+        return True
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Like QueueHandler.prepare, but keep the traceback apart from msg
+        # so it ends up in the "exc" field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Drop rather than block a request when the writer falls behind
+            pass
+
+
+def setup_logging(log_file, level=logging.INFO, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Route the root logger through a queue to a JSON file writer. Safe to call
+    on every Streamlit rerun: only the first call in a process installs the
+    handlers and starts the listener thread.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+        file_handler = SizeAndTimeRotatingFileHandler(log_file, max_bytes, backup_count)
+        file_handler.setFormatter(JsonFormatter())
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = _NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(_ContextFilter())
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(queue_handler)
+        _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def set_context(**fields):
+    """
+    Fields added to every record logged from the current thread/context
+    (e.g. page and user of the current Streamlit script run).
+    """
+    _context.set({k: v for k, v in fields.items() if v is not None})
+
+
+@contextmanager
+def timed(operation, level=logging.INFO, **fields):
+    """
+    Log `operation` with its duration_ms when the block ends. The yielded
+    dict can be filled with more fields (rows, status, ...). Failures are
+    logged with status="error" and re-raised.
+    """
+    fields = dict(fields, operation=operation)
+    started = time.perf_counter()
+    try:
+        yield fields
+    except Exception:
+        fields.setdefault("status", "error")
+        raise
+    finally:
+        fields["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logging.log(level, operation, extra=fields)
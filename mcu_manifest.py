@@ -0,0 +1,424 @@
+"""
+File manifest for uploaded MCU files.
+
+Every file under database/uploads/ that belongs to an employee is recorded in
+the file_manifest table (relative path, size, mtime, sha256 and the owning
+mcu_history id). The UI reads the manifest instead of probing the filesystem,
+fsck() reconciles disk, manifest and database, and deletions go through the
+gc_queue table so files are removed in the background. Uploads that predate
+the manifest are registered once by backfill_manifest(), which the app
+starts on a background thread when the marker row is missing (or run
+`python mcu_jobs.py manifest-backfill`).
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from mcu_archive import get_full_connection
+from mcu_db import UPLOAD_DIR, HISTORY_UPLOAD_DIR, get_connection
+import mcu_pack
+
+HASH_CHUNK_SIZE = 1024 * 1024
+BACKFILL_STALE_HOURS = 6
+
+
+def init_manifest_tables(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS file_manifest (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT UNIQUE,
+        nik TEXT,
+        file_name TEXT,
+        size INTEGER,
+        mtime REAL,
+        sha256 TEXT,
+        mcu_history_id INTEGER,
+        registered_at TEXT
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_manifest_nik ON file_manifest (nik, file_name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_file_manifest_history ON file_manifest (mcu_history_id)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS gc_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT,
+        reason TEXT,
+        enqueued_at TEXT,
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT
+    )
+    ''')
+    # One-off registration of pre-manifest uploads: status 'running' while a process owns it, then 'done'
+    columns = [r[1] for r in cursor.execute("PRAGMA table_info(manifest_backfill)")]
+    if columns and "status" not in columns:
+        # Marker of the first version (written only once the pass had finished)
+        cursor.execute("ALTER TABLE manifest_backfill RENAME TO manifest_backfill_old")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS manifest_backfill (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        status TEXT NOT NULL,
+        started_at TEXT NOT NULL,
+        done_at TEXT,
+        registered INTEGER
+    )
+    ''')
+    if columns and "status" not in columns:
+        cursor.execute('''
+        INSERT OR IGNORE INTO manifest_backfill (id, status, started_at, done_at, registered)
+        SELECT id, 'done', done_at, done_at, registered FROM manifest_backfill_old
+        ''')
+        cursor.execute("DROP TABLE manifest_backfill_old")
+    conn.commit()
+
+
+def backfill_pending(conn):
+    """
+    True if the pre-manifest uploads were never registered (no marker row).
+    Only reads the marker; the app calls it on every init.
+    """
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    # The CLI may run before the app created the tables; nothing to backfill yet
+    if not {"employee", "mcu_history", "pack_index", "manifest_backfill"} <= tables:
+        return False
+    return conn.execute("SELECT 1 FROM manifest_backfill WHERE id = 1").fetchone() is None
+
+
+def backfill_manifest():
+    """
+    Register the uploads that existed before the manifest (one fsck(fix=True)
+    pass). The marker row is claimed first, so concurrent callers do not
+    start their own pass; a claim left 'running' by a process that died is
+    taken over after BACKFILL_STALE_HOURS. Returns the number of files
+    registered, or None if another process owns or finished the backfill.
+    """
+    now = datetime.now()
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        claimed = conn.execute('''
+        INSERT INTO manifest_backfill (id, status, started_at) VALUES (1, 'running', ?)
+        ON CONFLICT(id) DO UPDATE SET started_at = excluded.started_at
+        WHERE status = 'running' AND started_at < ?
+        ''', (now.isoformat(timespec="seconds"),
+              (now - timedelta(hours=BACKFILL_STALE_HOURS)).isoformat(timespec="seconds"))).rowcount
+        conn.commit()
+        if not claimed:
+            return None
+        try:
+            registered = len(fsck(fix=True)["untracked_files"])
+        except Exception:
+            # Release the claim so the next init retries
+            conn.execute("DELETE FROM manifest_backfill WHERE id = 1 AND status = 'running'")
+            conn.commit()
+            raise
+        conn.execute("UPDATE manifest_backfill SET status = 'done', done_at = ?, registered = ? WHERE id = 1",
+                     (datetime.now().isoformat(timespec="seconds"), registered))
+        conn.commit()
+    finally:
+        conn.close()
+    logging.info(f"Manifest backfill: {registered} existing upload(s) registered",
+                 extra={"operation": "manifest_backfill", "rows": registered})
+    return registered
+
+
+_backfill_started = False
+_backfill_lock = threading.Lock()
+
+
+def start_background_backfill():
+    """
+    Run backfill_manifest() on a daemon thread, once per process.
+    """
+    global _backfill_started
+    with _backfill_lock:
+        if _backfill_started:
+            return
+        _backfill_started = True
+
+    def _worker():
+        try:
+            backfill_manifest()
+        except Exception as e:
+            logging.error(f"Manifest backfill failed: {e}")
+
+    threading.Thread(target=_worker, name="mcu-manifest-backfill", daemon=True).start()
+
+
+def manifest_path(nik, file_name):
+    """
+    Manifest paths are stored relative to UPLOAD_DIR so the volume can be
+    mounted anywhere.
+    """
+    return f"mcu_history/{nik}/{file_name}"
+
+
+def resolve_path(rel_path):
+    return os.path.join(UPLOAD_DIR, *rel_path.split("/"))
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat_and_hash(file_path):
+    st_ = os.stat(file_path)
+    return st_.st_size, st_.st_mtime, hash_file(file_path)
+
+
+def register_file(conn, nik, file_name, mcu_history_id=None):
+    """
+    Insert or refresh the manifest entry for an uploaded file.
+    Does not commit; callers commit together with their own writes.
+    """
+    rel_path = manifest_path(nik, file_name)
+    size, mtime, sha256 = _stat_and_hash(resolve_path(rel_path))
+    conn.execute('''
+    INSERT INTO file_manifest (path, nik, file_name, size, mtime, sha256, mcu_history_id, registered_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET
+        size=excluded.size,
+        mtime=excluded.mtime,
+        sha256=excluded.sha256,
+        mcu_history_id=COALESCE(excluded.mcu_history_id, file_manifest.mcu_history_id),
+        registered_at=excluded.registered_at
+    ''', (rel_path, str(nik), file_name, size, mtime, sha256, mcu_history_id,
+          datetime.now().isoformat(timespec="seconds")))
+    return rel_path
+
+
+def get_manifest_entries(nik):
+    """
+    Return {file_name: manifest row dict} for one employee.
+    """
+    try:
+        conn = get_connection()
+        conn.row_factory = lambda c, r: {col[0]: r[i] for i, col in enumerate(c.description)}
+        rows = conn.execute("SELECT * FROM file_manifest WHERE nik=?", (str(nik),)).fetchall()
+        conn.close()
+        return {row["file_name"]: row for row in rows}
+    except Exception as e:
+        logging.error(f"Error reading file manifest for {nik}: {e}")
+        return {}
+
+
+def _is_referenced(conn, rel_path):
+    """
+    A file is still in use if any mcu_history row (hot or archived) or
+    employee.file_mcu_main points at it (the input form stores the same file
+    for both). `conn` must have the archive attached.
+    """
+    parts = rel_path.split("/")
+    if len(parts) != 3 or parts[0] != "mcu_history":
+        return False
+    nik, file_name = parts[1], parts[2]
+    row = conn.execute('''
+    SELECT 1 FROM mcu_history_all WHERE nik=? AND file_name=?
+    UNION ALL
+    SELECT 1 FROM employee WHERE nik=? AND file_mcu_main=?
+    LIMIT 1
+    ''', (nik, file_name, nik, file_name)).fetchone()
+    return row is not None
+
+
+def enqueue_gc(conn, rel_paths, reason):
+    """
+    Queue files for background deletion. Does not commit.
+    """
+    now = datetime.now().isoformat(timespec="seconds")
+    conn.executemany(
+        "INSERT INTO gc_queue (path, reason, enqueued_at) VALUES (?, ?, ?)",
+        [(p, reason, now) for p in rel_paths]
+    )
+
+
+def enqueue_employee_files(conn, nik, reason):
+    """
+    Queue every manifest entry and loose file of an employee for deletion.
+    The directory listing catches files uploaded before the manifest existed.
+    """
+    rel_paths = {r[0] for r in conn.execute("SELECT path FROM file_manifest WHERE nik=?", (str(nik),))}
+    file_dir = os.path.join(HISTORY_UPLOAD_DIR, str(nik))
+    if os.path.isdir(file_dir):
+        rel_paths.update(manifest_path(nik, fname) for fname in os.listdir(file_dir))
+    enqueue_gc(conn, sorted(rel_paths), reason)
+    return len(rel_paths)
+
+
+def _inside_upload_dir(file_path):
+    root = os.path.realpath(UPLOAD_DIR)
+    return os.path.commonpath([root, os.path.realpath(file_path)]) == root
+
+
+def run_gc(limit=None):
+    """
+    Process pending gc_queue entries. Files that are referenced again (e.g. a
+    new MCU was uploaded for the same year) are kept and only dequeued.
+    Returns a dict with counts.
+    """
+    result = {"deleted": 0, "kept": 0, "failed": 0}
+    conn = get_full_connection()
+    try:
+        query = "SELECT id, path FROM gc_queue ORDER BY id"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        for queue_id, rel_path in conn.execute(query).fetchall():
+            file_path = resolve_path(rel_path)
+            try:
+                if _is_referenced(conn, rel_path):
+                    result["kept"] += 1
+                else:
+                    if not _inside_upload_dir(file_path):
+                        raise ValueError(f"refusing to delete outside {UPLOAD_DIR}: {file_path}")
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    mcu_pack.forget(conn, rel_path)
+                    conn.execute("DELETE FROM file_manifest WHERE path=?", (rel_path,))
+                    parent = os.path.dirname(file_path)
+                    if os.path.isdir(parent) and not os.listdir(parent):
+                        os.rmdir(parent)
+                    result["deleted"] += 1
+                conn.execute("DELETE FROM gc_queue WHERE id=?", (queue_id,))
+            except Exception as e:
+                result["failed"] += 1
+                conn.execute("UPDATE gc_queue SET attempts=attempts+1, last_error=? WHERE id=?", (str(e), queue_id))
+                logging.warning(f"GC failed for {rel_path}: {e}")
+            conn.commit()
+    finally:
+        conn.close()
+    if result["deleted"] or result["failed"]:
+        logging.info(f"GC run: {result}")
+    return result
+
+
+_gc_lock = threading.Lock()
+
+
+def start_background_gc():
+    """
+    Run one GC pass on a daemon thread. If a pass is already running this
+    call does nothing: that pass only works through the entries queued when
+    it started, so newer ones wait for the next call.
+    """
+    def _worker():
+        if not _gc_lock.acquire(blocking=False):
+            return
+        try:
+            run_gc()
+        except Exception as e:
+            logging.error(f"Background GC error: {e}")
+        finally:
+            _gc_lock.release()
+
+    threading.Thread(target=_worker, name="mcu-gc", daemon=True).start()
+
+
+def fsck(workers=4, fix=False, collect_orphans=False):
+    """
+    Reconcile database/uploads/, file_manifest and mcu_history/employee.
+
+    Files on disk are stat'ed and hashed in parallel; entries that live in a
+    pack file (see mcu_pack) count as present. The report lists:
+      - orphan_files: on disk but not referenced by any database row
+      - untracked_files: referenced by the database but missing from the manifest
+      - missing_files: in the manifest but gone from disk
+      - changed_files: size or hash differs from the manifest
+      - dangling_rows: mcu_history rows whose file is neither on disk nor in the manifest
+      - stale_manifest: manifest rows whose mcu_history id no longer exists
+    With fix=True untracked files are registered, changed files re-hashed and
+    missing/stale manifest rows removed. With collect_orphans=True orphan files
+    are queued for GC. Archived history rows (mcu_archive) count as references.
+    """
+    conn = get_full_connection()
+    try:
+        manifest = {}
+        for row in conn.execute("SELECT path, size, sha256, mcu_history_id FROM file_manifest"):
+            manifest[row[0]] = {"size": row[1], "sha256": row[2], "mcu_history_id": row[3]}
+        referenced = {}
+        for hist_id, nik, file_name in conn.execute(
+                "SELECT id, nik, file_name FROM mcu_history_all WHERE file_name IS NOT NULL AND file_name != ''"):
+            referenced[manifest_path(nik, file_name)] = hist_id
+        for nik, file_name in conn.execute(
+                "SELECT nik, file_mcu_main FROM employee WHERE file_mcu_main IS NOT NULL AND file_mcu_main != ''"):
+            referenced.setdefault(manifest_path(nik, file_name), None)
+        history_ids = {r[0] for r in conn.execute("SELECT id FROM mcu_history_all")}
+        packed = {r[0] for r in conn.execute("SELECT path FROM pack_index")}
+
+        on_disk = []
+        if os.path.isdir(HISTORY_UPLOAD_DIR):
+            for nik in os.listdir(HISTORY_UPLOAD_DIR):
+                nik_dir = os.path.join(HISTORY_UPLOAD_DIR, nik)
+                if not os.path.isdir(nik_dir):
+                    continue
+                for fname in os.listdir(nik_dir):
+                    if os.path.isfile(os.path.join(nik_dir, fname)):
+                        on_disk.append(manifest_path(nik, fname))
+
+        def _scan(rel_path):
+            try:
+                return rel_path, _stat_and_hash(resolve_path(rel_path)), None
+            except Exception as e:
+                return rel_path, None, str(e)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            scanned = list(pool.map(_scan, on_disk))
+
+        report = {
+            "scanned": len(on_disk),
+            "packed": len(packed),
+            "orphan_files": [],
+            "untracked_files": [],
+            "missing_files": [],
+            "changed_files": [],
+            "dangling_rows": [],
+            "stale_manifest": [],
+            "errors": [],
+        }
+        disk_set = set()
+        for rel_path, info, error in scanned:
+            if error:
+                report["errors"].append({"path": rel_path, "error": error})
+                continue
+            disk_set.add(rel_path)
+            size, _, sha256 = info
+            if rel_path not in referenced:
+                report["orphan_files"].append(rel_path)
+            if rel_path not in manifest:
+                if rel_path in referenced:
+                    report["untracked_files"].append(rel_path)
+            elif manifest[rel_path]["size"] != size or manifest[rel_path]["sha256"] != sha256:
+                report["changed_files"].append(rel_path)
+
+        for rel_path, entry in manifest.items():
+            if rel_path not in disk_set and rel_path not in packed:
+                report["missing_files"].append(rel_path)
+            hist_id = entry["mcu_history_id"]
+            if hist_id is not None and hist_id not in history_ids:
+                report["stale_manifest"].append(rel_path)
+        for rel_path, hist_id in referenced.items():
+            if hist_id is not None and rel_path not in disk_set and rel_path not in packed and rel_path not in manifest:
+                report["dangling_rows"].append({"mcu_history_id": hist_id, "path": rel_path})
+
+        if fix:
+            for rel_path in report["untracked_files"] + report["changed_files"]:
+                nik, file_name = rel_path.split("/")[1:3]
+                register_file(conn, nik, file_name, referenced.get(rel_path))
+            for rel_path in set(report["missing_files"]):
+                conn.execute("DELETE FROM file_manifest WHERE path=?", (rel_path,))
+            for rel_path in set(report["stale_manifest"]) - set(report["missing_files"]):
+                conn.execute("UPDATE file_manifest SET mcu_history_id=NULL WHERE path=?", (rel_path,))
+            conn.commit()
+        if collect_orphans and report["orphan_files"]:
+            enqueue_gc(conn, report["orphan_files"], "fsck orphan")
+            conn.commit()
+        report["gc_pending"] = conn.execute("SELECT COUNT(*) FROM gc_queue").fetchone()[0]
+        return report
+    finally:
+        conn.close()
@@ -0,0 +1,404 @@
+"""
+Cold-storage pack files for old MCU uploads.
+
+Files older than a configurable number of years are appended into large pack
+files under database/uploads/packs/ and removed from their loose location.
+Each entry is stored (optionally zlib-compressed) at a known offset; the
+offsets live in the pack_index table and in a JSON sidecar next to each pack,
+so a single file is read back with one seek.
+
+read_file()/iter_file() are the only way the app should read an upload: they
+return the loose file when it exists and fall back to the pack otherwise.
+"""
+import hashlib
+import json
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from mcu_archive import get_full_connection
+from mcu_db import UPLOAD_DIR, get_connection
+
+PACK_DIR = os.path.join(UPLOAD_DIR, "packs")
+PACK_MAGIC = b"MCUPACK1"
+PACK_SUFFIX = ".mcupack"
+DEFAULT_MAX_PACK_BYTES = 1024 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def init_pack_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS pack_index (
+        path TEXT PRIMARY KEY,
+        pack_name TEXT,
+        offset INTEGER,
+        stored_size INTEGER,
+        size INTEGER,
+        compression TEXT,
+        sha256 TEXT,
+        packed_at TEXT
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pack_index_pack ON pack_index (pack_name)")
+    conn.commit()
+
+
+def loose_path(rel_path):
+    return os.path.join(UPLOAD_DIR, *rel_path.split("/"))
+
+
+def _pack_file_path(pack_name):
+    return os.path.join(PACK_DIR, pack_name)
+
+
+def get_pack_entry(conn, rel_path):
+    row = conn.execute(
+        "SELECT pack_name, offset, stored_size, size, compression FROM pack_index WHERE path=?", (rel_path,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {"pack_name": row[0], "offset": row[1], "stored_size": row[2], "size": row[3], "compression": row[4]}
+
+
+def iter_file(rel_path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the content of an upload in chunks, from the loose file or its pack.
+    Raises FileNotFoundError if neither exists.
+    """
+    file_path = loose_path(rel_path)
+    if os.path.exists(file_path):
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+        return
+    conn = get_connection()
+    try:
+        entry = get_pack_entry(conn, rel_path)
+    finally:
+        conn.close()
+    if entry is None:
+        raise FileNotFoundError(rel_path)
+    decompressor = zlib.decompressobj() if entry["compression"] == "zlib" else None
+    with open(_pack_file_path(entry["pack_name"]), "rb") as f:
+        f.seek(entry["offset"])
+        remaining = entry["stored_size"]
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                raise IOError(f"Pack {entry['pack_name']} truncated while reading {rel_path}")
+            remaining -= len(chunk)
+            yield decompressor.decompress(chunk) if decompressor else chunk
+        if decompressor:
+            yield decompressor.flush()
+
+
+def read_file(rel_path):
+    return b"".join(iter_file(rel_path))
+
+
+def exists(conn, rel_path):
+    return os.path.exists(loose_path(rel_path)) or get_pack_entry(conn, rel_path) is not None
+
+
+def forget(conn, rel_path):
+    """
+    Drop a packed entry from the index (used by GC). The bytes stay in the pack
+    until compact_packs() rewrites it. Does not commit.
+    """
+    conn.execute("DELETE FROM pack_index WHERE path=?", (rel_path,))
+
+
+def select_candidates(conn, older_than_years):
+    """
+    Manifest entries whose MCU year (or file mtime, for files without a
+    history row) is older than the cutoff and which are still loose. Archived
+    history rows count, so `conn` must have the archive attached.
+    """
+    cutoff_year = datetime.now().year - older_than_years
+    cutoff_ts = (datetime.now() - timedelta(days=365 * older_than_years)).timestamp()
+    rows = conn.execute('''
+    SELECT m.path, m.size, m.sha256
+    FROM file_manifest m
+    LEFT JOIN mcu_history_all h ON h.id = m.mcu_history_id
+    LEFT JOIN pack_index p ON p.path = m.path
+    WHERE p.path IS NULL
+      AND ((h.id IS NOT NULL AND h.mcu_year <= ?) OR (h.id IS NULL AND m.mtime < ?))
+    ORDER BY m.path
+    ''', (cutoff_year, cutoff_ts)).fetchall()
+    return [{"path": r[0], "size": r[1], "sha256": r[2]} for r in rows]
+
+
+class _PackWriter:
+    def __init__(self, compress):
+        os.makedirs(PACK_DIR, exist_ok=True)
+        self.compression = "zlib" if compress else "none"
+        self.pack_name = f"pack-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}{PACK_SUFFIX}"
+        self.file_path = _pack_file_path(self.pack_name)
+        self.f = open(self.file_path + ".tmp", "wb")
+        self.f.write(PACK_MAGIC)
+        self.offset = len(PACK_MAGIC)
+        self.entries = []
+
+    def add(self, rel_path, expected_sha256=None):
+        """
+        Append one loose file. Returns the index entry, or None when the file
+        no longer matches its manifest hash.
+        """
+        digest = hashlib.sha256()
+        compressor = zlib.compressobj(6) if self.compression == "zlib" else None
+        start = self.offset
+        size = 0
+        with open(loose_path(rel_path), "rb") as src:
+            for chunk in iter(lambda: src.read(READ_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                size += len(chunk)
+                out = compressor.compress(chunk) if compressor else chunk
+                self.f.write(out)
+                self.offset += len(out)
+        if compressor:
+            out = compressor.flush()
+            self.f.write(out)
+            self.offset += len(out)
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256:
+            # Roll back the bytes we just wrote
+            self.f.seek(start)
+            self.f.truncate()
+            self.offset = start
+            logging.warning(f"Not packing {rel_path}: hash differs from manifest (run fsck)")
+            return None
+        entry = {
+            "path": rel_path,
+            "offset": start,
+            "stored_size": self.offset - start,
+            "size": size,
+            "compression": self.compression,
+            "sha256": sha256,
+        }
+        self.entries.append(entry)
+        return entry
+
+    def close(self):
+        """
+        fsync the pack and write its sidecar index before anything points at it.
+        The pack keeps its .tmp name (invisible to compact_packs) until
+        _commit_pack() publishes it together with its pack_index rows.
+        """
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        with open(self.file_path + ".idx.json", "w") as idx:
+            json.dump({"pack_name": self.pack_name, "entries": self.entries}, idx)
+
+    def publish(self):
+        os.replace(self.file_path + ".tmp", self.file_path)
+
+
+def _unchanged(file_path, manifest_row, sha256):
+    """
+    True if the loose file is still the one the manifest describes and the
+    pack holds (same hash, size and mtime).
+    """
+    if manifest_row is None or manifest_row[2] != sha256:
+        return False
+    try:
+        st_ = os.stat(file_path)
+    except OSError:
+        return False
+    return st_.st_size == manifest_row[0] and st_.st_mtime == manifest_row[1]
+
+
+def _commit_pack(conn, writer, remove_loose=True, replaces=None):
+    """
+    Index the entries of a closed pack. With remove_loose the loose copies
+    are re-checked against file_manifest under the write lock first: a file
+    re-uploaded or modified while it was being packed is left loose and
+    unindexed (its bytes in the pack are reclaimed by compact_packs). With
+    `replaces` (compaction) only entries still indexed in that pack are
+    moved, so files GC forgot meanwhile stay forgotten. The pack is renamed
+    to its final name inside the same write transaction, so compact_packs()
+    never sees it without its index rows. Returns the number of entries
+    indexed.
+    """
+    writer.close()
+    now = datetime.now().isoformat(timespec="seconds")
+    entries = writer.entries
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if remove_loose:
+            checked = []
+            for e in entries:
+                manifest_row = conn.execute(
+                    "SELECT size, mtime, sha256 FROM file_manifest WHERE path=?", (e["path"],)
+                ).fetchone()
+                if _unchanged(loose_path(e["path"]), manifest_row, e["sha256"]):
+                    checked.append((e, manifest_row))
+                else:
+                    logging.warning(f"Not indexing {e['path']} in {writer.pack_name}: file changed while packing")
+            entries = [e for e, _ in checked]
+        if replaces:
+            indexed = 0
+            for e in entries:
+                indexed += conn.execute('''
+                UPDATE pack_index SET pack_name=?, offset=?, packed_at=? WHERE path=? AND pack_name=?
+                ''', (writer.pack_name, e["offset"], now, e["path"], replaces)).rowcount
+        else:
+            conn.executemany('''
+            INSERT OR REPLACE INTO pack_index (path, pack_name, offset, stored_size, size, compression, sha256, packed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(e["path"], writer.pack_name, e["offset"], e["stored_size"], e["size"], e["compression"], e["sha256"], now)
+                  for e in entries])
+            indexed = len(entries)
+        writer.publish()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if remove_loose:
+        for e, manifest_row in checked:
+            file_path = loose_path(e["path"])
+            # Unlinked only if nothing touched it since the check
+            if not _unchanged(file_path, manifest_row, e["sha256"]):
+                logging.warning(f"Packed {e['path']} but kept the loose copy: it changed after indexing")
+                continue
+            try:
+                os.remove(file_path)
+                parent = os.path.dirname(file_path)
+                if not os.listdir(parent):
+                    os.rmdir(parent)
+            except OSError as err:
+                logging.warning(f"Packed {e['path']} but could not remove loose copy: {err}")
+    return indexed
+
+
+def pack_old_files(older_than_years=3, compress=False, max_pack_bytes=DEFAULT_MAX_PACK_BYTES, dry_run=False):
+    """
+    Move loose files older than `older_than_years` into pack files.
+    PDF scans are already compressed, so compression is off by default; it
+    pays off for images and uncompressed scans.
+    Returns a dict with counts and byte totals.
+    """
+    conn = get_full_connection()
+    result = {"files": 0, "bytes_in": 0, "bytes_stored": 0, "packs": [], "skipped": 0}
+    try:
+        candidates = select_candidates(conn, older_than_years)
+        if dry_run:
+            result["files"] = len(candidates)
+            result["bytes_in"] = sum(c["size"] or 0 for c in candidates)
+            return result
+        writer = None
+        for cand in candidates:
+            if not os.path.exists(loose_path(cand["path"])):
+                result["skipped"] += 1
+                continue
+            if writer is None:
+                writer = _PackWriter(compress)
+            entry = writer.add(cand["path"], cand["sha256"])
+            if entry is None:
+                result["skipped"] += 1
+                continue
+            result["files"] += 1
+            result["bytes_in"] += entry["size"]
+            result["bytes_stored"] += entry["stored_size"]
+            if writer.offset >= max_pack_bytes:
+                changed = len(writer.entries) - _commit_pack(conn, writer)
+                result["files"] -= changed
+                result["skipped"] += changed
+                result["packs"].append(writer.pack_name)
+                writer = None
+        if writer is not None:
+            if writer.entries:
+                changed = len(writer.entries) - _commit_pack(conn, writer)
+                result["files"] -= changed
+                result["skipped"] += changed
+                result["packs"].append(writer.pack_name)
+            else:
+                writer.f.close()
+                os.remove(writer.file_path + ".tmp")
+        logging.info(f"Packed {result['files']} file(s) into {len(result['packs'])} pack(s)")
+        return result
+    finally:
+        conn.close()
+
+
+def compact_packs(min_live_ratio=0.5):
+    """
+    Rewrite packs whose live (still indexed) bytes fell below min_live_ratio
+    after GC, then delete the old pack. Packs still being written keep their
+    .tmp name and are skipped; the old pack is deleted under the write lock,
+    only once no pack_index row points at it.
+    """
+    conn = get_connection()
+    rewritten = []
+    try:
+        if not os.path.isdir(PACK_DIR):
+            return rewritten
+        for pack_name in sorted(os.listdir(PACK_DIR)):
+            if not pack_name.endswith(PACK_SUFFIX):
+                continue
+            pack_path = _pack_file_path(pack_name)
+            total = os.path.getsize(pack_path) - len(PACK_MAGIC)
+            rows = conn.execute(
+                "SELECT path, offset, stored_size, size, compression, sha256 FROM pack_index WHERE pack_name=? ORDER BY offset",
+                (pack_name,)
+            ).fetchall()
+            live = sum(r[2] for r in rows)
+            if total > 0 and live / total >= min_live_ratio:
+                continue
+            if rows:
+                writer = _PackWriter(compress=False)
+                with open(pack_path, "rb") as src:
+                    for path, offset, stored_size, size, compression, sha256 in rows:
+                        src.seek(offset)
+                        new_offset = writer.offset
+                        remaining = stored_size
+                        while remaining > 0:
+                            chunk = src.read(min(READ_CHUNK_SIZE, remaining))
+                            writer.f.write(chunk)
+                            remaining -= len(chunk)
+                        writer.offset += stored_size
+                        # Entries are copied byte-for-byte, so keep their original compression
+                        writer.entries.append({"path": path, "offset": new_offset, "stored_size": stored_size,
+                                               "size": size, "compression": compression, "sha256": sha256})
+                _commit_pack(conn, writer, remove_loose=False, replaces=pack_name)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("SELECT 1 FROM pack_index WHERE pack_name=? LIMIT 1", (pack_name,)).fetchone():
+                    logging.warning(f"Not deleting {pack_name}: entries were indexed in it during compaction")
+                    continue
+                os.remove(pack_path)
+                if os.path.exists(pack_path + ".idx.json"):
+                    os.remove(pack_path + ".idx.json")
+            finally:
+                conn.rollback()
+            rewritten.append(pack_name)
+        return rewritten
+    finally:
+        conn.close()
+
+
+def storage_stats():
+    """
+    Disk usage and file counts of the loose and packed tiers.
+    """
+    stats = {"loose_files": 0, "loose_bytes": 0, "packed_files": 0, "packed_bytes": 0,
+             "packed_stored_bytes": 0, "pack_files": 0, "pack_disk_bytes": 0}
+    history_dir = os.path.join(UPLOAD_DIR, "mcu_history")
+    for root, _, files in os.walk(history_dir):
+        for fname in files:
+            stats["loose_files"] += 1
+            stats["loose_bytes"] += os.path.getsize(os.path.join(root, fname))
+    if os.path.isdir(PACK_DIR):
+        for pack_name in os.listdir(PACK_DIR):
+            if pack_name.endswith(PACK_SUFFIX):
+                stats["pack_files"] += 1
+                stats["pack_disk_bytes"] += os.path.getsize(_pack_file_path(pack_name))
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM pack_index").fetchone()
+        stats["packed_files"], stats["packed_bytes"], stats["packed_stored_bytes"] = row
+    finally:
+        conn.close()
+    return stats
@@ -0,0 +1,271 @@
+"""
+Precomputed per-employee profile documents for the MCU History page.
+
+Opening an employee used to read the employee row, the history, the file
+manifest and the archive count separately. A profile document holds all of
+it in one compact JSON record keyed by NIK in employee_profile:
+
+    {"employee": {...}, "history": [...newest first...],
+     "manifest": {file_name: entry}, "archived": n, "status": "...",
+     "stale_on": "YYYY-MM-DD" or null}
+
+so opening an employee is one primary-key read, however large the
+workforce. Documents are built on first open and kept until that employee
+changes: triggers on employee, mcu_history and file_manifest delete the
+employee's document in the same transaction as the write (and
+mcu_archive.delete_archived does the same for archived rows), so a stale
+document is never read. `stale_on` covers the calendar: the day the
+derived status would move on (Berkala -> Will Expire -> Expired), after
+which the document is rebuilt.
+
+A bounded in-process LRU (MCU_PROFILE_CACHE_ENTRIES) sits in front. An
+entry is served without touching any table while `PRAGMA data_version` is
+unchanged (nothing was committed to the database by anyone, the same check
+mcu_coherence uses); after a commit it is re-read by primary key once.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+import mcu_archive
+from mcu_db import DB_PATH, get_connection
+from mcu_projection import STATUS_SQL
+
+PROFILE_CACHE_ENTRIES = int(os.environ.get("MCU_PROFILE_CACHE_ENTRIES", "1024"))
+REBUILD_BATCH_SIZE = 500
+
+# Tables whose rows belong to one employee (by nik) and end up in the document
+PROFILE_SOURCES = ("employee", "mcu_history", "file_manifest")
+
+# Day the status derived by STATUS_SQL changes next (NULL: never, by date alone)
+STALE_ON_SQL = '''
+CASE
+    WHEN COALESCE(employment_status, '') != 'Permanent' OR COALESCE(mcu_expired, '') = '' THEN NULL
+    WHEN date(mcu_expired) <= date('now', 'localtime') THEN NULL
+    WHEN julianday(date(mcu_expired)) - julianday('now', 'localtime') < 31 THEN date(mcu_expired)
+    ELSE date(mcu_expired, '-31 days')
+END
+'''
+
+
+def init_profile_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS employee_profile (
+        nik TEXT PRIMARY KEY,
+        doc TEXT NOT NULL,
+        stale_on TEXT,
+        built_at TEXT NOT NULL
+    ) WITHOUT ROWID
+    ''')
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table in PROFILE_SOURCES:
+        # The CLI may run before the app created the tables; init_db adds the triggers later
+        if table not in existing:
+            continue
+        for op, niks in (("insert", "NEW.nik"), ("update", "NEW.nik, OLD.nik"), ("delete", "OLD.nik")):
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_profile AFTER {op.upper()} ON {table}
+            BEGIN
+                DELETE FROM employee_profile WHERE nik IN ({niks});
+            END
+            ''')
+    conn.commit()
+
+
+def _rows(cursor):
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _read(conn, nik):
+    """
+    Read the sources of one employee's document. Caller holds a transaction
+    and has the archive attached.
+    """
+    employee = _rows(conn.execute("SELECT * FROM employee WHERE nik=?", (nik,)))
+    if not employee:
+        return None
+    status, stale_on = conn.execute(
+        f"SELECT {STATUS_SQL}, {STALE_ON_SQL} FROM employee WHERE nik=?", (nik,)
+    ).fetchone()
+    history_columns = ", ".join(mcu_archive.HISTORY_COLUMNS)
+    doc = {
+        "employee": employee[0],
+        # Same rows and order as mcu_archive.get_history(full=False)
+        "history": _rows(conn.execute(
+            f"SELECT {history_columns} FROM mcu_history WHERE nik=? ORDER BY mcu_year DESC", (nik,)
+        )),
+        "manifest": {row["file_name"]: row for row in _rows(conn.execute(
+            "SELECT * FROM file_manifest WHERE nik=?", (str(nik),)
+        ))},
+        "archived": mcu_archive.count_archived(nik, conn),
+        "status": status,
+        "stale_on": stale_on,
+    }
+    return doc
+
+
+def _store(conn, nik, doc):
+    conn.execute(
+        "INSERT OR REPLACE INTO employee_profile (nik, doc, stale_on, built_at) VALUES (?, ?, ?, ?)",
+        (nik, json.dumps(doc, separators=(",", ":"), default=str), doc["stale_on"],
+         datetime.now().isoformat(timespec="seconds"))
+    )
+
+
+def _build(conn, nik):
+    """
+    Read and store one document. Caller holds a write transaction and has
+    the archive attached.
+    """
+    doc = _read(conn, nik)
+    if doc is not None:
+        _store(conn, nik, doc)
+    return doc
+
+
+def build_profile(conn, nik):
+    """
+    Build and store the document of one employee; None if the NIK does not
+    exist. The sources are read in a deferred (read-only) transaction, so
+    opening an employee does not queue for the write lock; only the upsert
+    takes it, without waiting. The document is stored only if the lock is
+    free and nothing was committed since it was read (`PRAGMA data_version`
+    unchanged); otherwise it is returned without being stored and the next
+    open builds it again.
+    """
+    mcu_archive.attach_archive(conn)
+    conn.execute("BEGIN")
+    try:
+        # Shared locks on main and archive first: both are read at one point in time
+        conn.execute("SELECT COUNT(*) FROM main.sqlite_master")
+        conn.execute(f"SELECT COUNT(*) FROM {mcu_archive.ARCHIVE_SCHEMA}.sqlite_master")
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        doc = _read(conn, nik)
+    finally:
+        conn.rollback()
+    if doc is None:
+        return None
+    # A writer holding the lock changes data_version when it commits, so waiting for it gains nothing
+    busy_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.execute("PRAGMA busy_timeout = 0")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError:
+        return doc
+    finally:
+        conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    try:
+        if conn.execute("PRAGMA data_version").fetchone()[0] == version:
+            _store(conn, nik, doc)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return doc
+
+
+def rebuild_all():
+    """
+    Build the documents that are missing or past stale_on (e.g. after a bulk
+    import, so the first opens are fast too). Returns the number built.
+    """
+    started = time.perf_counter()
+    today = date.today().isoformat()
+    conn = mcu_archive.get_full_connection()
+    built = 0
+    try:
+        niks = [r[0] for r in conn.execute('''
+        SELECT e.nik FROM employee e LEFT JOIN employee_profile p ON p.nik = e.nik
+        WHERE p.nik IS NULL OR p.stale_on <= ?
+        ''', (today,))]
+        # One short write transaction per batch, so the app's writers are not held up for long
+        for start in range(0, len(niks), REBUILD_BATCH_SIZE):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                built += sum(_build(conn, nik) is not None for nik in niks[start:start + REBUILD_BATCH_SIZE])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        conn.close()
+    logging.info(f"Built {built} employee profile(s)", extra={
+        "operation": "profile_rebuild", "rows": built, "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+    return built
+
+
+def _fresh(doc, today):
+    return doc["stale_on"] is None or doc["stale_on"] > today
+
+
+class ProfileCache:
+    def __init__(self, max_entries=PROFILE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # nik -> (doc, data_version it was last read at)
+        self._entries = OrderedDict()
+        self._conn = None
+
+    def _data_version(self):
+        """
+        Changes whenever any other connection commits to the database. Caller
+        holds the lock.
+        """
+        if self._conn is None:
+            self._conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+            # Autocommit: a lingering read transaction would freeze data_version
+            self._conn.isolation_level = None
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, nik):
+        """
+        Profile document of `nik` (None if it does not exist): from memory if
+        nothing was written since, else one primary-key read, else a rebuild.
+        """
+        nik = str(nik)
+        today = date.today().isoformat()
+        with self._lock:
+            version = self._data_version()
+            entry = self._entries.get(nik)
+            if entry is not None and entry[1] == version and _fresh(entry[0], today):
+                self._entries.move_to_end(nik)
+                return entry[0]
+        conn = get_connection()
+        try:
+            row = conn.execute("SELECT doc FROM employee_profile WHERE nik=?", (nik,)).fetchone()
+            doc = json.loads(row[0]) if row is not None else None
+            if doc is None or not _fresh(doc, today):
+                doc = build_profile(conn, nik)
+        finally:
+            conn.close()
+        if doc is None:
+            self.forget(nik)
+            return None
+        with self._lock:
+            self._entries[nik] = (doc, version)
+            self._entries.move_to_end(nik)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return doc
+
+    def forget(self, nik):
+        with self._lock:
+            self._entries.pop(str(nik), None)
+
+
+_cache = ProfileCache()
+
+
+def get_profile(nik):
+    """
+    {"employee", "history", "manifest", "archived", "status", "stale_on"}
+    of one employee, or None.
+    """
+    return _cache.get(nik)
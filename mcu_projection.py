@@ -0,0 +1,189 @@
+"""
+"Latest MCU" projection on the employee table.
+
+employee.mcu_date, mcu_expired, file_mcu_main, diagnosis and recommendation
+are a copy of the employee's latest mcu_history row (by mcu_year, mcu_date,
+id), and employee.status is derived from mcu_expired and employment_status.
+Both are maintained by SQLite triggers, so an MCU is written once, into
+mcu_history, and every writer (Tambah MCU Baru, edits, deletes, imports,
+the CLI) keeps the dashboard, export and status logic in step without
+recomputing latest-per-NIK anywhere. Lookups go through the
+(nik, mcu_year) index.
+
+The history triggers only do work when the changed row is (or was) the
+employee's latest, so archiving old rows or adding an older MCU does not
+touch employee at all.
+
+Status follows determine_mcu_status() in mcu.py: Permanent employees are
+No MCU / Expired / Will Expire (30 days) / Berkala, everyone else
+Pre Employee. Because "today" moves, refresh_status() re-derives it; the
+daily compliance snapshot calls it before counting, and the dashboard calls
+refresh_status_daily() so a process that runs without that job still moves
+on at most once a day.
+"""
+import logging
+import threading
+from datetime import date
+
+import mcu_archive
+from mcu_db import get_connection
+
+PROJECTED_COLUMNS = ("mcu_date", "mcu_expired", "file_mcu_main", "diagnosis", "recommendation")
+HISTORY_SOURCE_COLUMNS = ("mcu_date", "expired_date", "file_name", "diagnosis", "recommendation")
+# The dashboard's refresh only waits this long for the write lock, then skips
+DAILY_REFRESH_TIMEOUT = 2
+
+STATUS_SQL = '''
+CASE
+    WHEN COALESCE(employment_status, '') != 'Permanent' THEN 'Pre Employee'
+    WHEN COALESCE(mcu_expired, '') = '' THEN 'No MCU'
+    WHEN date(mcu_expired) <= date('now', 'localtime') THEN 'Expired'
+    WHEN julianday(date(mcu_expired)) - julianday('now', 'localtime') < 31 THEN 'Will Expire'
+    ELSE 'Berkala'
+END
+'''
+
+# Row `r` is the latest of its employee if no row sorts after it
+_NO_NEWER_ROW = '''
+NOT EXISTS (SELECT 1 FROM mcu_history n WHERE n.nik = {r}.nik
+            AND (n.mcu_year, n.mcu_date, n.id) > ({r}.mcu_year, {r}.mcu_date, {r}.id))
+'''
+
+
+def _project_sql(source, nik_expr):
+    columns = ", ".join(PROJECTED_COLUMNS)
+    source_columns = ", ".join(HISTORY_SOURCE_COLUMNS)
+    return f'''
+    UPDATE employee SET ({columns}) = (
+        SELECT {source_columns} FROM {source} h WHERE h.nik = employee.nik
+        ORDER BY h.mcu_year DESC, h.mcu_date DESC, h.id DESC LIMIT 1
+    )
+    WHERE nik = {nik_expr}
+    '''
+
+
+def init_latest_mcu_projection(conn):
+    """
+    Create the projection triggers. The first time (no triggers yet) also
+    migrates existing data, see rebuild_projection().
+    """
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    # The CLI may run before the app created the tables; init_db adds the triggers later
+    if not {"employee", "mcu_history"} <= tables:
+        return
+    existing = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_mcu_history_insert_latest'"
+    ).fetchone()
+    project_new = _project_sql("mcu_history", "NEW.nik") + ";"
+    project_old = _project_sql("mcu_history", "OLD.nik") + ";"
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_mcu_history_insert_latest AFTER INSERT ON mcu_history
+    WHEN {_NO_NEWER_ROW.format(r="NEW")}
+    BEGIN
+        {project_new}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_mcu_history_update_latest AFTER UPDATE ON mcu_history
+    BEGIN
+        {project_new}
+        {project_old}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_mcu_history_delete_latest AFTER DELETE ON mcu_history
+    WHEN {_NO_NEWER_ROW.format(r="OLD")}
+    BEGIN
+        {project_old}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_employee_insert_status AFTER INSERT ON employee
+    BEGIN
+        UPDATE employee SET status = {STATUS_SQL} WHERE id = NEW.id;
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_employee_update_status AFTER UPDATE OF mcu_expired, employment_status ON employee
+    BEGIN
+        UPDATE employee SET status = {STATUS_SQL} WHERE id = NEW.id AND status IS NOT {STATUS_SQL};
+    END
+    ''')
+    conn.commit()
+    if not existing:
+        rebuild_projection(conn)
+
+
+def rebuild_projection(conn):
+    """
+    One-off migration and repair. Employees whose employee.mcu_date is newer
+    than anything in their history (MCUs entered or edited only on the
+    employee row) first get that MCU written to mcu_history; then every
+    employee with history is re-projected from its latest row, hot or
+    archived, and every status re-derived. Returns (history rows added,
+    employees projected).
+    """
+    mcu_archive.attach_archive(conn)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        added = conn.execute('''
+        INSERT INTO mcu_history (nik, mcu_year, mcu_date, expired_date, file_name, diagnosis, recommendation)
+        SELECT e.nik, CAST(SUBSTR(e.mcu_date, 1, 4) AS INTEGER), e.mcu_date, e.mcu_expired, e.file_mcu_main,
+               e.diagnosis, e.recommendation
+        FROM employee e
+        WHERE COALESCE(e.mcu_date, '') != ''
+          AND NOT EXISTS (SELECT 1 FROM mcu_history_all h WHERE h.nik = e.nik AND date(h.mcu_date) >= date(e.mcu_date))
+        ''').rowcount
+        projected = conn.execute(
+            _project_sql("mcu_history_all", "employee.nik") + " AND nik IN (SELECT nik FROM mcu_history_all)"
+        ).rowcount
+        refresh_status(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logging.info(f"Latest-MCU projection rebuilt: {added} history row(s) added, {projected} employee(s) projected",
+                 extra={"operation": "rebuild_projection", "rows": projected})
+    return added, projected
+
+
+def refresh_status(conn):
+    """
+    Re-derive employee.status for today (only rows whose status changes are
+    written). Does not commit. Returns the number of employees updated.
+    """
+    return conn.execute(f"UPDATE employee SET status = {STATUS_SQL} WHERE status IS NOT {STATUS_SQL}").rowcount
+
+
+_refreshed_on = None
+_refresh_lock = threading.Lock()
+
+
+def refresh_status_daily():
+    """
+    refresh_status() at most once per process per day. Only takes the write
+    lock if some status is out of date, and gives up after
+    DAILY_REFRESH_TIMEOUT seconds if a writer holds it (sqlite3 raises;
+    the next call tries again). Returns the number of employees updated.
+    """
+    global _refreshed_on
+    today = date.today()
+    with _refresh_lock:
+        if _refreshed_on == today:
+            return 0
+        conn = get_connection(timeout=DAILY_REFRESH_TIMEOUT)
+        try:
+            stale = conn.execute(f"SELECT 1 FROM employee WHERE status IS NOT {STATUS_SQL} LIMIT 1").fetchone()
+            changed = refresh_status(conn) if stale else 0
+            conn.commit()
+        finally:
+            conn.close()
+        _refreshed_on = today
+    return changed
+
+
+def latest_history_id(conn, nik):
+    row = conn.execute(
+        "SELECT id FROM mcu_history WHERE nik = ? ORDER BY mcu_year DESC, mcu_date DESC, id DESC LIMIT 1", (nik,)
+    ).fetchone()
+    return row[0] if row else None
@@ -0,0 +1,204 @@
+"""
+Downscaled renditions of image MCU uploads.
+
+For every png/jpg/jpeg upload a preview (longest side PREVIEW_MAX_PX) and a
+thumbnail (THUMB_MAX_PX) are generated once with Pillow and stored as JPEG
+under database/renditions/<sha[:2]>/<sha>.<kind>.jpg. Renditions are keyed
+by the content hash from file_manifest, so a re-upload of the same bytes
+reuses them and a changed file gets new ones. They are derived data: not
+part of backups, rebuilt on demand, and pruned when no manifest row has
+their hash any more.
+
+Generation runs on a small background pool; the page asks for missing
+renditions and shows the original until they exist. Without Pillow the
+functions report nothing available and the page keeps showing originals.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from mcu_db import DB_DIR, get_connection
+import mcu_pack
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow ships with streamlit; keep the CLI usable without it
+    Image = None
+
+RENDITION_DIR = os.path.join(DB_DIR, "renditions")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+PREVIEW_MAX_PX = int(os.environ.get("MCU_PREVIEW_MAX_PX", "1600"))
+THUMB_MAX_PX = 160
+RENDITION_SIZES = {"preview": (PREVIEW_MAX_PX, 82), "thumb": (THUMB_MAX_PX, 70)}
+RENDITION_WORKERS = int(os.environ.get("MCU_RENDITION_WORKERS", "2"))
+
+_executor = None
+_pending = set()
+_failed = set()
+_lock = threading.Lock()
+
+
+def available():
+    return Image is not None
+
+
+def is_image(file_name):
+    return bool(file_name) and file_name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def rendition_path(sha256, kind):
+    return os.path.join(RENDITION_DIR, sha256[:2], f"{sha256}.{kind}.jpg")
+
+
+def get_rendition(sha256, kind):
+    """
+    Rendition bytes, or None if not generated (yet).
+    """
+    if not sha256:
+        return None
+    try:
+        with open(rendition_path(sha256, kind), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _encode(img, max_px, quality):
+    rendition = img.copy()
+    rendition.thumbnail((max_px, max_px))
+    out = BytesIO()
+    rendition.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def build_renditions(rel_path, sha256):
+    """
+    Decode the original once and write every missing rendition. Returns the
+    number written.
+    """
+    missing = [kind for kind in RENDITION_SIZES if not os.path.exists(rendition_path(sha256, kind))]
+    if not missing:
+        return 0
+    img = Image.open(BytesIO(mcu_pack.read_file(rel_path)))
+    # JPEG: let the decoder downscale by 1/2..1/8 instead of decoding full size
+    img.draft("RGB", (PREVIEW_MAX_PX, PREVIEW_MAX_PX))
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    for kind in missing:
+        max_px, quality = RENDITION_SIZES[kind]
+        data = _encode(img, max_px, quality)
+        out_path = rendition_path(sha256, kind)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, out_path)
+    return len(missing)
+
+
+def _build_in_background(rel_path, sha256):
+    try:
+        build_renditions(rel_path, sha256)
+    except Exception as e:
+        with _lock:
+            _failed.add(sha256)
+        logging.warning(f"Rendition failed for {rel_path}: {e}")
+    finally:
+        with _lock:
+            _pending.discard(sha256)
+
+
+def request_renditions(entries):
+    """
+    Queue rendition builds for manifest entries (dicts with file_name, path,
+    sha256) whose renditions are missing. Returns how many were queued.
+    """
+    global _executor
+    if not available():
+        return 0
+    queued = 0
+    for entry in entries:
+        sha256 = entry.get("sha256")
+        if not sha256 or not is_image(entry.get("file_name")):
+            continue
+        if all(os.path.exists(rendition_path(sha256, kind)) for kind in RENDITION_SIZES):
+            continue
+        with _lock:
+            # Unreadable images are not retried until the process restarts
+            if sha256 in _pending or sha256 in _failed:
+                continue
+            _pending.add(sha256)
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=RENDITION_WORKERS, thread_name_prefix="mcu-rendition")
+        _executor.submit(_build_in_background, entry["path"], sha256)
+        queued += 1
+    return queued
+
+
+def is_pending(sha256):
+    with _lock:
+        return sha256 in _pending
+
+
+def build_all(workers=RENDITION_WORKERS):
+    """
+    Backfill renditions for every image in the manifest (CLI). Returns
+    {"images", "built", "failed"}.
+    """
+    if not available():
+        raise RuntimeError("Pillow is not installed")
+    conn = get_connection()
+    try:
+        entries = conn.execute(
+            "SELECT path, sha256 FROM file_manifest WHERE sha256 IS NOT NULL "
+            "AND (LOWER(file_name) LIKE '%.png' OR LOWER(file_name) LIKE '%.jpg' OR LOWER(file_name) LIKE '%.jpeg')"
+        ).fetchall()
+    finally:
+        conn.close()
+    # One build per hash: identical uploads share their renditions
+    unique = dict((sha256, path) for path, sha256 in entries)
+    result = {"images": len(unique), "built": 0, "failed": 0}
+
+    def _build(item):
+        sha256, path = item
+        try:
+            return build_renditions(path, sha256) > 0, None
+        except Exception as e:
+            return False, f"{path}: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for built, error in pool.map(_build, unique.items()):
+            if error:
+                result["failed"] += 1
+                logging.warning(f"Rendition failed for {error}")
+            elif built:
+                result["built"] += 1
+    return result
+
+
+def prune_renditions():
+    """
+    Delete renditions whose hash no longer appears in file_manifest.
+    """
+    if not os.path.isdir(RENDITION_DIR):
+        return 0
+    conn = get_connection()
+    try:
+        live = {r[0] for r in conn.execute("SELECT DISTINCT sha256 FROM file_manifest WHERE sha256 IS NOT NULL")}
+    finally:
+        conn.close()
+    removed = 0
+    for root, _, files in os.walk(RENDITION_DIR):
+        for fname in files:
+            if fname.split(".", 1)[0] not in live:
+                os.remove(os.path.join(root, fname))
+                removed += 1
+    return removed
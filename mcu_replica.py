@@ -0,0 +1,225 @@
+"""
+In-memory analytics replica of the MCU database.
+
+The Dashboard, Health Monitoring and Export pages read whole tables. On the
+on-disk file those long reads hold a shared lock that makes HR's writes on
+the Input and History pages wait. They read this replica instead: an
+in-memory copy of mcu_database.db and mcu_archive.db taken with the SQLite
+backup API, inside one read transaction so both files are copied at the
+same point in time (the disk file is only locked for the copy itself).
+
+Each snapshot is a named shared-cache memory database, so any thread opens
+its own connections to it. A snapshot stays alive while the replica or a
+reader still holds a connection; refreshing builds the next one alongside
+and swaps it in.
+
+Refresh policy:
+- a write anywhere (write_version, via mcu_coherence) starts a background
+  refresh about a second later; readers keep using the previous snapshot
+  meanwhile
+- once a snapshot has been behind the database for more than
+  MCU_REPLICA_MAX_STALENESS_S, the next reader waits for the refresh
+- MCU_ANALYTICS_REPLICA=0 turns the replica off: readers get ordinary
+  connections to the database files (e.g. on hosts short on memory; the
+  replica needs about the size of both files in RAM, twice during a refresh)
+
+Pages show snapshot_info()["taken_at"] so users know how fresh the numbers are.
+Anything that writes, or sends reminders based on flags, reads the database
+itself.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from mcu_archive import ARCHIVE_SCHEMA, attach_archive, get_full_connection
+import mcu_coherence
+from mcu_db import DB_PATH
+
+ENABLED = os.environ.get("MCU_ANALYTICS_REPLICA", "1") != "0"
+MAX_STALENESS = int(os.environ.get("MCU_REPLICA_MAX_STALENESS_S", "60"))
+# Background refreshes wait this long first, so a burst of writes costs one copy
+REFRESH_DEBOUNCE = 1.0
+
+
+class _Snapshot:
+    def __init__(self, generation):
+        self.main_uri = f"file:mcu_replica_{os.getpid()}_{generation}?mode=memory&cache=shared"
+        self.archive_uri = f"file:mcu_replica_archive_{os.getpid()}_{generation}?mode=memory&cache=shared"
+        # Keep both memory databases alive for as long as this snapshot is current
+        self._holders = [sqlite3.connect(uri, uri=True, check_same_thread=False)
+                         for uri in (self.main_uri, self.archive_uri)]
+        self.write_version = None
+        self.taken_at = None
+
+    def copy_from(self, source):
+        source.execute("BEGIN")
+        try:
+            # Shared locks on both files first: main and archive are copied at one point in time
+            source.execute("SELECT COUNT(*) FROM main.sqlite_master")
+            source.execute(f"SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.sqlite_master")
+            source.backup(self._holders[0], name="main")
+            source.backup(self._holders[1], name=ARCHIVE_SCHEMA)
+        finally:
+            source.rollback()
+        row = self._holders[0].execute("SELECT version FROM write_version WHERE id = 1").fetchone()
+        self.write_version = row[0] if row else 0
+        self.taken_at = datetime.now()
+
+    def connect(self):
+        conn = sqlite3.connect(self.main_uri, uri=True, check_same_thread=False)
+        attach_archive(conn, archive_path=self.archive_uri)
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def close(self):
+        for holder in self._holders:
+            holder.close()
+
+
+class AnalyticsReplica:
+    def __init__(self, max_staleness=MAX_STALENESS):
+        self.max_staleness = max_staleness
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+        self._behind_since = None
+        self._refreshing = False
+        self._hook_registered = False
+
+    def refresh(self):
+        """
+        Take a new snapshot and make it current. Returns its info.
+        """
+        with self._refresh_lock:
+            started = time.perf_counter()
+            with self._lock:
+                self._generation += 1
+                generation = self._generation
+            snapshot = _Snapshot(generation)
+            source = get_full_connection()
+            try:
+                snapshot.copy_from(source)
+            except Exception:
+                snapshot.close()
+                raise
+            finally:
+                source.close()
+            with self._lock:
+                previous, self._snapshot = self._snapshot, snapshot
+                self._behind_since = None
+            if previous is not None:
+                # Readers still connected keep the old memory database until they close
+                previous.close()
+            logging.info(f"Analytics replica refreshed to write version {snapshot.write_version}", extra={
+                "operation": "replica_refresh", "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+            })
+            return self._info(snapshot)
+
+    def _refresh_in_background(self):
+        try:
+            while True:
+                time.sleep(REFRESH_DEBOUNCE)
+                self.refresh()
+                with self._lock:
+                    caught_up = self._snapshot.write_version == mcu_coherence.current_write_version()
+                    if caught_up:
+                        self._refreshing = False
+                        return
+        except Exception as e:
+            logging.error(f"Analytics replica refresh failed: {e}")
+            with self._lock:
+                self._refreshing = False
+
+    def request_refresh(self, version=None):
+        if not ENABLED:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name="mcu-replica", daemon=True).start()
+
+    def current(self):
+        """
+        The snapshot readers should use now, refreshing first if it is
+        missing or has been behind for longer than max_staleness.
+        """
+        if not self._hook_registered:
+            mcu_coherence.on_change(self.request_refresh)
+            self._hook_registered = True
+        version = mcu_coherence.current_write_version()
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.write_version != version and self._behind_since is None:
+                self._behind_since = time.monotonic()
+            behind_for = time.monotonic() - self._behind_since if self._behind_since is not None else 0
+        if snapshot is None or (snapshot.write_version != version and behind_for > self.max_staleness):
+            self.refresh()
+            with self._lock:
+                return self._snapshot
+        if snapshot.write_version != version:
+            self.request_refresh()
+        return snapshot
+
+    def open_reader(self):
+        """
+        (connection, info) on the current snapshot; the caller closes the
+        connection. For handing a snapshot to a background job.
+        """
+        if not ENABLED:
+            conn = attach_archive(sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False))
+            return conn, {"write_version": mcu_coherence.current_write_version(), "taken_at": datetime.now(),
+                          "replica": False}
+        while True:
+            snapshot = self.current()
+            with self._lock:
+                # A concurrent refresh may have just closed it; take the new one then
+                if snapshot is self._snapshot:
+                    return snapshot.connect(), self._info(snapshot)
+
+    def snapshot_info(self):
+        if not ENABLED:
+            return {"write_version": mcu_coherence.current_write_version(), "taken_at": datetime.now(), "replica": False}
+        return self._info(self.current())
+
+    @staticmethod
+    def _info(snapshot):
+        return {"write_version": snapshot.write_version, "taken_at": snapshot.taken_at, "replica": True}
+
+
+_replica = AnalyticsReplica()
+
+
+def open_reader():
+    return _replica.open_reader()
+
+
+@contextmanager
+def reader():
+    """
+    Read-only connection to the current snapshot (mcu_history_all defined).
+    Yields (connection, info); info has write_version and taken_at.
+    """
+    conn, info = _replica.open_reader()
+    try:
+        yield conn, info
+    finally:
+        conn.close()
+
+
+def refresh():
+    if not ENABLED:
+        return _replica.snapshot_info()
+    return _replica.refresh()
+
+
+def snapshot_info():
+    """
+    write_version and taken_at of the snapshot readers currently get.
+    """
+    return _replica.snapshot_info()
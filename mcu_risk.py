@@ -0,0 +1,332 @@
+"""
+Health-risk scoring for the whole workforce.
+
+Every employee gets a score that is the sum of weighted factors:
+
+    recurring_diagnosis  points per extra MCU year with the same abnormal
+                         diagnosis in mcu_history (2 years -> 1x, 3 years -> 2x)
+    current_finding      the latest MCU (employee.diagnosis) is abnormal
+    age_bands            points for the highest band reached ({min_age: points})
+    mcu_expired / mcu_will_expire / no_mcu
+                         state of employee.mcu_expired today
+    positions            extra points per position ({position: points})
+
+Scores are computed in one vectorized pass and stored in employee_risk with
+an index on score, so the page reads the top-N with a bounded query. Like
+the rest of the Health Monitoring page, scores are computed from the
+analytics replica (mcu_replica) and keyed on its snapshot's write version;
+the table is rebuilt only when that version, the weights or the date change
+(ensure_scores). Weights live in risk_config and can be edited on the
+Health Monitoring page.
+"""
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from mcu_analytics import NORMAL_DIAGNOSES
+from mcu_archive import attach_archive
+from mcu_db import get_connection
+import mcu_replica
+
+DEFAULT_RISK_WEIGHTS = {
+    "recurring_diagnosis": 3.0,
+    "current_finding": 2.0,
+    "mcu_expired": 3.0,
+    "mcu_will_expire": 1.0,
+    "no_mcu": 2.0,
+    "age_bands": {"40": 1.0, "50": 2.0, "60": 3.0},
+    "positions": {},
+}
+
+WILL_EXPIRE_DAYS = 30
+
+
+def init_risk_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS employee_risk (
+        nik TEXT PRIMARY KEY,
+        score REAL NOT NULL,
+        recurring_diagnosis TEXT,
+        recurring_years INTEGER,
+        age INTEGER,
+        mcu_state TEXT,
+        reasons TEXT
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_employee_risk_score ON employee_risk (score DESC)")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS risk_config (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        weights TEXT NOT NULL,
+        updated_at TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS risk_score_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        write_version INTEGER,
+        weights_hash TEXT,
+        score_date TEXT,
+        computed_at TEXT,
+        employees INTEGER
+    )
+    ''')
+    conn.commit()
+
+
+def get_risk_weights(conn=None):
+    """
+    Configured weights merged over DEFAULT_RISK_WEIGHTS.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        row = conn.execute("SELECT weights FROM risk_config WHERE id = 1").fetchone()
+    finally:
+        if own_conn:
+            conn.close()
+    weights = json.loads(json.dumps(DEFAULT_RISK_WEIGHTS))
+    if row:
+        weights.update(json.loads(row[0]))
+    return weights
+
+
+def save_risk_weights(weights):
+    merged = json.loads(json.dumps(DEFAULT_RISK_WEIGHTS))
+    merged.update(weights)
+    conn = get_connection()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO risk_config (id, weights, updated_at) VALUES (1, ?, ?)",
+            (json.dumps(merged, sort_keys=True), datetime.now().isoformat(timespec="seconds"))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _weights_hash(weights):
+    return hashlib.sha256(json.dumps(weights, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _load_recurring(conn):
+    """
+    Per employee, the abnormal diagnosis seen in the most distinct MCU years
+    (only diagnoses seen in 2+ years), over hot and archived history.
+    """
+    attach_archive(conn)
+    placeholders = ",".join("?" * len(NORMAL_DIAGNOSES))
+    recurring = pd.read_sql(f'''
+        SELECT nik, MAX(TRIM(diagnosis)) AS recurring_diagnosis, COUNT(DISTINCT mcu_year) AS recurring_years
+        FROM mcu_history_all
+        WHERE LOWER(TRIM(COALESCE(diagnosis, ''))) NOT IN ({placeholders})
+        GROUP BY nik, LOWER(TRIM(diagnosis))
+        HAVING COUNT(DISTINCT mcu_year) >= 2
+    ''', conn, params=NORMAL_DIAGNOSES)
+    recurring = recurring.sort_values(["nik", "recurring_years"], ascending=[True, False])
+    return recurring.drop_duplicates("nik").set_index("nik")
+
+
+def score_employees(conn, weights, now=None):
+    """
+    Score every employee in one vectorized pass. Returns a DataFrame with the
+    columns of employee_risk.
+    """
+    now = pd.Timestamp(now or datetime.now())
+    emp = pd.read_sql(
+        "SELECT nik, birth_date, position, mcu_expired, diagnosis FROM employee WHERE nik IS NOT NULL", conn
+    )
+    if emp.empty:
+        return pd.DataFrame(columns=["nik", "score", "recurring_diagnosis", "recurring_years", "age", "mcu_state", "reasons"])
+    emp = emp.join(_load_recurring(conn), on="nik")
+    recurring_years = pd.to_numeric(emp["recurring_years"]).fillna(0).astype(int).to_numpy()
+    recurring_points = weights["recurring_diagnosis"] * np.maximum(recurring_years - 1, 0)
+
+    current_finding = ~emp["diagnosis"].fillna("").astype(str).str.strip().str.lower().isin(NORMAL_DIAGNOSES).to_numpy()
+    finding_points = np.where(current_finding, weights["current_finding"], 0.0)
+
+    birth = pd.to_datetime(emp["birth_date"], errors="coerce")
+    age = ((now - birth).dt.days // 365).to_numpy()
+    age_points = np.zeros(len(emp))
+    band_label = np.full(len(emp), "", dtype=object)
+    # Bands ascending, so the highest band reached wins
+    for min_age, points in sorted(((int(k), float(v)) for k, v in weights["age_bands"].items())):
+        reached = age >= min_age
+        age_points = np.where(reached, points, age_points)
+        band_label = np.where(reached, f"Age {min_age}+; ", band_label)
+
+    expired_at = pd.to_datetime(emp["mcu_expired"], errors="coerce")
+    days_left = (expired_at - now).dt.days.to_numpy()
+    mcu_state = np.select(
+        [expired_at.isna().to_numpy(), days_left < 0, days_left <= WILL_EXPIRE_DAYS],
+        ["No MCU", "Expired", "Will Expire"],
+        default="Valid"
+    )
+    mcu_points = np.select(
+        [mcu_state == "No MCU", mcu_state == "Expired", mcu_state == "Will Expire"],
+        [weights["no_mcu"], weights["mcu_expired"], weights["mcu_will_expire"]],
+        default=0.0
+    )
+
+    position_points = emp["position"].map(weights["positions"]).fillna(0.0).astype(float).to_numpy()
+
+    score = recurring_points + finding_points + age_points + mcu_points + position_points
+    recurring_label = np.where(
+        recurring_points > 0,
+        "Recurring " + emp["recurring_diagnosis"].fillna("").astype(str) + " (" + recurring_years.astype(str) + " yrs); ",
+        ""
+    )
+    reasons = (
+        pd.Series(recurring_label, dtype=object)
+        + np.where(finding_points > 0, "Finding: " + emp["diagnosis"].fillna("").astype(str) + "; ", "")
+        + np.where(age_points > 0, band_label, "")
+        + np.where(mcu_points > 0, "MCU " + pd.Series(mcu_state, dtype=object) + "; ", "")
+        + np.where(position_points > 0, "Position: " + emp["position"].fillna("").astype(str) + "; ", "")
+    ).str.rstrip("; ")
+    return pd.DataFrame({
+        "nik": emp["nik"],
+        "score": np.round(score, 2),
+        "recurring_diagnosis": emp["recurring_diagnosis"].where(recurring_points > 0),
+        "recurring_years": recurring_years,
+        "age": pd.array(age, dtype="Int64"),
+        "mcu_state": mcu_state,
+        "reasons": reasons,
+    })
+
+
+def refresh_scores(weights=None):
+    """
+    Recompute all scores from the current replica snapshot and persist them
+    in one transaction. Returns the row count.
+    """
+    conn = get_connection()
+    try:
+        weights = weights or get_risk_weights(conn)
+        source, snapshot = mcu_replica.open_reader()
+        try:
+            scores = score_employees(source, weights)
+        finally:
+            source.close()
+        version = snapshot["write_version"]
+        rows = list(scores.astype(object).where(scores.notna(), None).itertuples(index=False, name=None))
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM employee_risk")
+        conn.executemany(
+            "INSERT INTO employee_risk (nik, score, recurring_diagnosis, recurring_years, age, mcu_state, reasons) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO risk_score_meta (id, write_version, weights_hash, score_date, computed_at, employees) "
+            "VALUES (1, ?, ?, ?, ?, ?)",
+            (version, _weights_hash(weights), datetime.now().date().isoformat(),
+             datetime.now().isoformat(timespec="seconds"), len(rows))
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    logging.info(f"Risk scores refreshed for {len(rows)} employee(s)")
+    return len(rows)
+
+
+_refresh_lock = threading.Lock()
+
+
+def get_score_meta(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        row = conn.execute(
+            "SELECT write_version, weights_hash, score_date, computed_at, employees FROM risk_score_meta WHERE id = 1"
+        ).fetchone()
+    finally:
+        if own_conn:
+            conn.close()
+    if not row:
+        return None
+    return dict(zip(["write_version", "weights_hash", "score_date", "computed_at", "employees"], row))
+
+
+def _stale_weights():
+    """
+    The current weights if employee_risk is out of date, else None.
+    """
+    conn = get_connection()
+    try:
+        weights = get_risk_weights(conn)
+        meta = get_score_meta(conn)
+    finally:
+        conn.close()
+    current = (mcu_replica.snapshot_info()["write_version"], _weights_hash(weights), datetime.now().date().isoformat())
+    if meta and (meta["write_version"], meta["weights_hash"], meta["score_date"]) == current:
+        return None
+    return weights
+
+
+def _refresh_if_stale():
+    with _refresh_lock:
+        weights = _stale_weights()
+        if weights is None:
+            return False
+        refresh_scores(weights)
+        return True
+
+
+def _refresh_in_background():
+    try:
+        _refresh_if_stale()
+    except Exception as e:
+        logging.error(f"Background risk scoring failed: {e}")
+
+
+def ensure_scores(wait=True):
+    """
+    Rebuild employee_risk if the replica moved to a newer write version, or
+    the weights or the date changed since the last run. Returns True when a
+    rebuild happened or was started.
+
+    With wait=False and existing scores, the rebuild runs on a daemon thread
+    and the caller keeps reading the previous scores (see get_score_meta for
+    their age) instead of blocking a page render on a full rescore.
+    """
+    if _stale_weights() is None:
+        return False
+    if wait or get_score_meta() is None:
+        return _refresh_if_stale()
+    if _refresh_lock.locked():
+        return True
+    threading.Thread(target=_refresh_in_background, daemon=True).start()
+    return True
+
+
+def top_at_risk(limit=20, employment_status=None, min_score=0.0):
+    """
+    The `limit` highest scores, read through idx_employee_risk_score.
+    """
+    sql = '''
+    SELECT r.nik, e.employee_name, e.position, e.employment_status, r.score, r.reasons,
+           r.recurring_diagnosis, r.age, r.mcu_state
+    FROM employee_risk r
+    JOIN employee e ON e.nik = r.nik
+    WHERE r.score > ?
+    '''
+    params = [float(min_score)]
+    if employment_status:
+        sql += " AND e.employment_status = ?"
+        params.append(employment_status)
+    sql += " ORDER BY r.score DESC LIMIT ?"
+    params.append(int(limit))
+    conn = get_connection()
+    try:
+        return pd.read_sql(sql, conn, params=params)
+    finally:
+        conn.close()
@@ -0,0 +1,380 @@
+"""
+Vendor clinic appointment scheduling for upcoming MCU renewals.
+
+Input:
+- employees due: Permanent employees whose mcu_expired falls within the
+  horizon (already expired ones included, marked "overdue")
+- schedule_clinic: each vendor clinic's daily capacity and the weekdays it
+  takes MCU appointments (0 = Monday)
+- schedule_blackout: dates a clinic (or, with clinic '', every clinic) is closed
+
+build_schedule() walks the calendar from the start date. An employee
+becomes bookable MCU_SCHEDULE_LEAD_DAYS before expiry (earlier renewals
+would waste part of the current MCU); every bookable employee sits in a
+min-heap keyed by deadline (the day before mcu_expired), and each day's
+open slots go to the earliest deadlines first (already expired employees,
+"overdue", have the earliest of all). Whoever passes their deadline
+without a slot moves to a second queue that only gets leftover capacity,
+so an overloaded week makes its own employees "late" instead of pushing
+everyone after them past expiry as plain earliest-deadline-first would.
+Employees still waiting MCU_SCHEDULE_MAX_LATE_DAYS after the horizon
+stay "unscheduled". The cost is one sort plus a heap push/pop per
+employee and a constant amount of work per (day, clinic), so 50k
+employees schedule in well under a second.
+
+Each run is stored in schedule_run/mcu_schedule (the last
+MCU_SCHEDULE_KEEP_RUNS are kept) and exported with schedule_to_excel()
+or `python mcu_jobs.py schedule-export`.
+"""
+import heapq
+import logging
+import os
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from io import BytesIO
+
+import pandas as pd
+
+from mcu_db import get_connection
+
+LEAD_DAYS = int(os.environ.get("MCU_SCHEDULE_LEAD_DAYS", "45"))
+MAX_LATE_DAYS = int(os.environ.get("MCU_SCHEDULE_MAX_LATE_DAYS", "30"))
+KEEP_RUNS = int(os.environ.get("MCU_SCHEDULE_KEEP_RUNS", "10"))
+DEFAULT_HORIZON_DAYS = 90
+DEFAULT_WEEKDAYS = "0,1,2,3,4"
+
+DUE_EMPLOYEES_SQL = '''
+SELECT nik, mcu_expired FROM employee
+WHERE employment_status = 'Permanent' AND COALESCE(mcu_expired, '') != ''
+  AND date(mcu_expired) <= date(?)
+'''
+
+
+def init_schedule_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schedule_clinic (
+        clinic TEXT PRIMARY KEY,
+        daily_capacity INTEGER NOT NULL,
+        weekdays TEXT NOT NULL DEFAULT '0,1,2,3,4',
+        enabled INTEGER DEFAULT 1
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schedule_blackout (
+        clinic TEXT NOT NULL DEFAULT '',
+        blackout_date TEXT NOT NULL,
+        reason TEXT,
+        PRIMARY KEY (clinic, blackout_date)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schedule_run (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        start_date TEXT NOT NULL,
+        horizon_days INTEGER NOT NULL,
+        due INTEGER NOT NULL,
+        scheduled INTEGER NOT NULL,
+        late INTEGER NOT NULL,
+        overdue INTEGER NOT NULL,
+        unscheduled INTEGER NOT NULL,
+        duration_ms REAL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS mcu_schedule (
+        run_id INTEGER NOT NULL,
+        nik TEXT NOT NULL,
+        clinic TEXT,
+        appointment_date TEXT,
+        slot INTEGER,
+        mcu_expired TEXT,
+        status TEXT NOT NULL,
+        PRIMARY KEY (run_id, nik)
+    ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+
+# ----------------- clinics and blackout dates
+
+def set_clinic(clinic, daily_capacity, weekdays=DEFAULT_WEEKDAYS, enabled=True):
+    """
+    Add or update a vendor clinic. `weekdays` is a list or comma string of
+    weekday numbers (0 = Monday) on which it takes appointments.
+    """
+    if not clinic:
+        raise ValueError("Clinic name is required")
+    if int(daily_capacity) < 1:
+        raise ValueError("Daily capacity must be at least 1")
+    if not isinstance(weekdays, str):
+        weekdays = ",".join(str(int(d)) for d in weekdays)
+    if not _parse_weekdays(weekdays):
+        raise ValueError("At least one weekday (0-6) is required")
+    conn = get_connection()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO schedule_clinic (clinic, daily_capacity, weekdays, enabled) VALUES (?, ?, ?, ?)",
+            (clinic, int(daily_capacity), weekdays, 1 if enabled else 0)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def remove_clinic(clinic):
+    conn = get_connection()
+    try:
+        removed = conn.execute("DELETE FROM schedule_clinic WHERE clinic = ?", (clinic,)).rowcount
+        conn.execute("DELETE FROM schedule_blackout WHERE clinic = ?", (clinic,))
+        conn.commit()
+    finally:
+        conn.close()
+    return removed
+
+
+def list_clinics(enabled_only=False):
+    conn = get_connection()
+    try:
+        query = "SELECT clinic, daily_capacity, weekdays, enabled FROM schedule_clinic"
+        if enabled_only:
+            query += " WHERE enabled = 1"
+        return pd.read_sql(query + " ORDER BY clinic", conn)
+    finally:
+        conn.close()
+
+
+def add_blackout(blackout_date, clinic="", reason=None):
+    """
+    Close `clinic` (default: every clinic) on `blackout_date` (date or ISO string).
+    """
+    blackout_date = _to_date(blackout_date).isoformat()
+    conn = get_connection()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO schedule_blackout (clinic, blackout_date, reason) VALUES (?, ?, ?)",
+            (clinic or "", blackout_date, reason)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def remove_blackout(blackout_date, clinic=""):
+    conn = get_connection()
+    try:
+        removed = conn.execute(
+            "DELETE FROM schedule_blackout WHERE clinic = ? AND blackout_date = ?",
+            (clinic or "", _to_date(blackout_date).isoformat())
+        ).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return removed
+
+
+def list_blackouts(since=None):
+    conn = get_connection()
+    try:
+        return pd.read_sql(
+            "SELECT blackout_date, clinic, reason FROM schedule_blackout WHERE blackout_date >= ? "
+            "ORDER BY blackout_date, clinic",
+            conn, params=[since or "0000-00-00"]
+        )
+    finally:
+        conn.close()
+
+
+# ----------------- assignment
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def _parse_weekdays(weekdays):
+    return {int(d) for d in str(weekdays).split(",") if d.strip().isdigit() and 0 <= int(d) <= 6}
+
+
+def assign_slots(people, clinics, blackouts, start, horizon_days, lead_days=LEAD_DAYS, max_late_days=MAX_LATE_DAYS):
+    """
+    Core scheduler, independent of the database.
+
+    people: iterable of (nik, mcu_expired date); clinics: iterable of
+    (clinic, daily_capacity, weekdays set); blackouts: set of (clinic, date),
+    clinic '' meaning every clinic. Returns one tuple per person:
+    (nik, clinic, appointment_date, slot, mcu_expired, status) with status
+    scheduled / late / overdue / unscheduled (clinic, date and slot None).
+    """
+    clinics = [(name, capacity, weekdays) for name, capacity, weekdays in clinics if capacity > 0 and weekdays]
+    last_day = start + timedelta(days=horizon_days + max_late_days)
+    # Release order: the day each person may first be booked
+    pending = sorted(
+        (max(start, expiry - timedelta(days=lead_days)), expiry - timedelta(days=1), nik, expiry)
+        for nik, expiry in people
+    )
+    heap = []
+    # Employees past their deadline without a slot; served from leftover capacity
+    missed = []
+    results = []
+    i = 0
+    day = start
+    while day <= last_day and (heap or missed or i < len(pending)):
+        if not heap and not missed:
+            # Nothing bookable yet: jump to the next release day
+            day = max(day, pending[i][0])
+            if day > last_day:
+                break
+        while i < len(pending) and pending[i][0] <= day:
+            _, deadline, nik, expiry = pending[i]
+            heapq.heappush(heap, (deadline, nik, expiry))
+            i += 1
+        while heap and heap[0][0] < day and heap[0][2] > start:
+            heapq.heappush(missed, heapq.heappop(heap))
+        if ("", day) not in blackouts:
+            weekday = day.weekday()
+            for clinic, capacity, weekdays in clinics:
+                if not heap and not missed:
+                    break
+                if weekday not in weekdays or (clinic, day) in blackouts:
+                    continue
+                for slot in range(1, capacity + 1):
+                    if not heap and not missed:
+                        break
+                    deadline, nik, expiry = heapq.heappop(heap or missed)
+                    if expiry <= start:
+                        status = "overdue"
+                    elif day > deadline:
+                        status = "late"
+                    else:
+                        status = "scheduled"
+                    results.append((nik, clinic, day, slot, expiry, status))
+        day += timedelta(days=1)
+    for _, nik, expiry in heap + missed:
+        results.append((nik, None, None, None, expiry, "unscheduled"))
+    for _, _, nik, expiry in pending[i:]:
+        results.append((nik, None, None, None, expiry, "unscheduled"))
+    return results
+
+
+def build_schedule(start=None, horizon_days=DEFAULT_HORIZON_DAYS, lead_days=LEAD_DAYS, max_late_days=MAX_LATE_DAYS):
+    """
+    Schedule every employee due by start + horizon_days over the enabled
+    clinics and store the result as a new run. Returns the run summary
+    (run_id, due, scheduled, late, overdue, unscheduled, duration_ms).
+    """
+    started = time.perf_counter()
+    start = _to_date(start) if start else date.today()
+    horizon_end = start + timedelta(days=horizon_days)
+    conn = get_connection()
+    try:
+        people = []
+        for nik, mcu_expired in conn.execute(DUE_EMPLOYEES_SQL, (horizon_end.isoformat(),)):
+            try:
+                people.append((nik, _to_date(mcu_expired)))
+            except ValueError:
+                logging.warning(f"Skipping {nik} in MCU schedule: invalid mcu_expired {mcu_expired!r}")
+        clinics = [
+            (clinic, capacity, _parse_weekdays(weekdays))
+            for clinic, capacity, weekdays in conn.execute(
+                "SELECT clinic, daily_capacity, weekdays FROM schedule_clinic WHERE enabled = 1 ORDER BY clinic"
+            )
+        ]
+        blackouts = {
+            (clinic, _to_date(blackout_date))
+            for clinic, blackout_date in conn.execute(
+                "SELECT clinic, blackout_date FROM schedule_blackout WHERE blackout_date >= ?", (start.isoformat(),)
+            )
+        }
+        assignments = assign_slots(people, clinics, blackouts, start, horizon_days, lead_days, max_late_days)
+        counts = Counter(status for *_, status in assignments)
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        conn.execute("BEGIN IMMEDIATE")
+        run_id = conn.execute(
+            "INSERT INTO schedule_run (created_at, start_date, horizon_days, due, scheduled, late, overdue, "
+            "unscheduled, duration_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (datetime.now().isoformat(timespec="seconds"), start.isoformat(), horizon_days, len(assignments),
+             counts["scheduled"], counts["late"], counts["overdue"], counts["unscheduled"], duration_ms)
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO mcu_schedule (run_id, nik, clinic, appointment_date, slot, mcu_expired, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, nik, clinic, day.isoformat() if day else None, slot, expiry.isoformat(), status)
+             for nik, clinic, day, slot, expiry, status in assignments]
+        )
+        # Keep the last KEEP_RUNS runs
+        conn.execute("DELETE FROM mcu_schedule WHERE run_id <= ?", (run_id - KEEP_RUNS,))
+        conn.execute("DELETE FROM schedule_run WHERE run_id <= ?", (run_id - KEEP_RUNS,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    summary = {"run_id": run_id, "due": len(assignments), "scheduled": counts["scheduled"], "late": counts["late"],
+               "overdue": counts["overdue"], "unscheduled": counts["unscheduled"], "duration_ms": duration_ms}
+    logging.info(f"MCU schedule run {run_id}: {len(assignments)} due, {counts['unscheduled']} unscheduled",
+                 extra={"operation": "schedule_build", "rows": len(assignments), "duration_ms": duration_ms})
+    return summary
+
+
+# ----------------- results
+
+def latest_run():
+    """
+    The newest schedule_run row as a dict, or None.
+    """
+    conn = get_connection()
+    try:
+        conn.row_factory = lambda cursor, row: {col[0]: value for col, value in zip(cursor.description, row)}
+        return conn.execute("SELECT * FROM schedule_run ORDER BY run_id DESC LIMIT 1").fetchone()
+    finally:
+        conn.close()
+
+
+def load_schedule(run_id=None):
+    """
+    One run's appointments (default: the latest) with employee details,
+    ordered by date, clinic and slot; unscheduled employees last.
+    """
+    conn = get_connection()
+    try:
+        if run_id is None:
+            row = conn.execute("SELECT MAX(run_id) FROM schedule_run").fetchone()
+            run_id = row[0] if row else None
+        return pd.read_sql('''
+        SELECT s.appointment_date, s.clinic, s.slot, s.nik, e.employee_name, e.position, e.email,
+               s.mcu_expired, s.status
+        FROM mcu_schedule s LEFT JOIN employee e ON e.nik = s.nik
+        WHERE s.run_id = ?
+        ORDER BY s.appointment_date IS NULL, s.appointment_date, s.clinic, s.slot, s.mcu_expired
+        ''', conn, params=[run_id])
+    finally:
+        conn.close()
+
+
+def schedule_to_excel(df_schedule):
+    """
+    Schedule export (xlsx bytes): the appointment list and a clinic x date
+    count sheet for the vendor.
+    """
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df_schedule.to_excel(writer, index=False, sheet_name="Schedule")
+        booked = df_schedule.dropna(subset=["appointment_date"])
+        if not booked.empty:
+            per_clinic = booked.pivot_table(index="appointment_date", columns="clinic", values="nik",
+                                            aggfunc="count", fill_value=0)
+            per_clinic["Total"] = per_clinic.sum(axis=1)
+            per_clinic.to_excel(writer, sheet_name="Per Clinic")
+        header_format = writer.book.add_format({"bold": True, "fg_color": "#D7E4BC", "border": 1})
+        worksheet = writer.sheets["Schedule"]
+        for col_num, value in enumerate(df_schedule.columns.values):
+            worksheet.write(0, col_num, value, header_format)
+            worksheet.set_column(col_num, col_num, max(12, len(str(value)) + 2))
+    return output.getvalue()
@@ -0,0 +1,225 @@
+"""
+Multi-site federation: consolidated views over several site databases.
+
+Each project site runs its own dashboard with its own mcu_database.db. Head
+office registers those databases (a mounted volume, a synced copy or a
+backup snapshot) in site_registry and reads them here. Sites are queried in
+parallel, each over its own read-only connection, and the results are
+concatenated in Python with a leading `site` column. ATTACH was not used:
+SQLite limits a connection to 10 attached databases by default and one
+locked or missing site would fail the whole statement.
+
+Results are cached per (site, query, params) and keyed on that site's data
+version (its write_version counter, or the database file's mtime/size for
+sites on an older schema), so a consolidated view only re-reads the sites
+that changed since the last render.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+
+from mcu_db import get_connection
+
+SITE_WORKERS = int(os.environ.get("MCU_SITE_WORKERS", "8"))
+SITE_CACHE_ENTRIES = 512
+SITE_TIMEOUT = 5
+SEARCH_LIMIT_PER_SITE = 50
+
+
+def init_site_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS site_registry (
+        site TEXT PRIMARY KEY,
+        db_path TEXT NOT NULL,
+        upload_dir TEXT,
+        enabled INTEGER DEFAULT 1,
+        registered_at TEXT
+    )
+    ''')
+    conn.commit()
+
+
+def register_site(site, db_path, upload_dir=None):
+    if not os.path.exists(db_path):
+        raise ValueError(f"Database for site {site} not found: {db_path}")
+    conn = get_connection()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO site_registry (site, db_path, upload_dir, enabled, registered_at) VALUES (?, ?, ?, 1, ?)",
+            (site, os.path.abspath(db_path), os.path.abspath(upload_dir) if upload_dir else None,
+             datetime.now().isoformat(timespec="seconds"))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def remove_site(site):
+    conn = get_connection()
+    try:
+        removed = conn.execute("DELETE FROM site_registry WHERE site = ?", (site,)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    _forget_site(site)
+    return removed
+
+
+def list_sites(enabled_only=True):
+    conn = get_connection()
+    try:
+        query = "SELECT site, db_path, upload_dir, enabled, registered_at FROM site_registry"
+        if enabled_only:
+            query += " WHERE enabled = 1"
+        return pd.read_sql(query + " ORDER BY site", conn)
+    finally:
+        conn.close()
+
+
+def _connect_site(db_path):
+    # Read-only: head office must never write into a site database
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=SITE_TIMEOUT)
+
+
+def _site_version(conn, db_path):
+    try:
+        row = conn.execute("SELECT version FROM write_version WHERE id = 1").fetchone()
+        if row:
+            return ("wv", row[0])
+    except sqlite3.OperationalError:
+        pass
+    # Older site schema without the write_version counter
+    signature = []
+    for path in (db_path, db_path + "-wal"):
+        if os.path.exists(path):
+            st_ = os.stat(path)
+            signature.append((st_.st_mtime_ns, st_.st_size))
+    return ("stat", tuple(signature))
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _forget_site(site):
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] == site]:
+            del _cache[key]
+
+
+def _site_query(site, db_path, sql, params):
+    conn = _connect_site(db_path)
+    try:
+        version = _site_version(conn, db_path)
+        key = (site, sql, tuple(params))
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached and cached[0] == version:
+                _cache.move_to_end(key)
+                return cached[1]
+        df = pd.read_sql(sql, conn, params=list(params))
+    finally:
+        conn.close()
+    df.insert(0, "site", site)
+    with _cache_lock:
+        _cache[key] = (version, df)
+        _cache.move_to_end(key)
+        while len(_cache) > SITE_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return df
+
+
+def federated_query(sql, params=(), sites=None):
+    """
+    Run one read query on every registered site in parallel.
+    Returns (DataFrame with a leading `site` column, {site: error}) so one
+    unreachable site does not hide the others.
+    """
+    registry = list_sites()
+    if sites is not None:
+        registry = registry[registry["site"].isin(sites)]
+    if registry.empty:
+        return pd.DataFrame(), {}
+    frames, errors = [], {}
+
+    def _run(item):
+        site, db_path = item
+        try:
+            return site, _site_query(site, db_path, sql, params), None
+        except Exception as e:
+            return site, None, str(e)
+
+    items = list(registry[["site", "db_path"]].itertuples(index=False, name=None))
+    with ThreadPoolExecutor(max_workers=max(1, min(SITE_WORKERS, len(items)))) as pool:
+        for site, df, error in pool.map(_run, items):
+            if error is not None:
+                errors[site] = error
+                logging.error(f"Federated query failed for site {site}: {error}")
+            elif not df.empty:
+                frames.append(df)
+    result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return result, errors
+
+
+def status_summary(sites=None):
+    """
+    Employees per (site, status, employment_status), the consolidated
+    counterpart of the Dashboard MCU metrics.
+    """
+    return federated_query(
+        "SELECT status, employment_status, COUNT(*) AS employees FROM employee GROUP BY status, employment_status",
+        sites=sites
+    )
+
+
+def search_employees(query, limit_per_site=SEARCH_LIMIT_PER_SITE, sites=None):
+    """
+    NIK / name search across sites, at most `limit_per_site` rows per site.
+    """
+    pattern = f"%{query}%"
+    return federated_query(
+        "SELECT nik, employee_name, position, employment_status, status, mcu_date, mcu_expired, diagnosis "
+        "FROM employee WHERE nik LIKE ? OR employee_name LIKE ? ORDER BY employee_name LIMIT ?",
+        (pattern, pattern, int(limit_per_site)), sites=sites
+    )
+
+
+def filtered_employees(position="All", status="All", employment_status="All", sites=None):
+    """
+    Same filters as the vendor export (mcu_export.load_filtered_employees), across sites.
+    """
+    sql = ("SELECT nik, employee_name, position, employment_status, status, mcu_date, mcu_expired, "
+           "diagnosis, recommendation FROM employee WHERE 1=1")
+    params = []
+    for column, value in (("position", position), ("status", status), ("employment_status", employment_status)):
+        if value != "All":
+            sql += f" AND {column} = ?"
+            params.append(value)
+    return federated_query(sql + " ORDER BY id", params, sites=sites)
+
+
+def build_consolidated_workbook(df_emp, summary):
+    """
+    Consolidated export (xlsx bytes): one employee sheet with the site
+    column first and a per-site status summary.
+    """
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df_emp.to_excel(writer, index=False, sheet_name="Employees")
+        if not summary.empty:
+            pivot = summary.pivot_table(index="site", columns="status", values="employees", aggfunc="sum", fill_value=0)
+            pivot["Total"] = pivot.sum(axis=1)
+            pivot.to_excel(writer, sheet_name="Summary")
+        header_format = writer.book.add_format({"bold": True, "fg_color": "#D7E4BC", "border": 1})
+        worksheet = writer.sheets["Employees"]
+        for col_num, value in enumerate(df_emp.columns.values):
+            worksheet.write(0, col_num, value, header_format)
+            worksheet.set_column(col_num, col_num, max(12, len(str(value)) + 2))
+    return output.getvalue()